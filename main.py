@@ -15,6 +15,8 @@ from routes import authentication, deepgram_transcriber
 from routes import (chat, suggested_questions, text_to_speech,
                     conversations, admin_analytics, feedback, admin_chat)
 from utils import db
+from utils.admin_helper import admin_set
+from utils.browser_pool import browser_pool
 
 OTEL_RESOURCE_ATTRIBUTES = {
     "service.instance.id": str(uuid.uuid1()),
@@ -38,8 +40,18 @@ HTTPXClientInstrumentor().instrument()
 async def lifespan(_app: FastAPI):
     try:
         await db.pool.open()
+        # Load the admins, and keep them up to date
+        await admin_set.start()
+        # Warm up the browsers, so the first login doesn't wait for them
+        try:
+            await browser_pool.start()
+        except Exception as e:
+            # They're launched again when needed
+            print("Failed to start the browser pool:", e)
         yield
     finally:
+        await browser_pool.close()
+        await admin_set.close()
         await db.pool.close()
 
 
@@ -6,8 +6,7 @@ from typing import Union, Annotated
 import httpx
 from fastapi import APIRouter, HTTPException, Depends
 
-from routes.authentication import AuthenticatedUser, get_current_user
-from utils.db import pool
+from routes.authentication import AuthenticatedUser, require_admin
 
 router = APIRouter()
 
@@ -57,21 +56,8 @@ async def run_query(nrql_query: str) -> list[dict]:
 @router.get("/admin/query")
 async def get_query_id(current_user: Annotated[
     Union[AuthenticatedUser],
-    Depends(get_current_user)
+    Depends(require_admin)
 ]):
-    # Check if the user is an admin
-    async with pool.connection() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute(
-                "SELECT 1 FROM admins WHERE username = %s",
-                (current_user.username,)
-            )
-
-            is_admin = (await cur.fetchone()) is not None
-
-            if not is_admin:
-                raise HTTPException(status_code=403, detail="You are not an admin")
-
     # User is admin
 
     # Run the queries and create a list of async tasks
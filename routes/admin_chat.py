@@ -5,9 +5,9 @@ from psycopg.rows import dict_row
 from pydantic import BaseModel
 from sse_starlette import EventSourceResponse
 
-from routes.authentication import get_current_user, AuthenticatedUser
+from routes.authentication import require_admin, AuthenticatedUser
 from utils.db import pool
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends
 import anthropic
 
 from utils.models import ConversationMessage
@@ -58,7 +58,7 @@ async def ask_claude(question, query_results):
 # A route for admin to send a question to Claude
 @router.post("/admin_chat")
 async def admin_chat(question: Question,
-                     admin: AuthenticatedUser = Depends(get_current_user)):
+                     admin: AuthenticatedUser = Depends(require_admin)):
     messages = []
     for message in question.previous_messages:
         if message.role not in __allowed_roles:
@@ -67,17 +67,6 @@ async def admin_chat(question: Question,
 
     async with pool.connection() as conn:
         async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute("SELECT 1 FROM admins WHERE username = %s",
-                              (admin.username,))
-            # Check if the user is an admin
-            is_admin = (await cur.fetchone()) is not None
-
-            # If the user is not an admin, raise an error
-            if not is_admin:
-                raise HTTPException(
-                    status_code=403,
-                    detail="You don't have permission to access the database")
-
             # Get the data needed from the database
             await cur.execute(
                 """
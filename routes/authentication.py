@@ -1,6 +1,9 @@
+import hashlib
 import os
-from datetime import datetime, timedelta
-from typing import Union
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Union
 
 from fastapi import APIRouter, Depends
 from fastapi import HTTPException, status
@@ -8,12 +11,16 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from pydantic import BaseModel
 
-from utils.auth_helper import login, UniCredentials, BadCredentialsException
-from utils.db import pool
+from utils.admin_helper import admin_set
+from utils.auth_helper import login, UniCredentials, BadCredentialsException, \
+    LoginThrottledException
+from utils.session_store import create_session, load_cookies
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Tokens already verified, so repeated requests skip the signature check
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 1024))
 
 # Check if SECRET_KEY is set
 # You can generate one with: openssl rand -hex 32
@@ -37,19 +44,64 @@ def create_access_token(data: dict):
     return encoded_jwt
 
 
+# Hash of the token -> the verified payload, least recently used first
+token_cache: OrderedDict[str, dict] = OrderedDict()
+
+
+def verify_token(token: str) -> Optional[dict]:
+    """
+    Verify a JWT token, tokens seen before are looked up in memory
+    :return: the payload, or None if the token is invalid or expired
+    """
+    # The token itself isn't kept in memory
+    key = hashlib.sha256(token.encode()).hexdigest()
+
+    payload = token_cache.get(key)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            # Someone is tampering with the token
+            return None
+
+        # Check if the jwt contains a username
+        # Even though it's technically impossible
+        # Due to the JWT signing
+        if payload.get("sub") is None or payload.get("exp") is None:
+            return None
+
+    # Check if the token expired, cached tokens expire with it
+    if payload.get("exp") < time.time():
+        token_cache.pop(key, None)
+        return None
+
+    token_cache[key] = payload
+    token_cache.move_to_end(key)
+    while len(token_cache) > TOKEN_CACHE_SIZE:
+        token_cache.popitem(last=False)
+
+    return payload
+
+
 @router.post("/token", response_model=Token)
 async def login_for_access_token(credentials: UniCredentials):
     try:
         # Login ang get cookies
         cookies = await login(credentials)
-        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        username = credentials.username.lower()
+        expire = datetime.now(timezone.utc) + timedelta(
+            minutes=ACCESS_TOKEN_EXPIRE_MINUTES
+        )
 
-        # Create a JWT token with the username, expiration time and cookies
+        # The cookies are kept on the server, the token only has the session id
+        session_id = await create_session(username, cookies, int(expire.timestamp()))
+
+        # Create a JWT token with the username, expiration time and session
         access_token = create_access_token(
             data={
-                "sub": credentials.username.lower(),
-                "exp": datetime.utcnow() + access_token_expires,
-                "cookies": cookies,
+                "sub": username,
+                "exp": expire,
+                "sid": session_id,
             },
         )
 
@@ -64,6 +116,13 @@ async def login_for_access_token(credentials: UniCredentials):
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    except LoginThrottledException as e:
+        # throw 429 if the username failed to login too many times
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
 
 
 @router.get("/session")
@@ -77,44 +136,39 @@ async def session(token: str = Depends(oauth2_scheme)):
     if not token:
         raise credentials_exception
 
-    try:
-        # Decode the JWT token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-
-        # Check if the jwt contains a username
-        # Even though it's technically impossible
-        # Due to the JWT signing
-        if username is None:
-            raise credentials_exception
-
-        # Check if the token expired
-        if payload.get("exp") < datetime.utcnow().timestamp():
-            raise credentials_exception
-
-        async with pool.connection() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute("SELECT 1 FROM admins "
-                                  "WHERE username = %s",
-                                  (username,))
-                is_admin = (await cur.fetchone()) is not None
+    payload = verify_token(token)
 
-        return {
-            "admin": is_admin,
-            "valid": True,
-            # We just check if it's < 5 minutes from expiring
-            "needs_refresh": payload.get("exp") < (
-                    datetime.utcnow() + timedelta(minutes=5)
-            ).timestamp()
-        }
-    except JWTError:
-        # Someone is tampering with the token
+    if payload is None:
         raise credentials_exception
 
+    return {
+        "admin": await admin_set.is_admin(payload["sub"]),
+        "valid": True,
+        # We just check if it's < 5 minutes from expiring
+        "needs_refresh": payload.get("exp") < (
+                datetime.utcnow() + timedelta(minutes=5)
+        ).timestamp()
+    }
+
 
 class AuthenticatedUser(BaseModel):
     username: str
-    cookies: dict
+    session_id: Optional[str] = None
+    # Tokens issued before the session store carry the cookies themselves
+    cookies: Optional[dict] = None
+
+    async def get_cookies(self) -> dict:
+        """
+        Load the university cookies of the user, only the tools which
+        browse the university services need them
+        """
+        if self.cookies is None and self.session_id is not None:
+            self.cookies = await load_cookies(self.session_id)
+
+        if self.cookies is None:
+            raise Exception("Session expired, please log in again")
+
+        return self.cookies
 
 
 async def get_current_user_optional(
@@ -129,26 +183,17 @@ async def get_current_user_optional(
     if token is None:
         return None
 
-    try:
-        # Decode the JWT token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
+    payload = verify_token(token)
 
-        # Check if the jwt contains a username
-        # Even though it's technically impossible
-        # Due to the JWT signing
-        if username is None:
-            raise credentials_exception
-
-        # Check if the token expired
-        if payload.get("exp") < datetime.utcnow().timestamp():
-            raise credentials_exception
-
-        return AuthenticatedUser(username=username, cookies=payload.get("cookies"))
-    except JWTError:
-        # Someone is tampering with the token
+    if payload is None:
         raise credentials_exception
 
+    return AuthenticatedUser(
+        username=payload["sub"],
+        session_id=payload.get("sid"),
+        cookies=payload.get("cookies"),
+    )
+
 
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> AuthenticatedUser:
     credentials_exception = HTTPException(
@@ -163,3 +208,13 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> Authenticated
         raise credentials_exception
 
     return user
+
+
+async def require_admin(
+        user: AuthenticatedUser = Depends(get_current_user)
+) -> AuthenticatedUser:
+    # The admins are kept in memory, so this doesn't query the database
+    if not await admin_set.is_admin(user.username):
+        raise HTTPException(status_code=403, detail="You are not an admin")
+
+    return user
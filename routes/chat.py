@@ -332,13 +332,13 @@ async def chat(
                                 case "get_timetable":
                                     result = await timetable_tool.get_timetable(
                                         current_user.username,
-                                        current_user.cookies
+                                        current_user.get_cookies
                                     )
                                 case "get_learning_central_stream":
                                     result = await learning_central_tool \
                                         .get_learning_central_stream(
                                         current_user.username,
-                                        current_user.cookies
+                                        current_user.get_cookies
                                     )
 
                                 case _:
@@ -0,0 +1,203 @@
+import asyncio
+import math
+import os
+import random
+import statistics
+import time
+
+from dotenv import load_dotenv
+from qdrant_client import AsyncQdrantClient, models
+
+from utils.vector_store_helper import FULL_EMBED_DIMENSIONS, QUANTIZATION_MODES, \
+    vectors_config, quantization_config, search_params
+
+# Dimensions to compare, text-embedding-3 models support shortening the embedding
+DIMENSIONS = [3072, 1536, 1024, 512, 256]
+
+# Number of points copied from the intranet collection and indexed, and the number
+# of other points used as queries
+SAMPLE_SIZE = 5000
+QUERY_COUNT = 100
+TOP_K = 10
+
+
+def shorten(vector: list[float], dimensions: int) -> list[float]:
+    """
+    Shorten a text-embedding-3 vector, this is equivalent to asking
+    the API for fewer dimensions: truncate, then normalise again
+    """
+    vector = vector[:dimensions]
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector]
+
+
+def vector_memory(count: int, dimensions: int, quantization: str) -> int:
+    """
+    Estimate the RAM used by the vectors of a collection, in bytes.
+    Quantized collections keep the original vectors on disk
+    """
+    match quantization:
+        case "scalar":
+            return count * dimensions
+        case "binary":
+            return count * math.ceil(dimensions / 8)
+        case _:
+            return count * dimensions * 4
+
+
+async def sample_points(aclient: AsyncQdrantClient) -> list[list[float]]:
+    """
+    Copy a sample of vectors from the intranet collection,
+    so the benchmark doesn't need to embed anything
+    """
+    vectors = []
+    offset = None
+
+    while len(vectors) < SAMPLE_SIZE + QUERY_COUNT:
+        points, offset = await aclient.scroll(
+            "intranet",
+            limit=256,
+            offset=offset,
+            with_payload=False,
+            with_vectors=True,
+        )
+        vectors.extend(point.vector for point in points)
+        if offset is None:
+            break
+
+    return vectors[:SAMPLE_SIZE + QUERY_COUNT]
+
+
+async def exact_top_k(
+        aclient: AsyncQdrantClient,
+        collection_name: str,
+        queries: list[list[float]]
+) -> list[set]:
+    """
+    Find the true nearest neighbours, used as the ground truth for recall
+    """
+    truth = []
+    for query in queries:
+        response = await aclient.query_points(
+            collection_name,
+            query=query,
+            limit=TOP_K,
+            search_params=models.SearchParams(exact=True),
+        )
+        truth.append({point.id for point in response.points})
+    return truth
+
+
+async def benchmark_setting(
+        aclient: AsyncQdrantClient,
+        vectors: list[list[float]],
+        queries: list[list[float]],
+        truth: list[set],
+        dimensions: int,
+        quantization: str
+) -> dict:
+    collection_name = f"intranet_benchmark_{dimensions}_{quantization}"
+
+    await aclient.delete_collection(collection_name)
+    await aclient.create_collection(
+        collection_name,
+        vectors_config=vectors_config(dimensions, quantization),
+        quantization_config=quantization_config(quantization),
+    )
+
+    try:
+        await aclient.upload_points(
+            collection_name,
+            points=[
+                models.PointStruct(id=i, vector=shorten(vector, dimensions))
+                for i, vector in enumerate(vectors)
+            ],
+            wait=True,
+        )
+
+        params = search_params(quantization)
+
+        latencies = []
+        recalls = []
+
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            response = await aclient.query_points(
+                collection_name,
+                query=shorten(query, dimensions),
+                limit=TOP_K,
+                search_params=params,
+            )
+            latencies.append((time.perf_counter() - start) * 1000)
+
+            found = {point.id for point in response.points}
+            recalls.append(len(found & expected) / TOP_K)
+
+        return {
+            "dimensions": dimensions,
+            "quantization": quantization,
+            "recall": statistics.mean(recalls),
+            "p50_ms": statistics.median(latencies),
+            "p95_ms": statistics.quantiles(latencies, n=20)[-1],
+            "memory_mb": vector_memory(len(vectors), dimensions, quantization) / 1e6,
+        }
+    finally:
+        await aclient.delete_collection(collection_name)
+
+
+async def main():
+    aclient = AsyncQdrantClient(
+        url=os.environ.get("QDRANT_URL"),
+        api_key=os.environ.get("QDRANT_API_KEY")
+    )
+
+    vectors = await sample_points(aclient)
+
+    if len(vectors) <= QUERY_COUNT:
+        raise Exception(f"The intranet collection needs more than {QUERY_COUNT} "
+                        f"points, it has {len(vectors)}")
+    if len(vectors[0]) != FULL_EMBED_DIMENSIONS:
+        raise Exception("The intranet collection needs full dimension vectors")
+
+    # Use some of the stored chunks as queries, they aren't indexed,
+    # otherwise each query would find itself
+    random.Random(0).shuffle(vectors)
+    queries, vectors = vectors[:QUERY_COUNT], vectors[QUERY_COUNT:]
+
+    # Ground truth is the exact search over the full vectors
+    await aclient.delete_collection("intranet_benchmark_truth")
+    await aclient.create_collection(
+        "intranet_benchmark_truth",
+        vectors_config=vectors_config(FULL_EMBED_DIMENSIONS, "none"),
+    )
+    try:
+        await aclient.upload_points(
+            "intranet_benchmark_truth",
+            points=[
+                models.PointStruct(id=i, vector=vector)
+                for i, vector in enumerate(vectors)
+            ],
+            wait=True,
+        )
+        truth = await exact_top_k(aclient, "intranet_benchmark_truth", queries)
+    finally:
+        await aclient.delete_collection("intranet_benchmark_truth")
+
+    print(f"{len(vectors)} vectors, {len(queries)} queries, recall@{TOP_K}")
+    print(f"{'dims':>6} {'quantization':>12} {'recall':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'memory MB':>10}")
+
+    for dimensions in DIMENSIONS:
+        for quantization in QUANTIZATION_MODES:
+            result = await benchmark_setting(
+                aclient, vectors, queries, truth, dimensions, quantization
+            )
+            print(f"{result['dimensions']:>6} {result['quantization']:>12} "
+                  f"{result['recall']:>8.3f} {result['p50_ms']:>8.2f} "
+                  f"{result['p95_ms']:>8.2f} {result['memory_mb']:>10.1f}")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+
+    asyncio.run(main())
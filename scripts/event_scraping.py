@@ -1,18 +1,26 @@
 # Import necessary modules
-import asyncio
-import os
+import re
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Optional
 
 import httpx  # Async HTTP client library
 from bs4 import BeautifulSoup  # Module for web scraping
-from dotenv import load_dotenv
-from llama_index.core import VectorStoreIndex, Document
-from llama_index.core.ingestion import IngestionPipeline
-from llama_index.core.node_parser import SentenceSplitter
-from llama_index.embeddings.openai import OpenAIEmbedding
-from llama_index.vector_stores.qdrant import QdrantVectorStore
+from llama_index.core import Document
 # Base class for creating Pydantic models
 from pydantic import BaseModel
-from qdrant_client import AsyncQdrantClient
+from qdrant_client import AsyncQdrantClient, models
+
+from utils.ingestion_helper import CONTENT_HASH_KEY, IngestionReport, \
+    apply_changes, delete_documents, stable_document
+from utils.vector_store_helper import stored_documents, LLMTextQdrantVectorStore
+
+# Payload field with the date of the event as YYYY-MM-DD, which sorts by date
+DATE_KEY = "start_date"
+EVENT_KEYS = [CONTENT_HASH_KEY, DATE_KEY]
+
+# Formats of the event day headings, e.g. "Tuesday 14th May"
+DATE_FORMATS = ["%A %d %B", "%a %d %B", "%A %d %b", "%a %d %b", "%d %B", "%d %b"]
 
 
 class EventModel(BaseModel):
@@ -84,60 +92,129 @@ async def scrape_events(soc_event_url):
     return events_data
 
 
-async def main():
-    events_result = await scrape_events("https://www.cardiffstudents.com/activities/societies/events/")
+def event_date(day: str, today: date) -> Optional[date]:
+    """
+    Parse the heading of an event day, e.g. "Tuesday 14th May".
+    The listing only has upcoming events, so a date without a year
+    is the next one from today.
+    :return: the date, or None if the heading can't be parsed
+    """
+    text = " ".join(day.replace(",", " ").split())
+
+    if text.lower() == "today":
+        return today
+    if text.lower() == "tomorrow":
+        return today + timedelta(days=1)
+
+    # Remove the ordinal suffixes, "14th" is "14"
+    text = re.sub(r"(\d+)(st|nd|rd|th)\b", r"\1", text)
+
+    # Headings with a year
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, f"{date_format} %Y").date()
+        except ValueError:
+            pass
+
+    for date_format in DATE_FORMATS:
+        try:
+            # Parsed with the year, so the 29th of February is valid
+            parsed = datetime.strptime(f"{text} {today.year}",
+                                       f"{date_format} %Y").date()
+        except ValueError:
+            continue
+
+        # A date more than a month ago is next year's
+        if parsed < today - timedelta(days=31):
+            parsed = parsed.replace(year=today.year + 1)
+        return parsed
+
+    return None
+
+
+def event_id(event: EventModel, start_date: Optional[date] = None) -> str:
+    """
+    Stable id of the event, the same event has the same id on every run
+    :param start_date: the parsed date of the event, the heading is used
+    if it couldn't be parsed, "Tomorrow" is a different day on every run
+    """
+    day = start_date.isoformat() if start_date else event.date
+    key = "|".join([event.organisation, event.name, day, event.time])
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, key))
+
+
+def event_documents(
+        events: list[EventModel],
+        today: Optional[date] = None,
+) -> list[Document]:
+    today = today or date.today()
+
+    # Create Document objects for each event
     documents = []
-    for event in events_result:
+    for event in events:
         doc = Document(text=event.organisation,
                        metadata={"date": event.date,
                                  "description": event.description,
                                  "name": event.name, "time": event.time,
                                  "location": event.location})
-        documents.append(doc)
-
-    # Initialise embedding model
-    embed_model = OpenAIEmbedding(model="text-embedding-3-large")
-    splitter = SentenceSplitter(chunk_size=1024, chunk_overlap=20)
-    embed_model.embed_batch_size = 50
 
-    # Create Qdrant clients
-    aclient = AsyncQdrantClient(
-        url=os.environ.get("QDRANT_URL"),
-        api_key=os.environ.get("QDRANT_API_KEY")
+        start_date = event_date(event.date, today)
+        if start_date:
+            doc.metadata[DATE_KEY] = start_date.isoformat()
+            # Already in the LLM text as the date shown on the website
+            doc.excluded_embed_metadata_keys.append(DATE_KEY)
+            doc.excluded_llm_metadata_keys.append(DATE_KEY)
+        else:
+            print("Couldn't parse the date of the event:", event.date)
+
+        # Any change to the event, not only the organisation, is re-embedded
+        documents.append(stable_document(doc, event_id(event, start_date),
+                                         event.model_dump_json()))
+    return documents
+
+
+def is_past(payload: dict, today: date) -> bool:
+    # ISO dates compare in date order
+    return DATE_KEY in payload and payload[DATE_KEY] < today.isoformat()
+
+
+async def plan_events(
+        aclient: AsyncQdrantClient,
+        store: LLMTextQdrantVectorStore,
+        events: list[EventModel],
+        today: Optional[date] = None,
+) -> tuple[list[Document], IngestionReport]:
+    """
+    Compare the scraped events with the events collection.
+    Past events and the old versions of changed events are removed.
+    :param aclient: the Qdrant client
+    :param store: the vector store of the events collection
+    :param events: the events scraped from the website
+    :param today: the current date, events before it are removed
+    :return: the new and changed events to embed,
+    and the counts of added, updated, skipped and deleted events
+    """
+    today = today or date.today()
+
+    stored = await stored_documents(aclient, store.collection_name, EVENT_KEYS)
+    documents = [document for document in event_documents(events, today)
+                 if not is_past(document.metadata, today)]
+
+    # Events which aren't listed anymore are kept until they're past,
+    # the listing can be paginated
+    documents, report = await apply_changes(
+        store, documents, stored, delete_missing=False
     )
-
-    # Create Qdrant vector store
-    store = QdrantVectorStore("events", aclient=aclient)
-
-    # Define ingestion pipeline
-    pipeline = IngestionPipeline(
-        transformations=[splitter, embed_model],
-        vector_store=store
+    report.deleted = await delete_documents(
+        store, [doc_id for doc_id, payload in stored.items()
+                if is_past(payload, today)]
     )
 
-    # Ingest documents into Qdrant
-    await pipeline.arun(show_progress=True, documents=documents)
-
-    # Create index from vector store
-    index = VectorStoreIndex.from_vector_store(vector_store=store,
-                                               embed_model=embed_model,
-                                               use_async=True)
+    return documents, report
 
-    # Create retriever from index
-    retriever = index.as_retriever(similarity_top_k=3)
 
-    # Perform retrieval query
-    results = await retriever.aretrieve("When is the next yoga event?")
-
-    # Print retrieval result
-    print(results)
-
-
-if __name__ == "__main__":
-    load_dotenv()
-
-    import nest_asyncio
-
-    nest_asyncio.apply()
-
-    asyncio.run(main())
+async def create_date_index(aclient: AsyncQdrantClient, collection_name: str):
+    # The date index lets Qdrant filter and sort events by date
+    await aclient.create_payload_index(
+        collection_name, DATE_KEY, field_schema=models.PayloadSchemaType.DATETIME
+    )
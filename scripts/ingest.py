@@ -0,0 +1,422 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import AsyncIterator, Optional
+
+from dotenv import load_dotenv
+from llama_index.core import Document
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.embeddings.openai import OpenAIEmbedding
+from qdrant_client import AsyncQdrantClient
+
+# Run from the repository root with `python -m scripts.ingest`
+from scripts.event_scraping import EVENT_KEYS, EventModel, create_date_index, \
+    plan_events, scrape_events
+from scripts.scrape_intranet import INGEST_BATCH_SIZE, crawl
+from scripts.society_scraping import EMBED_GROUP_SIZE, SocietyModel, \
+    scrape_links, society_client, society_documents, stream_societies
+from scripts.uni_website_scraping import CHANGE_KEYS, SITEMAP_URL, page_document, \
+    plan_refresh, read_sitemap, remember_lastmod, stream_pages, website_client
+from utils.dedup_helper import DuplicateReport, NearDuplicateFilter
+from utils.embedding_pool import EmbeddingPool, EmbeddingReport
+from utils.embedding_stub import HashingEmbedding
+from utils.ingestion_helper import CONTENT_HASH_KEY, IngestionReport, abatched, \
+    add_duplicates, apply_changes, batched, delete_documents, shrank_sharply, \
+    stable_document
+from utils.intranet_crawler import CrawlCheckpoint
+from utils.vector_store_helper import EMBED_MODEL, FULL_EMBED_DIMENSIONS, \
+    embedding_kwargs, ensure_collection, intranet_embed_dimensions, \
+    intranet_quantization, search_llm_text, stored_documents, \
+    LLMTextQdrantVectorStore
+
+EVENTS_URL = "https://www.cardiffstudents.com/activities/societies/events/"
+
+
+class StageTimer:
+    """
+    Adds up the time spent in each stage of the ingestion
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+
+    def __str__(self) -> str:
+        return ", ".join(f"{name} {seconds:.1f}s"
+                         for name, seconds in self.seconds.items())
+
+
+class IngestionSource(ABC):
+    """
+    A data source ingested into its own collection.
+    Sources scrape their documents and find the new and changed ones,
+    the splitting, embedding and upserting stages are shared.
+    """
+    collection_name: str
+    chunk_size = 1024
+    payload_keys = [CONTENT_HASH_KEY]
+    # Skip documents which are near-duplicates of another one
+    deduplicate = False
+    test_query: str
+
+    def __init__(self, args: argparse.Namespace, corpus: Optional[dict] = None):
+        """
+        :param args: the command line arguments
+        :param corpus: documents to use instead of scraping, in the format of
+        tests/fixtures/retrieval_corpus.json
+        """
+        self.args = args
+        self.corpus = corpus
+
+    def collection_settings(self) -> tuple[int, str]:
+        """
+        :return: the dimensions and the quantization of the collection
+        """
+        return FULL_EMBED_DIMENSIONS, "none"
+
+    def embed_model(self) -> BaseEmbedding:
+        return OpenAIEmbedding(model=EMBED_MODEL)
+
+    async def prepare(self, aclient: AsyncQdrantClient):
+        """
+        Called once the collection exists, e.g. to add payload indexes
+        """
+
+    @abstractmethod
+    def documents(
+            self,
+            aclient: AsyncQdrantClient,
+            store: LLMTextQdrantVectorStore,
+            duplicates: Optional[NearDuplicateFilter],
+    ) -> AsyncIterator[tuple[list[Document], IngestionReport]]:
+        """
+        Scrape the source, removing deleted and changed documents from the store
+        :param duplicates: the near-duplicate filter, if the source deduplicates
+        :return: batches of documents to embed, with the report of each batch
+        """
+
+
+class IntranetSource(IngestionSource):
+    collection_name = "intranet"
+    # Paginated listings, search results and printer-friendly copies
+    # are crawled as separate pages
+    deduplicate = True
+    test_query = "connect to intranet vpn"
+
+    def collection_settings(self) -> tuple[int, str]:
+        # The dimension and quantization can be reduced to save memory in Qdrant,
+        # see INTRANET_EMBED_DIMENSIONS and INTRANET_QUANTIZATION
+        return intranet_embed_dimensions(), intranet_quantization()
+
+    def embed_model(self) -> BaseEmbedding:
+        return OpenAIEmbedding(**embedding_kwargs(intranet_embed_dimensions()))
+
+    async def documents(self, aclient, store, duplicates):
+        stored = await stored_documents(aclient, self.collection_name,
+                                        self.payload_keys)
+
+        checkpoint = None
+        if self.corpus is not None:
+            corpus = [Document(text=page["text"], extra_info={"URL": page["url"]})
+                      for page in self.corpus["intranet"]]
+            finished = True
+        else:
+            # Crawled pages are kept here, in case the script fails later
+            checkpoint = CrawlCheckpoint(os.getenv("INTRANET_CHECKPOINT_DIR",
+                                                   "intranet_checkpoint"))
+            # A dry run only ingests the pages crawled before
+            if not self.args.ingest_only and not self.args.dry_run:
+                await crawl(checkpoint, self.args.fresh)
+            finished = checkpoint.finished()
+
+        def stable_pages():
+            # Streamed, so the whole crawl is never in memory
+            pages = corpus if checkpoint is None else checkpoint.documents()
+            # The url is the document id, so the page can be found on the next run
+            for document in pages:
+                yield stable_document(document, document.metadata["URL"])
+
+        if duplicates is not None:
+            # Only the signatures are kept, the pages are read again afterwards
+            add_duplicates(duplicates, stable_pages(), stored)
+
+        crawled = set()
+        for documents in batched(stable_pages(), INGEST_BATCH_SIZE):
+            crawled.update(document.id_ for document in documents)
+
+            # Only new and changed pages are embedded,
+            # the chunks of changed pages and near-duplicates are removed
+            yield await apply_changes(store, documents, stored, delete_missing=False,
+                                      duplicates=duplicates)
+
+        # Pages which weren't found by a complete crawl were deleted from the intranet,
+        # a crawl with failed pages isn't complete
+        if finished and not shrank_sharply(len(crawled), len(stored)):
+            report = IngestionReport()
+            report.deleted = await delete_documents(
+                store, [doc_id for doc_id in stored if doc_id not in crawled]
+            )
+            yield [], report
+
+
+class EventsSource(IngestionSource):
+    collection_name = "events"
+    payload_keys = EVENT_KEYS
+    test_query = "When is the next yoga event?"
+
+    async def prepare(self, aclient):
+        await create_date_index(aclient, self.collection_name)
+
+    async def documents(self, aclient, store, duplicates):
+        if self.corpus is not None:
+            events = [EventModel(**event) for event in self.corpus["events"]]
+        else:
+            events = await scrape_events(EVENTS_URL)
+
+        yield await plan_events(aclient, store, events)
+
+
+class SocietiesSource(IngestionSource):
+    collection_name = "societies"
+    chunk_size = 2048
+    test_query = "Get me information on the yoga society"
+
+    async def documents(self, aclient, store, duplicates):
+        stored = await stored_documents(aclient, self.collection_name,
+                                        self.payload_keys)
+
+        if self.corpus is not None:
+            societies = [SocietyModel(**society)
+                         for society in self.corpus["societies"]]
+            links = [society.link for society in societies]
+            yield await apply_changes(store, society_documents(societies), stored,
+                                      delete_missing=False, duplicates=duplicates)
+        else:
+            async with society_client() as client:
+                links = await scrape_links(client)
+
+                # Societies are embedded while the rest are still being scraped
+                groups = abatched(stream_societies(client, links), EMBED_GROUP_SIZE)
+                async for group in groups:
+                    yield await apply_changes(store, society_documents(group),
+                                              stored, delete_missing=False,
+                                              duplicates=duplicates)
+
+        # Societies which aren't listed anymore were removed,
+        # a page which failed to load is still listed.
+        # An empty or much shorter listing is more likely a broken page,
+        # e.g. a changed layout or a Cloudflare check
+        if shrank_sharply(len(links), len(stored)):
+            return
+
+        listed = set(links)
+        report = IngestionReport()
+        report.deleted = await delete_documents(
+            store, [doc_id for doc_id in stored if doc_id not in listed]
+        )
+        yield [], report
+
+
+class UniWebsiteSource(IngestionSource):
+    collection_name = "uni_website"
+    # Chunks are the size of the passages reranked by search_uni_website
+    chunk_size = 256
+    payload_keys = CHANGE_KEYS
+    test_query = "computer science tuition fees"
+
+    async def documents(self, aclient, store, duplicates):
+        stored = await stored_documents(aclient, self.collection_name,
+                                        self.payload_keys)
+
+        if self.corpus is not None:
+            corpus = self.corpus.get("uni_website", [])
+            pages = {page["url"]: page.get("lastmod") for page in corpus}
+            documents = [page_document(page["url"], page["text"], page.get("lastmod"))
+                         for page in corpus]
+            await remember_lastmod(aclient, documents, stored)
+            yield await apply_changes(store, documents, stored, delete_missing=False)
+        else:
+            async with website_client() as client:
+                pages = await read_sitemap(client, SITEMAP_URL)
+                to_fetch, _ = plan_refresh(pages, stored)
+                print(f"{len(pages)} pages in the sitemap, {len(stored)} indexed, "
+                      f"{len(to_fetch)} to fetch")
+
+                # Pages are embedded while the next ones are still being fetched
+                batches = abatched(stream_pages(client, pages, to_fetch),
+                                   INGEST_BATCH_SIZE)
+                async for documents in batches:
+                    # Pages with a new date but the same text aren't embedded again
+                    await remember_lastmod(aclient, documents, stored)
+                    yield await apply_changes(store, documents, stored,
+                                              delete_missing=False)
+
+        # Pages which aren't in the sitemap anymore were removed,
+        # an empty or much shorter sitemap is more likely a failed request
+        if shrank_sharply(len(pages), len(stored)):
+            return
+
+        _, to_delete = plan_refresh(pages, stored)
+        report = IngestionReport()
+        report.deleted = await delete_documents(store, to_delete)
+        yield [], report
+
+
+SOURCES = {
+    source.collection_name: source
+    for source in [IntranetSource, EventsSource, SocietiesSource, UniWebsiteSource]
+}
+
+
+async def ingest(
+        source: IngestionSource,
+        aclient: AsyncQdrantClient,
+        embed_model: BaseEmbedding,
+        dimensions: int,
+        quantization: str,
+) -> tuple[IngestionReport, EmbeddingReport, DuplicateReport, StageTimer]:
+    """
+    Ingest a source into its collection
+    :param source: the source to ingest
+    :param aclient: the Qdrant client
+    :param embed_model: the embedding model of the collection
+    :param dimensions: the dimensions of the embedding model
+    :param quantization: the quantization of the collection
+    :return: the changes made, the embedding stats, the near-duplicates removed
+    and the time of each stage
+    """
+    timer = StageTimer()
+
+    # Create the collection ourselves, as the vector store
+    # would create it without quantization
+    await ensure_collection(aclient, source.collection_name, dimensions, quantization)
+    await source.prepare(aclient)
+
+    # Only the text pre-rendered for the LLM is stored in the payload,
+    # with the fields the source needs to find changes on the next run
+    store = LLMTextQdrantVectorStore(source.collection_name, aclient=aclient,
+                                     payload_keys=source.payload_keys)
+    splitter = SentenceSplitter(chunk_size=source.chunk_size, chunk_overlap=20)
+    # The pool embeds the chunks with concurrent requests,
+    # within the rate limit of the account, and upserts them to Qdrant
+    pool = EmbeddingPool(embed_model, store)
+
+    # Checked with the changes, so the time is part of the scrape stage
+    duplicates = NearDuplicateFilter(splitter) if source.deduplicate else None
+
+    report = IngestionReport()
+    batches = source.documents(aclient, store, duplicates)
+
+    while True:
+        with timer.stage("scrape"):
+            try:
+                documents, batch_report = await anext(batches)
+            except StopAsyncIteration:
+                break
+        report.add(batch_report)
+
+        with timer.stage("split"):
+            nodes = splitter.get_nodes_from_documents(documents)
+
+        with timer.stage("embed and upsert"):
+            await pool.run(nodes)
+
+    duplicate_report = duplicates.report if duplicates else DuplicateReport()
+    return report, pool.report, duplicate_report, timer
+
+
+async def main(args: argparse.Namespace) -> dict[str, IngestionReport]:
+    corpus = None
+    if args.corpus:
+        with open(args.corpus) as f:
+            corpus = json.load(f)
+
+    if args.dry_run:
+        aclient = AsyncQdrantClient(location=":memory:")
+    else:
+        aclient = AsyncQdrantClient(
+            url=os.environ.get("QDRANT_URL"),
+            api_key=os.environ.get("QDRANT_API_KEY")
+        )
+
+    reports = {}
+    for name in args.sources:
+        source = SOURCES[name](args, corpus)
+        dimensions, quantization = source.collection_settings()
+
+        if args.dry_run:
+            embed_model = HashingEmbedding()
+            dimensions = embed_model.dimensions
+        else:
+            embed_model = source.embed_model()
+
+        report, embedding_report, duplicate_report, timer = await ingest(
+            source, aclient, embed_model, dimensions, quantization
+        )
+        reports[name] = report
+
+        print(f"{name}: {report}")
+        print(f"{name}: {embedding_report}")
+        if source.deduplicate:
+            print(f"{name}: {duplicate_report}")
+        print(f"{name}: {timer}")
+
+        # Test the retriever
+        query_embedding = await embed_model.aget_query_embedding(source.test_query)
+        print(await search_llm_text(aclient, name, query_embedding, 2))
+
+    return reports
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Scrape the data sources, and ingest them into Qdrant"
+    )
+    parser.add_argument("sources", nargs="*", default=list(SOURCES),
+                        help=f"the sources to ingest: {', '.join(SOURCES)}, "
+                             "all of them by default")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="embed with a local stub into an in-memory Qdrant, "
+                             "without OpenAI or Qdrant")
+    parser.add_argument("--corpus",
+                        help="with --dry-run, ingest the documents of this file "
+                             "instead of scraping, "
+                             "e.g. tests/fixtures/retrieval_corpus.json")
+    parser.add_argument("--fresh", action="store_true",
+                        help="start a new intranet crawl, "
+                             "instead of resuming the last one")
+    parser.add_argument("--ingest-only", action="store_true",
+                        help="only ingest the pages of the last intranet crawl")
+
+    args = parser.parse_args(argv)
+    for source in args.sources:
+        if source not in SOURCES:
+            parser.error(f"unknown source {source}, "
+                         f"choose from {', '.join(SOURCES)}")
+    if args.corpus and not args.dry_run:
+        parser.error("--corpus can only be used with --dry-run")
+
+    return args
+
+
+if __name__ == "__main__":
+    load_dotenv()
+
+    import nest_asyncio
+
+    nest_asyncio.apply()
+
+    asyncio.run(main(parse_args()))
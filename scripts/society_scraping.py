@@ -1,17 +1,27 @@
 import asyncio
 import os
+import random
+from typing import AsyncIterator, Optional
 
 import httpx  # Async HTTP client library
 from bs4 import BeautifulSoup  # Module for web scraping
-from dotenv import load_dotenv
-from llama_index.core import VectorStoreIndex, Document
-from llama_index.core.ingestion import IngestionPipeline
-from llama_index.core.node_parser import SentenceSplitter
-from llama_index.embeddings.openai import OpenAIEmbedding
-from llama_index.vector_stores.qdrant import QdrantVectorStore
+from llama_index.core import Document
 # Base class for creating Pydantic models
 from pydantic import BaseModel
-from qdrant_client import AsyncQdrantClient
+
+from utils.ingestion_helper import stable_document
+
+SOCIETIES_URL = "https://www.cardiffstudents.com/activities/societies/"
+
+# Pages fetched at once, over the same keep-alive connections
+CONCURRENCY = int(os.getenv("SOCIETY_SCRAPE_CONCURRENCY", 8))
+REQUEST_TIMEOUT = 30
+MAX_RETRIES = 3
+# Societies embedded together, while the next ones are scraped
+EMBED_GROUP_SIZE = 50
+
+# Status codes worth retrying
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
 
 
 class SocietyModel(BaseModel):
@@ -20,27 +30,64 @@ class SocietyModel(BaseModel):
     link: str
 
 
-async def scrape_links():
-    async with httpx.AsyncClient() as client:
-        response = await client.get("https://www.cardiffstudents.com/activities/societies/")
-        soup = BeautifulSoup(response.text, 'html.parser')
+def society_client() -> httpx.AsyncClient:
+    """
+    One client for the whole scrape, so connections are reused between pages
+    """
+    return httpx.AsyncClient(
+        timeout=REQUEST_TIMEOUT,
+        limits=httpx.Limits(max_connections=CONCURRENCY,
+                            max_keepalive_connections=CONCURRENCY),
+    )
+
+
+async def fetch_page(client: httpx.AsyncClient, url: str) -> str:
+    """
+    Fetch a page, retrying connection errors and transient status codes
+    :return: the html of the page
+    """
+    attempt = 0
+    while True:
+        try:
+            response = await client.get(url)
+            if response.status_code not in TRANSIENT_STATUS_CODES:
+                return response.text
+            error = f"status {response.status_code}"
+        except httpx.TransportError as e:
+            error = repr(e)
+
+        if attempt >= MAX_RETRIES:
+            raise Exception(f"Failed to fetch {url}: {error}")
 
-        # Find links using the specified CSS selector
-        links = soup.select("li[data-msl-organisation-id] > a.msl-gl-link")
+        # Exponential backoff with jitter
+        delay = 2 ** attempt * random.uniform(0.5, 1.0)
+        print(f"Failed to fetch {url} ({error}), retrying in {delay:.1f}s")
+        attempt += 1
+        await asyncio.sleep(delay)
 
-        # Extract href attributes from the links
-        href_links = [link['href'] for link in links]
 
-        # Construct absolute URLs
-        abs_links = [f"https://www.cardiffstudents.com{href}" for href in href_links]
+async def scrape_links(client: Optional[httpx.AsyncClient] = None):
+    if client is None:
+        async with society_client() as client:
+            return await scrape_links(client)
 
-        return abs_links
+    html = await fetch_page(client, SOCIETIES_URL)
+    soup = BeautifulSoup(html, 'html.parser')
 
+    # Find links using the specified CSS selector
+    links = soup.select("li[data-msl-organisation-id] > a.msl-gl-link")
 
-async def scrape_content(url):
-    async with httpx.AsyncClient(timeout=30) as client:
-        response = await client.get(url)
-        soup = BeautifulSoup(response.text, 'html.parser')
+    # Extract href attributes from the links
+    href_links = [link['href'] for link in links]
+
+    # Construct absolute URLs
+    abs_links = [f"https://www.cardiffstudents.com{href}" for href in href_links]
+
+    return abs_links
+
+
+def parse_society(html: str, url: str) -> SocietyModel:
+    soup = BeautifulSoup(html, 'html.parser')
 
     soc_title = soup.find('h1')
     if soc_title:
@@ -55,74 +102,64 @@ async def scrape_content(url):
         text_content = "Society content not found."
 
     # Create SocietyDTO object with society name, content, and link
-    society_data = SocietyModel(
+    return SocietyModel(
         organisation=society_name,
         content=text_content,
         link=url  # Pass the URL as the link field
     )
-    # Wrap the society_data in a list before returning
-    return society_data
 
 
-async def main():
-    # Fetch links asynchronously
-    scraped_links = await scrape_links()
-
-    # Asynchronously scrape content from each link
-    tasks = [scrape_content(link) for link in scraped_links]
-    societies_results = await asyncio.gather(*tasks)
-
+async def scrape_content(url, client: Optional[httpx.AsyncClient] = None):
+    if client is None:
+        async with society_client() as client:
+            return await scrape_content(url, client)
+
+    html = await fetch_page(client, url)
+    # Parsing is CPU bound, so it doesn't hold up the other fetches
+    return await asyncio.to_thread(parse_society, html, url)
+
+
+async def stream_societies(
+        client: httpx.AsyncClient,
+        links: list[str],
+        concurrency: int = CONCURRENCY,
+) -> AsyncIterator[SocietyModel]:
+    """
+    Scrape the society pages concurrently
+    :return: the societies as soon as they're scraped, in any order.
+    Pages which still fail after the retries are skipped.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def scrape(link: str) -> Optional[SocietyModel]:
+        async with semaphore:
+            try:
+                return await scrape_content(link, client)
+            except Exception as e:
+                print(e)
+                return None
+
+    tasks = [asyncio.create_task(scrape(link)) for link in links]
+    try:
+        for task in asyncio.as_completed(tasks):
+            society = await task
+            if society is not None:
+                yield society
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def society_documents(societies: list[SocietyModel]) -> list[Document]:
     # Create Document objects for each society
     documents = []
-    for society in societies_results:
+    for society in societies:
         doc = Document(
             text=society.organisation,
             metadata={"content": society.content, "URL": society.link}
         )
-        documents.append(doc)
-
-    # OpenAI Model works but needs a little tweaking
-    embed_model = OpenAIEmbedding(model="text-embedding-3-large")
-    splitter = SentenceSplitter(chunk_size=2048, chunk_overlap=20)
-    embed_model.embed_batch_size = 50
-
-    aclient = AsyncQdrantClient(
-        url=os.environ.get("QDRANT_URL"),
-        api_key=os.environ.get("QDRANT_API_KEY")
-    )
-
-    # Create Qdrant vector store
-    store = QdrantVectorStore("societies", aclient=aclient)
-
-    # Define ingestion pipeline
-    pipeline = IngestionPipeline(
-        transformations=[splitter, embed_model],
-        vector_store=store
-    )
-
-    # Ingest documents into Qdrant
-    await pipeline.arun(show_progress=True, documents=documents)
-
-    # Create index from vector store
-    index = VectorStoreIndex.from_vector_store(vector_store=store,
-                                               embed_model=embed_model,
-                                               use_async=True)
-
-    # Create retriever from index
-    retriever = index.as_retriever(similarity_top_k=3)
-
-    # Perform retrieval query
-    results = await retriever.aretrieve("Get me information on the yoga society")
-
-    print(results)
-
-
-if __name__ == "__main__":
-    load_dotenv()
-
-    import nest_asyncio
-
-    nest_asyncio.apply()
-
-    asyncio.run(main())
-
+        # The link is the id, so the society can be found on the next run,
+        # and a change to its content is re-embedded
+        documents.append(stable_document(doc, society.link,
+                                         society.model_dump_json()))
+    return documents
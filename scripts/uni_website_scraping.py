@@ -0,0 +1,222 @@
+import asyncio
+import os
+from itertools import islice
+from typing import AsyncIterator, Optional
+from urllib.parse import urlsplit
+
+import httpx
+import lxml.etree
+from llama_index.core import Document
+from qdrant_client import AsyncQdrantClient, models
+
+from utils.html_helper import html_to_markdown
+from utils.ingestion_helper import content_hash, is_unchanged
+
+SITEMAP_URL = os.getenv("UNI_WEBSITE_SITEMAP", "https://www.cardiff.ac.uk/sitemap.xml")
+HOST = urlsplit(SITEMAP_URL).hostname
+
+# Pages fetched at once, to be polite to the website
+CONCURRENCY = int(os.getenv("UNI_WEBSITE_CRAWL_CONCURRENCY", 8))
+MAX_PAGE_BYTES = int(os.getenv("UNI_WEBSITE_MAX_PAGE_BYTES", 2 * 1024 * 1024))
+
+# Links in the sitemap which aren't html pages
+SKIP_EXTENSIONS = (".pdf", ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx",
+                   ".zip", ".jpg", ".jpeg", ".png")
+
+# Stored with each chunk so the next run can tell if the page changed,
+# but not shown to the model
+CHANGE_KEYS = ["lastmod", "content_hash"]
+
+
+def parse_sitemap(xml: bytes) -> tuple[list[str], dict[str, Optional[str]]]:
+    """
+    Parse a sitemap, or a sitemap index
+    :param xml: the sitemap
+    :return: the nested sitemaps, and the last modified date of each page
+    """
+    root = lxml.etree.fromstring(xml)
+
+    sitemaps = []
+    pages = {}
+
+    for entry in root:
+        if not isinstance(entry.tag, str):
+            continue
+
+        fields = {
+            lxml.etree.QName(child).localname: (child.text or "").strip()
+            for child in entry if isinstance(child.tag, str)
+        }
+        if not fields.get("loc"):
+            continue
+
+        if lxml.etree.QName(entry).localname == "sitemap":
+            sitemaps.append(fields["loc"])
+        else:
+            pages[fields["loc"]] = fields.get("lastmod") or None
+
+    return sitemaps, pages
+
+
+async def read_sitemap(client: httpx.AsyncClient, url: str) -> dict[str, Optional[str]]:
+    """
+    Read the sitemap, following nested sitemaps
+    :return: the last modified date of each html page on the website
+    """
+    pages = {}
+    queue = [url]
+    seen = set()
+
+    while queue:
+        sitemap_url = queue.pop()
+        if sitemap_url in seen:
+            continue
+        seen.add(sitemap_url)
+
+        resp = await client.get(sitemap_url)
+        if resp.status_code != 200:
+            print("Error while reading the sitemap:", sitemap_url, resp.status_code)
+            continue
+
+        sitemaps, sitemap_pages = parse_sitemap(resp.content)
+        queue.extend(sitemaps)
+
+        for page_url, lastmod in sitemap_pages.items():
+            parts = urlsplit(page_url)
+            if parts.hostname != HOST or parts.path.lower().endswith(SKIP_EXTENSIONS):
+                continue
+            pages[page_url] = lastmod
+
+    return pages
+
+
+def plan_refresh(
+        pages: dict[str, Optional[str]],
+        stored: dict[str, dict]
+) -> tuple[list[str], list[str]]:
+    """
+    Work out which pages need to be fetched again
+    :param pages: the last modified date of each page in the sitemap
+    :param stored: the payload of each page already in the index
+    :return: the pages to fetch, and the pages to remove from the index
+    """
+    to_fetch = [
+        url for url, lastmod in pages.items()
+        # Pages without a date are fetched, and compared by their content
+        if url not in stored or lastmod is None
+        or stored[url].get("lastmod") != lastmod
+    ]
+    to_delete = [url for url in stored if url not in pages]
+
+    return to_fetch, to_delete
+
+
+def page_document(url: str, markdown: str, lastmod: Optional[str]) -> Document:
+    return Document(
+        # The url is the document id, so the page can be replaced later
+        id_=url,
+        text=markdown,
+        extra_info={
+            "Source": url,
+            "lastmod": lastmod,
+            "content_hash": content_hash(markdown),
+        },
+        excluded_llm_metadata_keys=CHANGE_KEYS,
+        excluded_embed_metadata_keys=CHANGE_KEYS,
+    )
+
+
+def website_client() -> httpx.AsyncClient:
+    """
+    One client for the whole refresh, so connections are reused between pages
+    """
+    return httpx.AsyncClient(
+        follow_redirects=True,
+        timeout=30,
+        limits=httpx.Limits(max_connections=CONCURRENCY,
+                            max_keepalive_connections=CONCURRENCY),
+    )
+
+
+async def fetch_markdown(client: httpx.AsyncClient, url: str) -> Optional[str]:
+    """
+    Fetch the page and extract its text
+    :return: the markdown, or None if the page couldn't be fetched
+    """
+    try:
+        resp = await client.get(url)
+    except httpx.HTTPError as e:
+        print("Error while fetching:", url, e)
+        return None
+
+    if resp.status_code != 200 or len(resp.content) > MAX_PAGE_BYTES:
+        print("Skipping page:", url, resp.status_code, len(resp.content))
+        return None
+
+    if "html" not in resp.headers.get("Content-Type", "text/html"):
+        return None
+
+    return await asyncio.to_thread(html_to_markdown, resp.content, url)
+
+
+async def stream_pages(
+        client: httpx.AsyncClient,
+        pages: dict[str, Optional[str]],
+        urls: list[str],
+        concurrency: int = CONCURRENCY,
+) -> AsyncIterator[Document]:
+    """
+    Fetch the pages concurrently. A fetch only starts when another page
+    was taken, so the pages waiting to be embedded stay few.
+    :param pages: the last modified date of each page in the sitemap
+    :param urls: the pages to fetch
+    :return: the documents as soon as they're fetched, in any order.
+    Pages which couldn't be fetched are skipped.
+    """
+    async def fetch(url: str) -> Optional[Document]:
+        markdown = await fetch_markdown(client, url)
+        return page_document(url, markdown, pages[url]) if markdown else None
+
+    remaining = iter(urls)
+    tasks = set()
+    try:
+        while True:
+            for url in islice(remaining, concurrency - len(tasks)):
+                tasks.add(asyncio.create_task(fetch(url)))
+            if not tasks:
+                break
+
+            done, tasks = await asyncio.wait(tasks,
+                                             return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if (document := task.result()) is not None:
+                    yield document
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def remember_lastmod(
+        aclient: AsyncQdrantClient,
+        documents: list[Document],
+        stored: dict[str, dict]
+):
+    """
+    Store the new date of the pages whose text didn't change,
+    so they aren't fetched again on the next run
+    :param documents: the fetched pages
+    :param stored: the payload of each page already in the index
+    """
+    for document in documents:
+        previous = stored.get(document.id_)
+        if not is_unchanged(document, stored) or \
+                previous.get("lastmod") == document.metadata["lastmod"]:
+            continue
+
+        await aclient.set_payload(
+            "uni_website",
+            payload={"lastmod": document.metadata["lastmod"]},
+            points=models.Filter(must=[models.FieldCondition(
+                key="doc_id", match=models.MatchValue(value=document.id_)
+            )]),
+        )
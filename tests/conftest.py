@@ -0,0 +1,62 @@
+import os
+from typing import Awaitable, Callable, Optional
+
+import pytest
+from qdrant_client import AsyncQdrantClient
+
+from utils.embedding_stub import HashingEmbedding
+from utils.vector_store_helper import LLMTextQdrantVectorStore, vectors_config
+
+# The modules check these when imported, the offline tests never connect to them.
+# Set them in the environment to run the tests against the real services
+os.environ.setdefault("DB_URI", "postgresql://localhost/offline")
+os.environ.setdefault("QDRANT_URL", "http://localhost:6333")
+os.environ.setdefault("QDRANT_API_KEY", "offline")
+os.environ.setdefault("OPENAI_API_KEY", "offline")
+os.environ.setdefault("SECRET_KEY", "offline")
+
+StoreFactory = Callable[..., Awaitable[LLMTextQdrantVectorStore]]
+
+
+@pytest.fixture
+def aclient() -> AsyncQdrantClient:
+    """
+    An in-memory Qdrant, empty for each test
+    """
+    return AsyncQdrantClient(location=":memory:")
+
+
+@pytest.fixture
+def embed_model() -> HashingEmbedding:
+    return HashingEmbedding()
+
+
+@pytest.fixture
+def make_store(aclient, embed_model) -> StoreFactory:
+    """
+    Create a collection for the vectors of embed_model
+    :return: a function creating the collection, and returning its store
+    """
+    async def make_store(
+            collection_name: str,
+            payload_keys: Optional[list[str]] = None,
+    ) -> LLMTextQdrantVectorStore:
+        await aclient.create_collection(
+            collection_name,
+            vectors_config=vectors_config(embed_model.dimensions, "none"),
+        )
+        return LLMTextQdrantVectorStore(collection_name, aclient=aclient,
+                                        payload_keys=payload_keys)
+
+    return make_store
+
+
+@pytest.fixture
+def reranker():
+    """
+    The local reranker of the retrieval benchmark, in place of CohereRerank
+    """
+    # Imported when needed, so the unit tests don't load the whole benchmark
+    from tests.retrieval_benchmark import OverlapReranker
+
+    return OverlapReranker
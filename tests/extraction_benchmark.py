@@ -0,0 +1,157 @@
+"""
+Benchmark for the HTML to markdown extraction of university pages.
+
+Compares the previous extraction (BeautifulSoup, prettify, then html2text)
+with the single pass extraction in utils.html_helper, on the saved pages in
+tests/fixtures/uni_website. Also measures how long the event loop is blocked
+while a batch of pages is extracted, inline and on the worker pool.
+
+Run with `python -m tests.extraction_benchmark` from the repository root.
+"""
+import asyncio
+import statistics
+import time
+from pathlib import Path
+
+import html2text
+from bs4 import BeautifulSoup
+
+from utils.html_helper import extract_markdown, html_to_markdown
+
+FIXTURES_PATH = Path(__file__).parent / "fixtures" / "uni_website"
+
+ROUNDS = 50
+
+# Pages extracted at once, like the results of one search
+BATCH_SIZE = 10
+
+
+def legacy_html_to_markdown(html: str) -> str:
+    """
+    The extraction used before utils.html_helper, kept for comparison
+    """
+    doc = BeautifulSoup(html, "html.parser")
+
+    for nav in doc.find_all("nav"):
+        nav.decompose()
+    for footer in doc.find_all("footer"):
+        footer.decompose()
+    for header in doc.find_all("header"):
+        header.decompose()
+    for element in doc.recursiveChildGenerator():
+        if element.name is None:
+            continue
+
+        blacklist = ["footer", "btn"]
+        for class_name in element.get("class", []):
+            if class_name in blacklist:
+                element.decompose()
+                break
+
+    return html2text.html2text(str(doc.prettify("utf-8"), encoding='utf-8'))
+
+
+def load_pages() -> dict[str, bytes]:
+    return {
+        path.name: path.read_bytes()
+        for path in sorted(FIXTURES_PATH.glob("*.html"))
+    }
+
+
+def time_extraction(extract, html, rounds: int = ROUNDS) -> float:
+    """
+    :return: the median time to extract the page, in milliseconds
+    """
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        extract(html)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+async def max_loop_stall(extract_batch) -> float:
+    """
+    Measure the longest time the event loop couldn't run other tasks,
+    while the batch is extracted
+    :return: the longest stall, in milliseconds
+    """
+    stalls = []
+    done = False
+
+    async def ticker():
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0)
+            stalls.append((time.perf_counter() - start) * 1000)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    try:
+        await extract_batch()
+    finally:
+        done = True
+        await task
+
+    return max(stalls, default=0.0)
+
+
+async def run_benchmark(pages: dict[str, bytes]) -> dict:
+    results = {"pages": {}}
+
+    for name, html in pages.items():
+        text = html.decode("utf-8")
+        legacy = legacy_html_to_markdown(text)
+        markdown = html_to_markdown(html)
+        results["pages"][name] = {
+            "legacy_ms": time_extraction(legacy_html_to_markdown, text),
+            "single_pass_ms": time_extraction(html_to_markdown, html),
+            "legacy_chars": len(legacy),
+            "single_pass_chars": len(markdown),
+        }
+
+    batch = [html for html in pages.values()] * (BATCH_SIZE // len(pages) + 1)
+    batch = batch[:BATCH_SIZE]
+
+    async def inline():
+        for html in batch:
+            legacy_html_to_markdown(html.decode("utf-8"))
+
+    async def pooled():
+        await asyncio.gather(*[extract_markdown(html) for html in batch])
+
+    results["inline_stall_ms"] = await max_loop_stall(inline)
+    results["pooled_stall_ms"] = await max_loop_stall(pooled)
+
+    return results
+
+
+def format_report(results: dict) -> str:
+    lines = [
+        f"{'page':<16} {'legacy ms':>10} {'single ms':>10} {'speedup':>8} "
+        f"{'legacy chars':>13} {'single chars':>13}"
+    ]
+
+    for name, page in results["pages"].items():
+        speedup = page["legacy_ms"] / page["single_pass_ms"]
+        lines.append(
+            f"{name:<16} {page['legacy_ms']:>10.2f} {page['single_pass_ms']:>10.2f} "
+            f"{speedup:>7.1f}x {page['legacy_chars']:>13} "
+            f"{page['single_pass_chars']:>13}"
+        )
+
+    lines.append(
+        f"Longest event loop stall for {BATCH_SIZE} pages: "
+        f"{results['inline_stall_ms']:.2f} ms inline, "
+        f"{results['pooled_stall_ms']:.2f} ms on the worker pool"
+    )
+
+    return "\n".join(lines)
+
+
+async def main():
+    print(format_report(await run_benchmark(load_pages())))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
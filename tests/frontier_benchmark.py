@@ -0,0 +1,131 @@
+"""
+Micro-benchmark for the link admission of the intranet crawler.
+
+Replays a synthetic crawl through the link de-duplication of the old
+CustomWholeSiteReader.extract_links, and through URLFrontier. The old
+algorithm scans every url seen so far for each link with a query, so it's
+only run on the smaller crawls.
+
+Run with `python -m tests.frontier_benchmark` from the repository root.
+"""
+import random
+import time
+from hashlib import sha256
+
+from httpx import URL
+
+from utils.intranet_crawler import URLFrontier
+
+PREFIX = "https://intranet.cardiff.ac.uk/students/"
+
+# Links found on each crawled page
+LINKS_PER_PAGE = 50
+
+SIZES = [1_000, 10_000, 100_000]
+# The old algorithm takes minutes above this
+LEGACY_MAX_SIZE = 10_000
+
+
+def synthetic_crawl(size: int, seed: int = 0) -> list[list[str]]:
+    """
+    Build the links found on each page of a crawl with `size` links in total.
+    Most links are to pages, some are to search and listing pages with queries,
+    and many are repeated, like menus are on every page
+    """
+    rng = random.Random(seed)
+    pages = max(size // 20, 1)
+
+    links = []
+    for _ in range(size):
+        kind = rng.random()
+        if kind < 0.6:
+            links.append(f"{PREFIX}section-{rng.randrange(pages // 10 + 1)}"
+                         f"/page-{rng.randrange(pages)}")
+        elif kind < 0.9:
+            path = f"search-{rng.randrange(50)}"
+            links.append(f"{PREFIX}{path}?q={rng.randrange(pages)}&page={rng.randrange(5)}")  # noqa
+        else:
+            # Menu links
+            links.append(f"{PREFIX}menu-{rng.randrange(20)}")
+
+    return [links[i:i + LINKS_PER_PAGE] for i in range(0, len(links), LINKS_PER_PAGE)]
+
+
+class LegacyLinkFilter:
+    """
+    The de-duplication of CustomWholeSiteReader.extract_links, kept for comparison
+    """
+
+    def __init__(self):
+        self.all_urls = set()
+        self.cache = {}
+
+    def cache_path(self, url):
+        key = sha256(url.encode()).hexdigest()
+        if key in self.cache:
+            return self.cache[key]
+        path = URL(url).path
+        self.cache[key] = path
+        return path
+
+    def extract_links(self, links: list[str]) -> list[str]:
+        links = list(links)
+        to_remove = []
+
+        for link in links:
+            self.all_urls.add(link)
+            count = 0
+            url = URL(link)
+            # As in the original, httpx returns the query as bytes,
+            # so this never skips a link
+            if url.query == "":
+                continue
+            path = url.path
+            for added_url in self.all_urls:
+                cur_path = self.cache_path(added_url)
+                if path == cur_path:
+                    count += 1
+                if count > 10:
+                    to_remove.append(link)
+                    break
+
+        for link in to_remove:
+            links.remove(link)
+
+        return links
+
+
+def run_legacy(crawl: list[list[str]]) -> float:
+    legacy = LegacyLinkFilter()
+    start = time.perf_counter()
+    for page in crawl:
+        legacy.extract_links(page)
+    return time.perf_counter() - start
+
+
+def run_frontier(crawl: list[list[str]]) -> tuple[float, int]:
+    frontier = URLFrontier(PREFIX)
+    start = time.perf_counter()
+    for page in crawl:
+        for link in page:
+            frontier.admit(link, 1)
+    return time.perf_counter() - start, len(frontier.seen)
+
+
+def main():
+    print(f"{'links':>8} {'legacy s':>10} {'frontier s':>11} "
+          f"{'frontier us/link':>17} {'admitted':>9}")
+
+    for size in SIZES:
+        crawl = synthetic_crawl(size)
+
+        legacy = run_legacy(crawl) if size <= LEGACY_MAX_SIZE else None
+        frontier, admitted = run_frontier(crawl)
+
+        legacy_text = f"{legacy:>10.2f}" if legacy is not None else f"{'skipped':>10}"
+        print(f"{size:>8} {legacy_text} {frontier:>11.3f} "
+              f"{frontier / size * 1e6:>17.2f} {admitted:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Offline benchmark for the retrieval tools.
+
+Runs the real search_intranet, search_event_tool and search_society_tool code
+against a fixture corpus, using an in-memory Qdrant, a deterministic embedding
+stub and a local reranker stub, so no network access is needed.
+
+Run with `python -m tests.retrieval_benchmark` from the repository root.
+"""
+import asyncio
+import importlib
+import json
+import os
+import statistics
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, List, Optional
+
+from llama_index.core import Document
+from llama_index.core.ingestion import IngestionPipeline
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import \
+    InMemorySpanExporter
+from qdrant_client import AsyncQdrantClient
+
+from scripts.event_scraping import EventModel, event_documents
+from scripts.society_scraping import SocietyModel, society_documents
+from utils.embedding_stub import HashingEmbedding, tokenize
+from utils.vector_store_helper import LLMTextQdrantVectorStore, vectors_config
+
+CORPUS_PATH = Path(__file__).parent / "fixtures" / "retrieval_corpus.json"
+
+STAGES = ["embed", "search", "rerank", "render"]
+
+# Tool name in the corpus -> module, function and collection
+TOOLS = {
+    "intranet": ("utils.intranet_search_tool", "search_intranet", "intranet"),
+    "events": ("utils.event_scrape_tool", "search_event_tool", "events"),
+    "societies": ("utils.society_scrape_tool", "search_society_tool", "societies"),
+}
+
+
+class OverlapReranker(BaseNodePostprocessor):
+    """
+    Scores nodes by the share of query words they contain.
+    Stands in for CohereRerank, with the same default top_n
+    """
+    model: str = "overlap"
+    top_n: int = 2
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OverlapReranker"
+
+    def _postprocess_nodes(
+            self,
+            nodes: List[NodeWithScore],
+            query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        query_tokens = set(tokenize(query_bundle.query_str))
+
+        scored = []
+        for node in nodes:
+            tokens = set(tokenize(node.node.get_content()))
+            score = len(query_tokens & tokens) / (len(query_tokens) or 1)
+            scored.append(NodeWithScore(node=node.node, score=score))
+
+        # Sorting is stable, so ties keep the vector search order
+        scored.sort(key=lambda node: node.score, reverse=True)
+
+        return scored[:self.top_n]
+
+
+def load_corpus(path: Path = CORPUS_PATH) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def corpus_documents(corpus: dict) -> dict[str, list[Document]]:
+    """
+    Build the documents for each collection, the same way the scrapers do
+    """
+    return {
+        "intranet": [
+            # Same metadata as the intranet crawler
+            Document(text=page["text"], extra_info={"URL": page["url"]})
+            for page in corpus["intranet"]
+        ],
+        "events": event_documents(
+            [EventModel(**event) for event in corpus["events"]]
+        ),
+        "societies": society_documents(
+            [SocietyModel(**society) for society in corpus["societies"]]
+        ),
+    }
+
+
+# Chunk sizes used by each ingestion script
+CHUNK_SIZES = {"intranet": 1024, "events": 1024, "societies": 2048}
+
+
+async def ingest(
+        aclient: AsyncQdrantClient,
+        collection_name: str,
+        documents: list[Document],
+        embed_model: HashingEmbedding,
+):
+    await aclient.create_collection(
+        collection_name,
+        vectors_config=vectors_config(embed_model.dimensions, "none"),
+    )
+
+    pipeline = IngestionPipeline(
+        transformations=[
+            SentenceSplitter(chunk_size=CHUNK_SIZES[collection_name], chunk_overlap=20),
+            embed_model,
+        ],
+        vector_store=LLMTextQdrantVectorStore(collection_name, aclient=aclient),
+    )
+
+    await pipeline.arun(documents=documents)
+
+
+@asynccontextmanager
+async def offline_tools(corpus: dict):
+    """
+    Ingest the corpus into an in-memory Qdrant, and point the tools at it
+    with the local stubs. The tools are restored afterwards.
+    :return: the search function for each tool name
+    """
+    # The tools check these when imported, they're never used
+    os.environ.setdefault("QDRANT_URL", "http://localhost:6333")
+    os.environ.setdefault("QDRANT_API_KEY", "offline")
+    os.environ.setdefault("OPENAI_API_KEY", "offline")
+
+    aclient = AsyncQdrantClient(location=":memory:")
+    embed_model = HashingEmbedding()
+
+    for collection_name, documents in corpus_documents(corpus).items():
+        await ingest(aclient, collection_name, documents, embed_model)
+
+    patches = {
+        "aclient": aclient,
+        "embed_model": embed_model,
+        "CohereRerank": OverlapReranker,
+    }
+
+    tools = {}
+    originals = []
+
+    for name, (module_name, function_name, _) in TOOLS.items():
+        module = importlib.import_module(module_name)
+        for attribute, value in patches.items():
+            originals.append((module, attribute, getattr(module, attribute)))
+            setattr(module, attribute, value)
+        tools[name] = getattr(module, function_name)
+
+    try:
+        yield tools
+    finally:
+        for module, attribute, value in originals:
+            setattr(module, attribute, value)
+        await aclient.close()
+
+
+span_exporter: Optional[InMemorySpanExporter] = None
+
+
+def get_span_exporter() -> InMemorySpanExporter:
+    """
+    Collect the spans of the tool stages in memory
+    """
+    global span_exporter
+
+    if span_exporter is None:
+        span_exporter = InMemorySpanExporter()
+
+        provider = trace.get_tracer_provider()
+        if not isinstance(provider, TracerProvider):
+            provider = TracerProvider()
+            trace.set_tracer_provider(provider)
+
+        provider.add_span_processor(SimpleSpanProcessor(span_exporter))
+
+    return span_exporter
+
+
+def score_results(results: list[str], relevant: list[str]) -> tuple[float, float]:
+    """
+    Score the results of a query, a result is relevant if it contains a label
+    :return: the recall and the reciprocal rank
+    """
+    found = {label for label in relevant if any(label in text for text in results)}
+
+    reciprocal_rank = 0.0
+    for rank, text in enumerate(results, start=1):
+        if any(label in text for label in relevant):
+            reciprocal_rank = 1 / rank
+            break
+
+    return len(found) / len(relevant), reciprocal_rank
+
+
+async def run_benchmark(corpus: dict) -> dict[str, dict[str, Any]]:
+    """
+    Run every labelled query through its tool
+    :return: recall@k, MRR and the median latency of each stage, per tool
+    """
+    exporter = get_span_exporter()
+    records = {name: [] for name in TOOLS}
+
+    async with offline_tools(corpus) as tools:
+        for item in corpus["queries"]:
+            exporter.clear()
+
+            start = time.perf_counter()
+            output = await tools[item["tool"]](item["query"])
+            total = (time.perf_counter() - start) * 1000
+
+            results = json.loads(output)["results"]
+            recall, reciprocal_rank = score_results(results, item["relevant"])
+
+            latency = {
+                span.name: (span.end_time - span.start_time) / 1e6
+                for span in exporter.get_finished_spans()
+                if span.name in STAGES
+            }
+            latency["total"] = total
+
+            records[item["tool"]].append({
+                "k": len(results),
+                "recall": recall,
+                "reciprocal_rank": reciprocal_rank,
+                "latency": latency,
+            })
+
+    summary = {}
+    for name, tool_records in records.items():
+        if not tool_records:
+            continue
+        summary[name] = {
+            "queries": len(tool_records),
+            "k": max(record["k"] for record in tool_records),
+            "recall": statistics.mean(record["recall"] for record in tool_records),
+            "mrr": statistics.mean(
+                record["reciprocal_rank"] for record in tool_records
+            ),
+            "latency_ms": {
+                stage: statistics.median(
+                    record["latency"][stage] for record in tool_records
+                )
+                for stage in STAGES + ["total"]
+            },
+        }
+
+    return summary
+
+
+def format_report(summary: dict[str, dict[str, Any]]) -> str:
+    stages = STAGES + ["total"]
+    lines = [
+        f"{'tool':<10} {'queries':>7} {'recall@k':>9} {'mrr':>6} "
+        + " ".join(f"{stage + ' ms':>10}" for stage in stages)
+    ]
+
+    for name, result in summary.items():
+        lines.append(
+            f"{name:<10} {result['queries']:>7} "
+            f"{result['recall']:>7.3f}@{result['k']} {result['mrr']:>6.3f} "
+            + " ".join(f"{result['latency_ms'][stage]:>10.2f}" for stage in stages)
+        )
+
+    return "\n".join(lines)
+
+
+async def main():
+    summary = await run_benchmark(load_corpus())
+    print(format_report(summary))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+import asyncio
+from contextlib import asynccontextmanager
+from unittest.mock import patch
+
+import pytest
+from fastapi import HTTPException
+
+from routes.authentication import AuthenticatedUser, require_admin
+from utils.admin_helper import AdminSet
+
+
+class AdminsPool:
+    """
+    The admins table, counting the queries
+    """
+
+    def __init__(self, admins: list[str]):
+        self.admins = admins
+        self.queries = 0
+
+    @asynccontextmanager
+    async def connection(self):
+        yield self
+
+    @asynccontextmanager
+    async def cursor(self):
+        yield self
+
+    async def execute(self, query: str):
+        self.queries += 1
+
+    async def fetchall(self):
+        return [(username,) for username in self.admins]
+
+
+class ListenConnection:
+    """
+    A connection receiving the notifications put in the queue
+    """
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.listening = asyncio.Event()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def execute(self, query: str):
+        assert query == "LISTEN admins_changed"
+
+    async def notifies(self):
+        self.listening.set()
+        while True:
+            yield await self.queue.get()
+
+
+@pytest.mark.asyncio
+async def test_admins_are_reloaded_on_change():
+    fake = AdminsPool(["c1234567"])
+    connection = ListenConnection()
+
+    async def connect():
+        return connection
+
+    admins = AdminSet(connect=connect)
+
+    with patch("utils.admin_helper.pool", fake):
+        await admins.start()
+        await connection.listening.wait()
+
+        for _ in range(10):
+            assert await admins.is_admin("c1234567")
+            assert not await admins.is_admin("c7654321")
+        assert fake.queries == 1
+
+        # The trigger on the admins table notifies the change
+        fake.admins.append("c7654321")
+        await connection.queue.put("admins_changed")
+        await asyncio.sleep(0)
+
+        assert await admins.is_admin("c7654321")
+        assert fake.queries == 2
+
+        await admins.close()
+
+
+@pytest.mark.asyncio
+async def test_admins_load_without_listener():
+    fake = AdminsPool(["c1234567"])
+
+    with patch("utils.admin_helper.pool", fake):
+        admins = AdminSet()
+        assert await admins.is_admin("c1234567")
+        assert await admins.is_admin("c1234567")
+
+    assert fake.queries == 1
+
+
+@pytest.mark.asyncio
+async def test_require_admin():
+    user = AuthenticatedUser(username="c1234567")
+
+    with patch("utils.admin_helper.pool", AdminsPool(["c1234567"])), \
+            patch("routes.authentication.admin_set", AdminSet()):
+        assert await require_admin(user) == user
+
+    with patch("utils.admin_helper.pool", AdminsPool([])), \
+            patch("routes.authentication.admin_set", AdminSet()):
+        with pytest.raises(HTTPException) as e:
+            await require_admin(user)
+        assert e.value.status_code == 403
@@ -0,0 +1,84 @@
+import time
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pytest
+from fastapi import HTTPException
+from jose import jwt
+
+from routes import authentication
+from routes.authentication import create_access_token, get_current_user, \
+    session, verify_token
+from tests.test_admin_helper import AdminsPool
+from utils.admin_helper import AdminSet
+
+
+def token(minutes: int = 30, **data) -> str:
+    return create_access_token({
+        "sub": "c1234567",
+        "exp": datetime.now(timezone.utc) + timedelta(minutes=minutes),
+        "sid": "session",
+        **data,
+    })
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    with patch.dict(authentication.token_cache, clear=True):
+        yield
+
+
+def test_verified_tokens_are_cached():
+    access_token = token()
+
+    with patch("routes.authentication.jwt.decode", wraps=jwt.decode) as decode:
+        for _ in range(10):
+            assert verify_token(access_token)["sid"] == "session"
+
+    decode.assert_called_once()
+    # Keyed by a hash, the token itself isn't kept
+    assert access_token not in authentication.token_cache
+
+
+def test_invalid_tokens_are_rejected():
+    assert verify_token(token() + "x") is None
+    assert verify_token(token(minutes=-1)) is None
+    assert not authentication.token_cache
+
+    # Cached tokens expire with the token
+    access_token = token()
+    payload = verify_token(access_token)
+    payload["exp"] = time.time() - 1
+    assert verify_token(access_token) is None
+    assert not authentication.token_cache
+
+
+def test_token_cache_is_bounded():
+    with patch("routes.authentication.TOKEN_CACHE_SIZE", 2):
+        for minutes in [10, 20, 30]:
+            verify_token(token(minutes=minutes))
+
+    assert len(authentication.token_cache) == 2
+
+
+@pytest.mark.asyncio
+async def test_current_user():
+    user = await get_current_user(token())
+    assert (user.username, user.session_id) == ("c1234567", "session")
+
+    with pytest.raises(HTTPException):
+        await get_current_user(token(minutes=-1))
+
+
+@pytest.mark.asyncio
+async def test_session_uses_cached_admins():
+    fake = AdminsPool(["c1234567"])
+
+    with patch("utils.admin_helper.pool", fake), \
+            patch("routes.authentication.admin_set", AdminSet()):
+        for _ in range(3):
+            response = await session(token())
+            assert response["valid"] and not response["needs_refresh"]
+            assert response["admin"]
+
+    assert fake.queries == 1
@@ -0,0 +1,109 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from utils.browser_pool import BrowserPool
+
+
+class FakeContext:
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.connected = True
+        self.contexts = []
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    async def new_context(self, **kwargs) -> FakeContext:
+        context = FakeContext()
+        self.contexts.append(context)
+        return context
+
+    async def close(self):
+        self.connected = False
+
+
+def fake_pool(**kwargs) -> tuple[BrowserPool, list[FakeBrowser]]:
+    launched = []
+
+    async def launch():
+        launched.append(FakeBrowser())
+        return launched[-1]
+
+    return BrowserPool(launch=launch, max_memory_mb=0, **kwargs), launched
+
+
+@pytest.mark.asyncio
+async def test_contexts_share_warm_browsers():
+    pool, launched = fake_pool(size=2, max_contexts=3)
+    await pool.start()
+
+    running = 0
+    most_running = 0
+
+    async def operation():
+        nonlocal running, most_running
+        async with pool.context() as context:
+            running += 1
+            most_running = max(most_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+        return context
+
+    contexts = await asyncio.gather(*[operation() for _ in range(10)])
+
+    # Every operation had its own context, closed afterwards
+    assert len({id(context) for context in contexts}) == 10
+    assert all(context.closed for context in contexts)
+    # On the two browsers launched at startup, with at most 3 at once
+    assert len(launched) == 2
+    assert most_running == 3
+    assert all(browser.contexts for browser in launched)
+
+
+@pytest.mark.asyncio
+async def test_browsers_are_recycled():
+    pool, launched = fake_pool(size=1, max_uses=3)
+
+    for _ in range(4):
+        async with pool.context():
+            pass
+
+    # Replaced after 3 uses
+    assert len(launched) == 2
+    assert not launched[0].is_connected()
+    assert len(launched[0].contexts) == 3
+
+    # A crashed browser is replaced
+    launched[1].connected = False
+    async with pool.context():
+        pass
+    assert len(launched) == 3
+
+    await pool.close()
+    assert not launched[2].is_connected()
+
+
+@pytest.mark.asyncio
+async def test_memory_is_sampled():
+    pool, launched = fake_pool(size=1, memory_check_every=3)
+    pool.max_memory = 1024
+
+    memory = AsyncMock(side_effect=[512, 2048])
+    with patch("utils.browser_pool.browser_memory", memory):
+        for _ in range(7):
+            async with pool.context():
+                pass
+
+    # Measured after the 3rd and 6th operations, replaced after the 6th
+    assert memory.await_count == 2
+    assert len(launched) == 2
+    assert len(launched[0].contexts) == 6
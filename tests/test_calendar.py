@@ -1,5 +1,9 @@
+from unittest.mock import patch
+
+import httpx
 import pytest
 
+from utils import timetables_helper
 from utils.timetables_helper import parse_ical
 
 
@@ -20,3 +24,50 @@ async def test_ical_extraction():
     assert first_event.location == "Abacws/5.05"
 
     assert "Optional Drop In" in first_event.description
+
+
+ICAL = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//Cardiff University//Timetable//EN
+BEGIN:VEVENT
+UID:1
+DTSTAMP:20240101T000000Z
+DTSTART:20240108T111000Z
+DTEND:20240108T140000Z
+LOCATION:Abacws/5.05
+DESCRIPTION:Optional Drop In
+SUMMARY:Lab
+END:VEVENT
+END:VCALENDAR
+"""
+
+
+@pytest.mark.asyncio
+async def test_ical_is_cached_and_revalidated():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request.headers.get("If-None-Match"))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, text=ICAL, headers={"ETag": '"v1"'})
+
+    url = "https://timetables.cardiff.ac.uk/ical/c1234567.ics"
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    with patch("utils.timetables_helper.client", client), \
+            patch.dict(timetables_helper.timetable_cache, clear=True):
+        first = await parse_ical(url)
+        # Follow-up questions don't download or parse the feed
+        with patch("utils.timetables_helper.parse_events") as parse_events:
+            assert await parse_ical(url) == first
+
+            # Once stale, the feed is revalidated and wasn't changed
+            with patch("utils.timetables_helper.TIMETABLE_CACHE_TTL", 0):
+                assert await parse_ical(url) == first
+
+        parse_events.assert_not_called()
+
+    assert requests == [None, '"v1"']
+    assert [(event.start, event.location) for event in first] == \
+        [("2024-01-08 11:10:00", "Abacws/5.05")]
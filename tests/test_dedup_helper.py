@@ -0,0 +1,126 @@
+import random
+
+import pytest
+from llama_index.core import Document
+from llama_index.core.node_parser import SentenceSplitter
+
+from utils.dedup_helper import MinHasher, NearDuplicateFilter
+from utils.embedding_pool import EmbeddingPool
+from utils.ingestion_helper import CONTENT_HASH_KEY, add_duplicates, \
+    apply_changes, stable_document
+from utils.vector_store_helper import stored_documents
+
+WORDS = ["library", "opening", "hours", "student", "card", "printing", "laptop",
+         "loan", "book", "room", "study", "exam", "revision", "quiet", "floor",
+         "campus", "wifi", "support", "desk", "renew", "fine", "return", "shelf"]
+
+
+def page_text(seed: int, length: int = 300) -> str:
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(length))
+
+
+def page(url: str, text: str) -> Document:
+    return stable_document(Document(text=text, extra_info={"URL": url}), url)
+
+
+def test_signature_estimates_similarity():
+    hasher = MinHasher()
+    text = page_text(0)
+
+    same = hasher.signature(text) == hasher.signature(text)
+    different = hasher.signature(text) == hasher.signature(page_text(1))
+
+    assert same.all()
+    assert different.mean() < 0.2
+
+
+def test_near_duplicate_filter():
+    splitter = SentenceSplitter(chunk_size=128, chunk_overlap=20)
+    duplicates = NearDuplicateFilter(splitter)
+    listing = page_text(0)
+
+    kept = [
+        document for document in [
+            page("https://intranet/library", listing),
+            # Printer-friendly copy with an extra header
+            page("https://intranet/library?print=1", "Print this page " + listing),
+            # Next page of the listing, the last few words are different
+            page("https://intranet/library?page=2",
+                 listing.rsplit(" ", 5)[0] + " page 2 of 3 next"),
+            page("https://intranet/it", page_text(1)),
+        ]
+        if not duplicates.is_duplicate(document)
+    ]
+
+    assert [document.id_ for document in kept] == \
+        ["https://intranet/library", "https://intranet/it"]
+    assert duplicates.report.documents == 2
+    assert duplicates.report.chunks >= 2
+    assert duplicates.report.tokens > 2 * 300
+
+
+@pytest.mark.asyncio
+async def test_duplicates_are_removed_from_store(aclient, embed_model, make_store):
+    store = await make_store("intranet", [CONTENT_HASH_KEY])
+    splitter = SentenceSplitter(chunk_size=1024, chunk_overlap=20)
+    pool = EmbeddingPool(embed_model, store)
+
+    listing = page_text(0)
+    documents = [page("https://intranet/library", listing),
+                 page("https://intranet/library?print=1", "Print " + listing)]
+
+    # Embedded before the filter
+    stored = await stored_documents(aclient, "intranet", [CONTENT_HASH_KEY])
+    changed, _ = await apply_changes(store, documents, stored)
+    await pool.run(splitter.get_nodes_from_documents(changed))
+
+    stored = await stored_documents(aclient, "intranet", [CONTENT_HASH_KEY])
+    changed, report = await apply_changes(store, documents, stored,
+                                          duplicates=NearDuplicateFilter(splitter))
+
+    assert changed == []
+    assert (report.skipped, report.deleted) == (1, 1)
+    assert list(await stored_documents(aclient, "intranet", [])) == \
+        ["https://intranet/library"]
+
+
+@pytest.mark.asyncio
+async def test_kept_duplicate_does_not_depend_on_order(aclient, embed_model,
+                                                       make_store):
+    store = await make_store("intranet", [CONTENT_HASH_KEY])
+    splitter = SentenceSplitter(chunk_size=1024, chunk_overlap=20)
+    pool = EmbeddingPool(embed_model, store)
+
+    listing = page_text(0)
+
+    async def ingest(urls: list[str]):
+        documents = [page(url, ("Print " if "print" in url else "") + listing)
+                     for url in urls]
+        stored = await stored_documents(aclient, "intranet", [CONTENT_HASH_KEY])
+        duplicates = NearDuplicateFilter(splitter)
+        add_duplicates(duplicates, documents, stored)
+
+        # One document per batch, like a crawl streamed in batches
+        reports = []
+        for document in documents:
+            changed, report = await apply_changes(store, [document], stored,
+                                                  delete_missing=False,
+                                                  duplicates=duplicates)
+            await pool.run(splitter.get_nodes_from_documents(changed))
+            reports.append(report)
+        return reports
+
+    # The printer-friendly copy was crawled first
+    await ingest(["https://intranet/library?print=1", "https://intranet/library"])
+    assert list(await stored_documents(aclient, "intranet", [])) == \
+        ["https://intranet/library"]
+    embedded = pool.report.tokens
+
+    for urls in (["https://intranet/library", "https://intranet/library?print=1"],
+                 ["https://intranet/library?print=1", "https://intranet/library"]):
+        reports = await ingest(urls)
+        assert sum(report.deleted for report in reports) == 0
+        assert sum(report.tokens_embedded for report in reports) == 0
+
+    assert pool.report.tokens == embedded
@@ -0,0 +1,109 @@
+import json
+from typing import List
+
+import httpx
+import openai
+import pytest
+from llama_index.core.schema import TextNode
+from llama_index.embeddings.openai import OpenAIEmbedding
+
+from utils.embedding_stub import HashingEmbedding
+from utils.embedding_pool import EmbeddingPool, pack_batches
+
+
+def chunks(count: int) -> list[TextNode]:
+    return [TextNode(text=f"Chunk {i} about the library opening hours.")
+            for i in range(count)]
+
+
+def rate_limit_error() -> openai.RateLimitError:
+    request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+    response = httpx.Response(429, headers={"retry-after": "0"}, request=request)
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+class FlakyEmbedding(HashingEmbedding):
+    """
+    Rate limited for the first requests
+    """
+    failures: int = 0
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        if self.failures:
+            self.failures -= 1
+            raise rate_limit_error()
+        return [self._embed(text) for text in texts]
+
+
+def test_pack_batches():
+    nodes = chunks(10)
+
+    batches = list(pack_batches(nodes, batch_tokens=30, batch_size=3))
+
+    assert sum(len(batch_nodes) for batch_nodes, _, _ in batches) == 10
+    for batch_nodes, texts, tokens in batches:
+        assert len(batch_nodes) == len(texts) <= 3
+        assert tokens <= 30
+
+
+@pytest.mark.asyncio
+async def test_pool_embeds_and_upserts(aclient, embed_model, make_store):
+    store = await make_store("events")
+
+    pool = EmbeddingPool(embed_model, store, concurrency=3,
+                         batch_tokens=50, batch_size=4)
+    # Each batch is upserted with one request
+    assert store.batch_size == 4
+    await pool.run(iter(chunks(25)))
+
+    assert (await aclient.count("events")).count == 25
+    assert pool.report.chunks == 25
+    assert pool.report.batches >= 7
+    assert pool.report.retries == 0
+
+
+@pytest.mark.asyncio
+async def test_pool_retries_rate_limits(aclient, make_store):
+    store = await make_store("events")
+
+    pool = EmbeddingPool(FlakyEmbedding(failures=2), store)
+    await pool.run(chunks(5))
+
+    assert (await aclient.count("events")).count == 5
+    assert pool.report.retries == 2
+
+
+@pytest.mark.asyncio
+async def test_pool_owns_openai_retries(aclient, make_store):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        requests.append(body)
+        # Rate limited twice, OpenAIEmbedding would retry these itself
+        if len(requests) <= 2:
+            return httpx.Response(429, headers={"retry-after": "0"},
+                                  json={"error": {"message": "Rate limit reached"}})
+        return httpx.Response(200, json={
+            "object": "list",
+            "model": body["model"],
+            "data": [
+                {"object": "embedding", "index": i, "embedding": [0.1] * 256}
+                for i in range(len(body["input"]))
+            ],
+            "usage": {"prompt_tokens": 1, "total_tokens": 1},
+        })
+
+    store = await make_store("events")
+    embed_model = OpenAIEmbedding(api_key="test", model="text-embedding-3-large",
+                                  dimensions=256)
+
+    pool = EmbeddingPool(embed_model, store,
+                         transport=httpx.MockTransport(handler))
+    await pool.run(chunks(5))
+
+    assert (await aclient.count("events")).count == 5
+    # Every rate limit reached the pool, none were retried inside the model
+    assert pool.report.retries == 2
+    assert len(requests) == 3
+    assert requests[-1]["dimensions"] == 256
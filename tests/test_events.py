@@ -1,6 +1,12 @@
+from datetime import date
+
 import pytest
 from httpx import AsyncClient
-from scripts.event_scraping import scrape_events, EventModel
+from llama_index.core.node_parser import SentenceSplitter
+
+from scripts.event_scraping import EVENT_KEYS, scrape_events, EventModel, \
+    event_date, event_documents, plan_events
+from utils.embedding_pool import EmbeddingPool
 
 
 @pytest.mark.asyncio
@@ -48,3 +54,65 @@ async def test_search_event_and_organisation():
             break
 
     assert found_event  # Ensure at least one event matches the search criteria
+
+
+def yoga(day: str, **changes) -> EventModel:
+    return EventModel(**{
+        "date": day, "organisation": "Yoga Society", "name": "Morning Yoga",
+        "time": "08:00 - 09:00", "location": "SU", "description": "Bring a mat.",
+        **changes,
+    })
+
+
+def test_event_date():
+    today = date(2024, 12, 20)
+
+    assert event_date("Monday 23rd December", today) == date(2024, 12, 23)
+    # Upcoming events in January are next year
+    assert event_date("Thursday 2nd January", today) == date(2025, 1, 2)
+    assert event_date("Friday 3 January 2025", today) == date(2025, 1, 3)
+    assert event_date("Today", today) == today
+    assert event_date("Soon", today) is None
+
+
+def test_event_id_is_stable_across_days():
+    def listed(day: str) -> EventModel:
+        return EventModel(date=day, organisation="Chess Society", name="Social",
+                          time="19:00 - 21:00", location="SU",
+                          description="Casual games")
+
+    # Scraped the day before as "Tomorrow", then with its date
+    yesterday = event_documents([listed("Tomorrow")], date(2024, 12, 20))
+    today = event_documents([listed("Saturday 21st December")], date(2024, 12, 21))
+
+    assert yesterday[0].id_ == today[0].id_
+    assert yesterday[0].metadata["start_date"] == "2024-12-21"
+
+
+@pytest.mark.asyncio
+async def test_plan_events(aclient, embed_model, make_store):
+    store = await make_store("events", EVENT_KEYS)
+    pool = EmbeddingPool(embed_model, store)
+    splitter = SentenceSplitter(chunk_size=1024, chunk_overlap=20)
+
+    async def sync(events, today):
+        documents, report = await plan_events(aclient, store, events, today)
+        await pool.run(splitter.get_nodes_from_documents(documents))
+        return report
+
+    report = await sync([yoga("Monday 6th May"), yoga("Monday 13th May")],
+                        date(2024, 5, 1))
+    assert report.added == 2
+
+    # The same events are skipped, a changed one is replaced,
+    # and the one of last week is removed
+    report = await sync([yoga("Monday 13th May", location="Sports Hall"),
+                         yoga("Monday 20th May")], date(2024, 5, 13))
+
+    assert (report.added, report.updated, report.skipped, report.deleted) == \
+        (1, 1, 0, 1)
+
+    points, _ = await aclient.scroll("events", with_payload=True)
+    assert sorted(point.payload["start_date"] for point in points) == \
+        ["2024-05-13", "2024-05-20"]
+    assert any("Sports Hall" in point.payload["llm_text"] for point in points)
@@ -0,0 +1,187 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import pytest
+
+from utils import auth_helper
+from utils.auth_helper import BadCredentialsException, LoginFlowError, \
+    LoginThrottledException, UniCredentials, http_login, login
+
+LOGIN_FORM = """
+<form id="login-form" method="post" action="/nidp/idff/sso?sid=0">
+  <input type="hidden" name="option" value="credential">
+  <fieldset>
+    <input id="username" name="Ecom_User_ID" type="text">
+    <input id="Ecom_Password" name="Ecom_Password" type="password">
+    <input type="submit" value="Login">
+  </fieldset>
+</form>
+"""
+
+
+def auto_post_form(action: str, field: str) -> str:
+    return (f'<body onload="document.forms[0].submit()">'
+            f'<form method="post" action="{action}">'
+            f'<input type="hidden" name="{field}" value="saml">'
+            f'<input type="hidden" name="RelayState" value="students"></form></body>')
+
+
+def sso_transport(requests: list) -> httpx.MockTransport:
+    """
+    The redirects and forms between the intranet, the idp and the login server
+    """
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(f"{request.method} {request.url.host}{request.url.path}")
+        host, path = request.url.host, request.url.path
+
+        if host == "intranet.cardiff.ac.uk" and path == "/students":
+            if "SQ_SYSTEM_SESSION" in request.headers.get("Cookie", ""):
+                return httpx.Response(200, text="<h1>Students</h1>")
+            return httpx.Response(302, headers={
+                "Location": "https://idp.cf.ac.uk/idp/profile/SAML2/POST/SSO"
+            })
+        if host == "idp.cf.ac.uk" and path == "/idp/profile/SAML2/POST/SSO":
+            return httpx.Response(200, text=auto_post_form(
+                "https://login.cardiff.ac.uk/nidp/saml2/sso", "SAMLRequest"
+            ))
+        if host == "login.cardiff.ac.uk" and path == "/nidp/saml2/sso":
+            return httpx.Response(302, headers={"Location": "/nidp/idff/sso?id=1"})
+        if host == "login.cardiff.ac.uk" and request.method == "GET":
+            return httpx.Response(200, text=LOGIN_FORM)
+        if host == "login.cardiff.ac.uk":
+            form = dict(httpx.QueryParams(request.content.decode()))
+            assert form["option"] == "credential"
+            if form["Ecom_Password"] != "password":
+                return httpx.Response(200, text='<div id="status-msg">'
+                                                'Login failed, please try again.'
+                                                '</div>' + LOGIN_FORM)
+            return httpx.Response(
+                200,
+                text="<script>top.location.href="
+                     "'https://idp.cf.ac.uk/idp/profile/SAML2/Redirect/SSO';</script>",
+            )
+        if host == "idp.cf.ac.uk" and path == "/idp/profile/SAML2/Redirect/SSO":
+            return httpx.Response(
+                200,
+                text=auto_post_form("https://intranet.cardiff.ac.uk/_saml/acs",
+                                    "SAMLResponse"),
+                headers=[("Set-Cookie", "JSESSIONID=session; Path=/idp"),
+                         ("Set-Cookie", "IPCZQX01=ipc; Domain=.cf.ac.uk; Path=/")],
+            )
+        if host == "intranet.cardiff.ac.uk" and path == "/_saml/acs":
+            return httpx.Response(302, headers={
+                "Location": "/students", "Set-Cookie": "SQ_SYSTEM_SESSION=sq; Path=/"
+            })
+        return httpx.Response(404)
+
+    return httpx.MockTransport(handler)
+
+
+@pytest.mark.asyncio
+async def test_http_login():
+    requests = []
+    credentials = UniCredentials(username="c1234567", password="password")
+
+    cookies = await http_login(credentials, sso_transport(requests))
+
+    assert cookies == {
+        "IPCZQX01": {"value": "ipc", "domain": ".cf.ac.uk", "path": "/"},
+        "JSESSIONID": {"value": "session", "domain": "idp.cf.ac.uk", "path": "/idp"},
+    }
+    assert "POST login.cardiff.ac.uk/nidp/idff/sso" in requests
+    assert requests[-1] == "GET intranet.cardiff.ac.uk/students"
+
+
+@pytest.mark.asyncio
+async def test_http_login_bad_credentials():
+    credentials = UniCredentials(username="c1234567", password="wrong")
+
+    with pytest.raises(BadCredentialsException,
+                       match="Login failed, please try again."):
+        await http_login(credentials, sso_transport([]))
+
+
+@pytest.mark.asyncio
+async def test_login_falls_back_to_browser():
+    credentials = UniCredentials(username="c1234567", password="password")
+    cookies = {"IPCZQX01": {"value": "ipc", "domain": ".cf.ac.uk", "path": "/"}}
+
+    with patch("utils.auth_helper.http_login",
+               AsyncMock(side_effect=LoginFlowError("Unexpected page"))), \
+            patch("utils.auth_helper.browser_login",
+                  AsyncMock(return_value=cookies)) as browser_login:
+        assert await login(credentials) == cookies
+
+    browser_login.assert_awaited_once_with(credentials)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_logins_share_one_attempt():
+    credentials = UniCredentials(username="c1234567", password="password")
+    cookies = {"IPCZQX01": {"value": "ipc", "domain": ".cf.ac.uk", "path": "/"}}
+
+    async def slow_login(_credentials):
+        await asyncio.sleep(0.01)
+        return cookies
+
+    with patch("utils.auth_helper.http_login",
+               AsyncMock(side_effect=slow_login)) as http:
+        results = await asyncio.gather(*[login(credentials) for _ in range(5)])
+        # Another password isn't given the cookies of the running login
+        other = UniCredentials(username="C1234567", password="other")
+        await asyncio.gather(login(credentials), login(other))
+
+    assert results == [cookies] * 5
+    assert http.await_count == 3
+    assert not auth_helper.logins_in_flight
+
+
+@pytest.mark.asyncio
+async def test_browser_logins_are_capped():
+    running = 0
+    most_running = 0
+
+    async def browser_login(_credentials):
+        nonlocal running, most_running
+        running += 1
+        most_running = max(most_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return {}
+
+    with patch("utils.auth_helper.http_login",
+               AsyncMock(side_effect=LoginFlowError("Unexpected page"))), \
+            patch("utils.auth_helper.browser_login", browser_login), \
+            patch("utils.auth_helper.browser_logins", asyncio.Semaphore(2)):
+        await asyncio.gather(*[
+            login(UniCredentials(username=f"c{i}", password="password"))
+            for i in range(6)
+        ])
+
+    assert most_running == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_logins_are_throttled():
+    credentials = UniCredentials(username="c1234567", password="wrong")
+
+    with patch.dict(auth_helper.login_failures, clear=True), \
+            patch("utils.auth_helper.MAX_LOGIN_FAILURES", 3), \
+            patch("utils.auth_helper.http_login",
+                  AsyncMock(side_effect=BadCredentialsException)) as http:
+        for _ in range(3):
+            with pytest.raises(BadCredentialsException):
+                await login(credentials)
+
+        with pytest.raises(LoginThrottledException) as e:
+            await login(credentials.model_copy(update={"password": "password"}))
+
+        assert 0 < e.value.retry_after <= auth_helper.LOGIN_FAILURE_WINDOW + 1
+        assert http.await_count == 3
+
+        # Until the failures leave the window
+        with patch("utils.auth_helper.LOGIN_FAILURE_WINDOW", 0):
+            with pytest.raises(BadCredentialsException):
+                await login(credentials)
@@ -0,0 +1,92 @@
+import json
+from datetime import date
+from unittest.mock import patch
+
+import pytest
+
+from scripts.ingest import main, parse_args
+from tests.retrieval_benchmark import CORPUS_PATH, load_corpus
+
+
+def test_parse_args():
+    assert parse_args([]).sources == ["intranet", "events", "societies",
+                                      "uni_website"]
+
+    with pytest.raises(SystemExit):
+        parse_args(["library"])
+    # The corpus is never ingested into the real collections
+    with pytest.raises(SystemExit):
+        parse_args(["--corpus", str(CORPUS_PATH)])
+
+
+class FixedDate(date):
+    @classmethod
+    def today(cls) -> date:
+        # The corpus has events from Monday 15 to Tuesday 23 April
+        return date(2024, 4, 18)
+
+
+@pytest.mark.asyncio
+async def test_dry_run(aclient):
+    corpus = load_corpus()
+    args = parse_args(["--dry-run", "--corpus", str(CORPUS_PATH)])
+
+    # The same collections for both runs
+    with patch("scripts.ingest.AsyncQdrantClient", return_value=aclient), \
+            patch("scripts.event_scraping.date", FixedDate):
+        reports = await main(args)
+
+        assert reports["intranet"].added == len(corpus["intranet"])
+        assert reports["societies"].added == len(corpus["societies"])
+        # The events from the 15th to the 17th are past
+        assert reports["events"].added == len(corpus["events"]) - 3
+        assert all(report.deleted == 0 for report in reports.values())
+
+        # Nothing changed, so nothing is embedded again
+        reports = await main(args)
+
+        assert all(report.added == report.updated == report.deleted == 0
+                   for report in reports.values())
+        assert reports["events"].skipped == len(corpus["events"]) - 3
+
+
+@pytest.mark.asyncio
+async def test_broken_listing_keeps_societies(aclient, tmp_path):
+    corpus = load_corpus()
+
+    with patch("scripts.ingest.AsyncQdrantClient", return_value=aclient):
+        await main(parse_args(["societies", "--dry-run", "--corpus",
+                               str(CORPUS_PATH)]))
+
+        # The listing came back empty
+        broken = tmp_path / "corpus.json"
+        broken.write_text(json.dumps({**corpus, "societies": []}))
+        reports = await main(parse_args(["societies", "--dry-run", "--corpus",
+                                         str(broken)]))
+
+    assert reports["societies"].deleted == 0
+    assert (await aclient.count("societies")).count == len(corpus["societies"])
+
+
+@pytest.mark.asyncio
+async def test_uni_website_remembers_lastmod(aclient, tmp_path):
+    corpus = tmp_path / "corpus.json"
+
+    async def ingest_pages(lastmod: str):
+        pages = [{"url": f"https://www.cardiff.ac.uk/{name}", "lastmod": lastmod,
+                  "text": f"# {name.title()}\n\nAbout the {name} of the university."}
+                 for name in ["fees", "study", "accommodation"]]
+        corpus.write_text(json.dumps({"uni_website": pages}))
+        reports = await main(parse_args(["uni_website", "--dry-run", "--corpus",
+                                         str(corpus)]))
+        return reports["uni_website"]
+
+    with patch("scripts.ingest.AsyncQdrantClient", return_value=aclient):
+        assert (await ingest_pages("2024-04-01")).added == 3
+
+        # The sitemap has a new date, but the text is the same
+        report = await ingest_pages("2024-04-02")
+
+    assert report.skipped == 3 and report.added == report.updated == 0
+    points, _ = await aclient.scroll("uni_website", with_payload=True)
+    assert {point.payload["lastmod"] for point in points} == {"2024-04-02"}
@@ -0,0 +1,71 @@
+import pytest
+from llama_index.core import Document
+from llama_index.core.ingestion import IngestionPipeline
+from llama_index.core.node_parser import SentenceSplitter
+
+from utils.embedding_stub import HashingEmbedding
+from utils.ingestion_helper import CONTENT_HASH_KEY, apply_changes, shrank_sharply, \
+    stable_document
+from utils.vector_store_helper import stored_documents
+
+
+def pages(texts: dict[str, str]) -> list[Document]:
+    return [
+        stable_document(Document(text=text, extra_info={"URL": url}), url)
+        for url, text in texts.items()
+    ]
+
+
+async def ingest(aclient, store, documents):
+    stored = await stored_documents(aclient, "intranet", [CONTENT_HASH_KEY])
+    changed, report = await apply_changes(store, documents, stored)
+
+    pipeline = IngestionPipeline(
+        transformations=[SentenceSplitter(chunk_size=1024), HashingEmbedding()],
+        vector_store=store,
+    )
+    await pipeline.arun(documents=changed)
+
+    return report
+
+
+async def stored_texts(aclient) -> list[str]:
+    points, _ = await aclient.scroll("intranet", with_payload=True, limit=100)
+    return sorted(point.payload["llm_text"] for point in points)
+
+
+@pytest.mark.asyncio
+async def test_incremental_ingestion(aclient, make_store):
+    store = await make_store("intranet", [CONTENT_HASH_KEY])
+
+    report = await ingest(aclient, store, pages({
+        "https://intranet/vpn": "Connect to the VPN with the GlobalProtect app.",
+        "https://intranet/wifi": "Use eduroam for wifi on campus.",
+        "https://intranet/old": "This page will be removed.",
+    }))
+    assert report.added == 3
+
+    report = await ingest(aclient, store, pages({
+        "https://intranet/vpn": "Connect to the VPN with the GlobalProtect app.",
+        "https://intranet/wifi": "Use eduroam for wifi, or The Cloud in halls.",
+    }))
+
+    assert (report.added, report.updated, report.skipped, report.deleted) == \
+        (0, 1, 1, 1)
+    assert report.tokens_saved > 0
+
+    texts = await stored_texts(aclient)
+    # The changed page replaced its old chunks, the deleted page is gone
+    assert len(texts) == 2
+    assert any("The Cloud" in text for text in texts)
+    assert not any("removed" in text for text in texts)
+    # The hash isn't shown to the model
+    assert not any(CONTENT_HASH_KEY in text for text in texts)
+
+
+def test_shrank_sharply():
+    assert not shrank_sharply(90, 100)
+    assert not shrank_sharply(10, 0)
+    # A broken listing, the stored documents are kept
+    assert shrank_sharply(0, 100)
+    assert shrank_sharply(40, 100)
@@ -0,0 +1,232 @@
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import pytest
+
+from utils.intranet_crawler import CrawlCheckpoint, IntranetCrawler, \
+    SessionExpiredError, URLFrontier, canonical_url
+
+PREFIX = "https://intranet.cardiff.ac.uk/students/"
+
+SITE = {
+    "/students": '<main class="content"><h1>Students</h1>'
+                 '<a href="/students/it">IT</a> <a href="/staff">Staff</a>'
+                 '<a href="https://example.com/students/">Elsewhere</a></main>',
+    "/students/it": '<main class="content">'
+                    '<p>Connect to the VPN with GlobalProtect.</p>'
+                    '<a href="/students/it/wifi#eduroam">Wifi</a></main>',
+    "/students/it/wifi": '<main class="content"><p>Use eduroam.</p>'
+                         '<a href="/students/it/wifi/deep">Deep</a></main>',
+    "/students/it/wifi/deep": '<main class="content"><p>Too deep.</p></main>',
+    "/students/app": '<html><body><div id="app"></div>'
+                     '<script src="/app.js"></script></body></html>',
+}
+
+
+def site_transport(requests: list):
+    def handler(request):
+        requests.append(request)
+        html = SITE.get(request.url.path)
+        if html is None:
+            return httpx.Response(404)
+        return httpx.Response(200, text=html, headers={"Content-Type": "text/html"})
+    return httpx.MockTransport(handler)
+
+
+@pytest.mark.asyncio
+async def test_crawl_follows_prefix_and_depth():
+    requests = []
+    crawler = IntranetCrawler(PREFIX, {"SQ_SYSTEM_SESSION": "session"}, max_depth=2,
+                              concurrency=4, transport=site_transport(requests))
+
+    documents = await crawler.crawl("https://intranet.cardiff.ac.uk/students")
+
+    urls = sorted(document.metadata["URL"] for document in documents)
+    assert urls == [
+        "https://intranet.cardiff.ac.uk/students",
+        "https://intranet.cardiff.ac.uk/students/it",
+        "https://intranet.cardiff.ac.uk/students/it/wifi",
+    ]
+    # The session cookie is sent with every request
+    assert all("SQ_SYSTEM_SESSION=session" in request.headers["Cookie"]
+               for request in requests)
+
+    it = next(document for document in documents
+              if document.metadata["URL"].endswith("/it"))
+    assert it.text.startswith("Connect to the VPN")
+
+
+@pytest.mark.asyncio
+async def test_crawl_renders_javascript_pages():
+    crawler = IntranetCrawler(PREFIX, {}, transport=site_transport([]))
+
+    rendered = ('<main class="content"><p>' + "Rendered by JavaScript. " * 5
+                + '</p></main>')
+
+    with patch.object(crawler, "render", AsyncMock(return_value=rendered)) as render:
+        documents = await crawler.crawl("https://intranet.cardiff.ac.uk/students/app")
+
+    render.assert_awaited_once_with("https://intranet.cardiff.ac.uk/students/app")
+    assert documents[0].text.startswith("Rendered by JavaScript.")
+
+
+def test_canonical_url():
+    assert canonical_url("HTTPS://Intranet.Cardiff.ac.uk:443/students/it#vpn") == \
+        "https://intranet.cardiff.ac.uk/students/it"
+    assert canonical_url(f"{PREFIX}search?q=vpn&a=1&utm_source=x") == \
+        f"{PREFIX}search?a=1&q=vpn"
+    assert canonical_url("https://intranet.cardiff.ac.uk") == \
+        "https://intranet.cardiff.ac.uk/"
+
+
+def test_frontier_admission():
+    frontier = URLFrontier(PREFIX, max_depth=2)
+
+    admitted = [frontier.admit(f"{PREFIX}search?q={i}", 1) for i in range(20)]
+
+    # Only 10 urls are kept for the same path with different queries
+    assert len([url for url in admitted if url]) == 10
+    # Equivalent urls are only admitted once
+    assert frontier.admit(f"{PREFIX}it", 1)
+    assert not frontier.admit(f"{PREFIX}it#vpn", 1)
+    # Prefix and depth rules
+    assert not frontier.admit("https://intranet.cardiff.ac.uk/staff", 1)
+    assert not frontier.admit(f"{PREFIX}deep", 3)
+
+    assert len(frontier) == 11
+    frontier.complete(f"{PREFIX}it")
+    assert len(frontier) == 10
+
+
+@pytest.mark.asyncio
+async def test_crawl_resumes_from_checkpoint(tmp_path):
+    checkpoint = CrawlCheckpoint(str(tmp_path))
+    start_url = "https://intranet.cardiff.ac.uk/students"
+
+    def expired_handler(request):
+        # The session expires before the wifi page
+        if request.url.path == "/students/it/wifi":
+            return httpx.Response(302, headers={
+                "Location": "https://login.cardiff.ac.uk/nidp/idff/sso"
+            })
+        if request.url.host == "login.cardiff.ac.uk":
+            return httpx.Response(200, text="Login")
+        return httpx.Response(200, text=SITE[request.url.path],
+                              headers={"Content-Type": "text/html"})
+
+    crawler = IntranetCrawler(PREFIX, {}, max_depth=2,
+                              transport=httpx.MockTransport(expired_handler))
+    with pytest.raises(SessionExpiredError):
+        await crawler.crawl(start_url, checkpoint)
+
+    assert not checkpoint.finished()
+    assert len(list(checkpoint.documents())) == 2
+
+    requests = []
+    crawler = IntranetCrawler(PREFIX, {}, max_depth=2,
+                              transport=site_transport(requests))
+    await crawler.crawl(start_url, checkpoint)
+
+    # Only the page left over is crawled again
+    assert [request.url.path for request in requests] == ["/students/it/wifi"]
+    assert checkpoint.finished()
+    assert sorted(document.metadata["URL"] for document in checkpoint.documents()) == [
+        start_url, f"{PREFIX}it", f"{PREFIX}it/wifi",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_crawl_skips_off_site_redirects(tmp_path):
+    checkpoint = CrawlCheckpoint(str(tmp_path))
+
+    def handler(request):
+        # The IT page moved to SharePoint
+        if request.url.path == "/students/it":
+            return httpx.Response(302, headers={
+                "Location": "https://cf.sharepoint.com/sites/it"
+            })
+        if request.url.host == "cf.sharepoint.com":
+            return httpx.Response(200, text="<p>SharePoint</p>",
+                                  headers={"Content-Type": "text/html"})
+        return httpx.Response(200, text=SITE[request.url.path],
+                              headers={"Content-Type": "text/html"})
+
+    crawler = IntranetCrawler(PREFIX, {}, max_depth=2,
+                              transport=httpx.MockTransport(handler))
+    await crawler.crawl("https://intranet.cardiff.ac.uk/students", checkpoint)
+
+    assert checkpoint.finished()
+    assert [document.metadata["URL"] for document in checkpoint.documents()] == [
+        "https://intranet.cardiff.ac.uk/students"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_failed_pages_keep_the_crawl_unfinished(tmp_path):
+    checkpoint = CrawlCheckpoint(str(tmp_path))
+    start_url = "https://intranet.cardiff.ac.uk/students"
+    requests = []
+
+    def handler(request):
+        requests.append(request.url.path)
+        # A slow hub page, its subtree can't be found
+        if request.url.path == "/students/it":
+            raise httpx.ReadTimeout("Timed out", request=request)
+        return httpx.Response(200, text=SITE[request.url.path],
+                              headers={"Content-Type": "text/html"})
+
+    crawler = IntranetCrawler(PREFIX, {}, max_depth=2,
+                              transport=httpx.MockTransport(handler))
+    await crawler.crawl(start_url, checkpoint)
+
+    # Retried, then left for the next run
+    assert requests.count("/students/it") == 3
+    assert not checkpoint.finished()
+
+    crawler = IntranetCrawler(PREFIX, {}, max_depth=2,
+                              transport=site_transport([]))
+    await crawler.crawl(start_url, checkpoint)
+
+    assert checkpoint.finished()
+    assert len(list(checkpoint.documents())) == 3
+
+
+@pytest.mark.asyncio
+async def test_deleted_pages_finish_the_crawl(tmp_path):
+    checkpoint = CrawlCheckpoint(str(tmp_path))
+
+    def handler(request):
+        if request.url.path == "/students/it":
+            return httpx.Response(404)
+        return httpx.Response(200, text=SITE[request.url.path],
+                              headers={"Content-Type": "text/html"})
+
+    crawler = IntranetCrawler(PREFIX, {}, max_depth=2,
+                              transport=httpx.MockTransport(handler))
+    await crawler.crawl("https://intranet.cardiff.ac.uk/students", checkpoint)
+
+    assert checkpoint.finished()
+    assert len(list(checkpoint.documents())) == 1
+
+
+@pytest.mark.asyncio
+async def test_malformed_links_are_skipped():
+    site = {
+        "/students": '<main class="content"><h1>Students</h1>'
+                     '<a href="http://[bad">Bad</a>'
+                     '<a href="https://intranet.cardiff.ac.uk:abc/students/x">Port</a>'
+                     '<a href="/students/it">IT</a></main>',
+        "/students/it": '<main class="content"><p>IT services</p></main>',
+    }
+
+    def handler(request):
+        return httpx.Response(200, text=site[request.url.path],
+                              headers={"Content-Type": "text/html"})
+
+    crawler = IntranetCrawler(PREFIX, {}, transport=httpx.MockTransport(handler))
+    documents = await crawler.crawl("https://intranet.cardiff.ac.uk/students")
+
+    assert sorted(document.metadata["URL"] for document in documents) == [
+        "https://intranet.cardiff.ac.uk/students",
+        "https://intranet.cardiff.ac.uk/students/it",
+    ]
@@ -0,0 +1,23 @@
+import pytest
+
+from tests.retrieval_benchmark import STAGES, load_corpus, run_benchmark, \
+    format_report
+
+
+@pytest.mark.asyncio
+async def test_retrieval_benchmark():
+    summary = await run_benchmark(load_corpus())
+
+    print(format_report(summary))
+
+    # Every tool should have been run
+    assert set(summary) == {"intranet", "events", "societies"}
+
+    for result in summary.values():
+        # The fixture queries should find their labelled documents
+        assert result["recall"] >= 0.9
+        assert result["mrr"] >= 0.9
+
+        # Each stage of the tool should be timed
+        for stage in STAGES:
+            assert stage in result["latency_ms"]
@@ -1,6 +1,20 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import httpx
 import pytest
-from unittest.mock import patch, Mock
-from utils.scrape_uni_website import searxng_search
+from unittest.mock import patch, Mock, AsyncMock
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from utils.html_helper import html_to_markdown
+from utils.scrape_uni_website import searxng_search, get_text, CachedPage, \
+    transform_data, page_document
+from scripts.uni_website_scraping import parse_sitemap, plan_refresh, stream_pages
+from utils.uni_website_search_tool import search_uni_website, split_passages, \
+    select_passages
 
 
 @pytest.mark.asyncio
@@ -28,3 +42,384 @@ async def test_searxng_search():
 
         # Check the return value
         assert expected_result == normalized_expected_result
+
+
+PAGE_URL = "https://www.cardiff.ac.uk/study"
+PAGE_HTML = "<html><body><nav>Menu</nav><main><h1>Study</h1></main></body></html>"
+
+
+def mock_client(handler):
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+@pytest.mark.asyncio
+async def test_get_text_caches_page():
+    def handler(request):
+        return httpx.Response(200, text=PAGE_HTML, headers={"ETag": '"v1"'})
+
+    with patch("utils.scrape_uni_website.client", mock_client(handler)), \
+            patch("utils.scrape_uni_website.get_cached_page", AsyncMock(return_value=None)), \
+            patch("utils.scrape_uni_website.save_cached_page", AsyncMock()) as save:  # noqa
+        document = await get_text(PAGE_URL)
+
+    assert "Study" in document.text
+    # Navigation is removed from the page
+    assert "Menu" not in document.text
+
+    page = save.call_args.args[0]
+    assert page.url == PAGE_URL
+    assert page.etag == '"v1"'
+    assert page.markdown == document.text
+
+
+@pytest.mark.asyncio
+async def test_get_text_fresh_cache_skips_request():
+    cached = CachedPage(url=PAGE_URL, markdown="# Cached", fetched_at=int(time.time()))
+
+    def handler(request):
+        raise AssertionError("Fresh pages shouldn't be fetched")
+
+    with patch("utils.scrape_uni_website.client", mock_client(handler)), \
+            patch("utils.scrape_uni_website.get_cached_page", AsyncMock(return_value=cached)):  # noqa
+        document = await get_text(PAGE_URL)
+
+    assert document.text == "# Cached"
+
+
+@pytest.mark.asyncio
+async def test_get_text_revalidates_stale_cache():
+    cached = CachedPage(url=PAGE_URL, markdown="# Cached", etag='"v1"',
+                        last_modified="Mon, 01 Apr 2024 00:00:00 GMT", fetched_at=0)
+
+    def handler(request):
+        assert request.headers["If-None-Match"] == '"v1"'
+        assert request.headers["If-Modified-Since"] == cached.last_modified
+        return httpx.Response(304)
+
+    with patch("utils.scrape_uni_website.client", mock_client(handler)), \
+            patch("utils.scrape_uni_website.get_cached_page", AsyncMock(return_value=cached)), \
+            patch("utils.scrape_uni_website.touch_cached_page", AsyncMock()) as touch:  # noqa
+        document = await get_text(PAGE_URL)
+
+    # The page didn't change, so the cached markdown is used
+    assert document.text == "# Cached"
+    touch.assert_awaited_once()
+
+
+FIXTURES_PATH = Path(__file__).parent / "fixtures" / "uni_website"
+
+
+def test_html_to_markdown_prunes_page_chrome():
+    html = (FIXTURES_PATH / "fees.html").read_bytes()
+    markdown = html_to_markdown(html, "https://www.cardiff.ac.uk/study/fees")
+
+    assert markdown.startswith("# Tuition fees")
+    # Header, navigation, buttons and the footer are removed
+    assert "Research" not in markdown
+    assert "Apply now" not in markdown
+    assert "registered charity" not in markdown
+    assert "window.dataLayer" not in markdown
+
+
+def test_html_to_markdown_structure():
+    html = (FIXTURES_PATH / "fees.html").read_bytes()
+    markdown = html_to_markdown(html, "https://www.cardiff.ac.uk/study/fees")
+
+    assert "| Fee status | Full time | Part time (per 10 credits) |" in markdown
+    assert "| International | £24,450 | £2,040 |" in markdown
+    assert "3. Pay any fees not covered by a loan" in markdown
+    assert "   * January" in markdown
+    assert "[Student Finance](https://www.gov.uk/student-finance)" in markdown
+    # Relative links are made absolute
+    assert "(https://www.cardiff.ac.uk/accessibility)" in markdown
+
+
+def test_html_to_markdown_malformed_link():
+    html = '<main><p>See <a href="http://[bad">the fees</a> page.</p></main>'
+
+    markdown = html_to_markdown(html, "https://www.cardiff.ac.uk/study/fees")
+
+    assert markdown.strip() == "See [the fees](http://[bad) page."
+
+
+@pytest.mark.asyncio
+async def test_get_text_skips_large_pages():
+    def handler(request):
+        return httpx.Response(200, content=b"<p>" + b"a" * 2048 + b"</p>")
+
+    with patch("utils.scrape_uni_website.client", mock_client(handler)), \
+            patch("utils.scrape_uni_website.MAX_PAGE_BYTES", 1024), \
+            patch("utils.scrape_uni_website.get_cached_page", AsyncMock(return_value=None)), \
+            patch("utils.scrape_uni_website.save_cached_page", AsyncMock()) as save:  # noqa
+        document = await get_text(PAGE_URL)
+
+    assert document is None
+    save.assert_not_awaited()
+
+
+def slow_get_text(delays: dict):
+    """
+    Stand in for get_text, each page arrives after its delay
+    """
+    async def get_text(link):
+        await asyncio.sleep(delays[link])
+        return page_document(link, link)
+    return get_text
+
+
+@pytest.mark.asyncio
+async def test_transform_data_cancels_stragglers():
+    delays = {f"{PAGE_URL}/{i}": 0.01 * i for i in range(5)}
+    delays[f"{PAGE_URL}/slow"] = 10
+
+    with patch("utils.scrape_uni_website.get_text", slow_get_text(delays)):
+        start = time.perf_counter()
+        documents = await transform_data(list(delays), enough=3, deadline=5)
+
+    assert time.perf_counter() - start < 1
+    assert [document.text for document in documents] == [
+        f"{PAGE_URL}/0", f"{PAGE_URL}/1", f"{PAGE_URL}/2"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_transform_data_deadline():
+    delays = {f"{PAGE_URL}/slow": 10, f"{PAGE_URL}/fast": 0}
+
+    with patch("utils.scrape_uni_website.get_text", slow_get_text(delays)):
+        documents = await transform_data(list(delays), enough=2, deadline=0.1)
+
+    # The slow page missed the deadline
+    assert [document.text for document in documents] == [f"{PAGE_URL}/fast"]
+
+
+@pytest.mark.asyncio
+async def test_transform_data_host_concurrency():
+    active = 0
+    most_active = 0
+
+    async def get_text(link):
+        nonlocal active, most_active
+        active += 1
+        most_active = max(most_active, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return page_document(link, link)
+
+    links = [f"{PAGE_URL}/{i}" for i in range(10)]
+
+    with patch("utils.scrape_uni_website.get_text", get_text), \
+            patch("utils.scrape_uni_website.HOST_CONCURRENCY", 2):
+        documents = await transform_data(links, enough=10, deadline=5)
+
+    assert len(documents) == 10
+    assert most_active == 2
+
+
+def searxng_client(delays: dict, links: dict):
+    """
+    Mock SearXNG instances, each answers after its delay with its links
+    """
+    async def handler(request):
+        host = request.url.host
+        await asyncio.sleep(delays[host])
+        if links[host] is None:
+            return httpx.Response(502)
+        return httpx.Response(200, json={
+            "results": [{"url": link} for link in links[host]]
+        })
+    return mock_client(handler)
+
+
+@pytest.mark.asyncio
+async def test_searxng_search_hedges_slow_instance():
+    client = searxng_client(
+        delays={"slow.test": 10, "fast.test": 0},
+        links={"slow.test": ["https://slow"], "fast.test": ["https://fast"]},
+    )
+
+    with patch("utils.scrape_uni_website.client", client), \
+            patch("utils.scrape_uni_website.SEARX_URLS",
+                  ["http://slow.test", "http://fast.test"]), \
+            patch("utils.scrape_uni_website.SEARX_HEDGE_DELAY", 0.05), \
+            patch("utils.scrape_uni_website.search_cache", OrderedDict()):
+        start = time.perf_counter()
+        links = await searxng_search("fees")
+
+    assert links == ["https://fast"]
+    assert time.perf_counter() - start < 1
+
+
+@pytest.mark.asyncio
+async def test_searxng_search_falls_back_and_caches():
+    requests = []
+
+    async def handler(request):
+        requests.append(request.url.host)
+        if request.url.host == "broken.test":
+            return httpx.Response(429)
+        return httpx.Response(200, json={"results": [{"url": "https://fees"}]})
+
+    with patch("utils.scrape_uni_website.client", mock_client(handler)), \
+            patch("utils.scrape_uni_website.SEARX_URLS",
+                  ["http://broken.test", "http://working.test"]), \
+            patch("utils.scrape_uni_website.search_cache", OrderedDict()):
+        first = await searxng_search("Tuition  fees")
+        second = await searxng_search("tuition fees")
+
+    assert first == second == ["https://fees"]
+    # The second search is answered from the cache
+    assert requests == ["broken.test", "working.test"]
+
+
+@pytest.mark.asyncio
+async def test_searxng_search_without_instances():
+    with patch("utils.scrape_uni_website.SEARX_URLS", []), \
+            patch("utils.scrape_uni_website.search_cache", OrderedDict()):
+        assert await searxng_search("fees") == []
+
+
+TOOL = "utils.uni_website_search_tool"
+BANNER = "Cardiff University uses cookies to improve your experience."
+
+
+@pytest.mark.asyncio
+async def test_search_uni_website_returns_passages(reranker):
+    pages = [
+        page_document(f"{PAGE_URL}/fees", BANNER + "\n\n" + "\n\n".join(
+            ["Tuition fees for international students are £24,450 a year."]
+            + [f"Section {i} about accommodation and halls." * 20 for i in range(5)]
+        )),
+        page_document(f"{PAGE_URL}/apply", BANNER + "\n\n"
+                      + "Apply through UCAS before the January deadline."),
+    ]
+
+    links = [page.extra_info["Source"] for page in pages]
+
+    with patch(f"{TOOL}.search_index", AsyncMock(return_value=[])), \
+            patch(f"{TOOL}.searxng_search", AsyncMock(return_value=links)), \
+            patch(f"{TOOL}.transform_data",
+                  AsyncMock(return_value=pages)), \
+            patch(f"{TOOL}.CohereRerank", reranker):
+        output = await search_uni_website("tuition fees international students")
+
+    results = json.loads(output)["results"]
+
+    # The best passage comes first, with its source, not the whole page
+    assert "£24,450" in results[0]
+    assert f"Source: {PAGE_URL}/fees" in results[0]
+    assert "Section 4" not in results[0]
+
+
+def test_split_passages_dedupes_across_pages():
+    pages = [
+        page_document(f"{PAGE_URL}/{i}", f"{BANNER}\n\nPage {i} content.")
+        for i in range(3)
+    ]
+
+    passages = split_passages(pages)
+    texts = [passage.get_content() for passage in passages]
+
+    assert len(passages) == 3
+    assert len(set(texts)) == 3
+    assert [passage.metadata["Source"] for passage in passages] == [
+        f"{PAGE_URL}/{i}" for i in range(3)
+    ]
+
+
+def test_select_passages_token_cap():
+    results = [
+        NodeWithScore(node=TextNode(text=text))
+        for text in ["word " * 50, "word " * 200, "word " * 20]
+    ]
+
+    selected = select_passages(results, token_cap=100)
+
+    # The long passage doesn't fit, the shorter one after it does
+    assert [len(text.split()) for text in selected] == [50, 20]
+
+
+@pytest.mark.asyncio
+async def test_search_uni_website_uses_index(reranker):
+    indexed = [
+        NodeWithScore(node=TextNode(text=text), score=0.5)
+        for text in [
+            "Source: https://www.cardiff.ac.uk/fees\n\nTuition fees are £9,000.",
+            "Source: https://www.cardiff.ac.uk/halls\n\nHalls of residence.",
+        ]
+    ]
+
+    with patch(f"{TOOL}.search_index",
+               AsyncMock(return_value=indexed)), \
+            patch(f"{TOOL}.searxng_search", AsyncMock()) as search, \
+            patch(f"{TOOL}.CohereRerank", reranker):
+        output = await search_uni_website("tuition fees")
+
+    results = json.loads(output)["results"]
+
+    assert "£9,000" in results[0]
+    # The live search isn't needed
+    search.assert_not_awaited()
+
+
+def test_parse_sitemap():
+    index = b"""<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc>https://www.cardiff.ac.uk/sitemap-study.xml</loc></sitemap>
+</sitemapindex>"""
+    urlset = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>https://www.cardiff.ac.uk/study</loc><lastmod>2024-04-01</lastmod></url>
+  <url><loc>https://www.cardiff.ac.uk/fees</loc></url>
+</urlset>"""
+
+    assert parse_sitemap(index) == (["https://www.cardiff.ac.uk/sitemap-study.xml"], {})
+    assert parse_sitemap(urlset) == ([], {
+        "https://www.cardiff.ac.uk/study": "2024-04-01",
+        "https://www.cardiff.ac.uk/fees": None,
+    })
+
+
+def test_plan_refresh():
+    pages = {"unchanged": "2024-04-01", "changed": "2024-04-02",
+             "new": "2024-04-01", "undated": None}
+    stored = {"unchanged": {"lastmod": "2024-04-01"},
+              "changed": {"lastmod": "2024-04-01"},
+              "undated": {"lastmod": None},
+              "removed": {"lastmod": "2024-01-01"}}
+
+    to_fetch, to_delete = plan_refresh(pages, stored)
+
+    assert to_fetch == ["changed", "new", "undated"]
+    assert to_delete == ["removed"]
+
+
+@pytest.mark.asyncio
+async def test_stream_pages_fetches_ahead_of_the_consumer():
+    in_flight = 0
+    most_in_flight = 0
+
+    async def handler(request):
+        nonlocal in_flight, most_in_flight
+        in_flight += 1
+        most_in_flight = max(most_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        if request.url.path == "/missing":
+            return httpx.Response(404)
+        return httpx.Response(200, html=PAGE_HTML)
+
+    urls = [f"https://www.cardiff.ac.uk/page-{i}" for i in range(10)] + \
+        ["https://www.cardiff.ac.uk/missing"]
+    pages = {url: "2024-04-01" for url in urls}
+
+    documents = []
+    async with mock_client(handler) as client:
+        async for document in stream_pages(client, pages, urls, concurrency=3):
+            documents.append(document)
+            # A slow consumer, e.g. embedding the batch
+            await asyncio.sleep(0.01)
+
+    assert most_in_flight <= 3
+    assert sorted(document.id_ for document in documents) == sorted(urls[:-1])
+    assert documents[0].metadata["lastmod"] == "2024-04-01"
@@ -0,0 +1,101 @@
+import time
+from contextlib import asynccontextmanager
+from unittest.mock import patch
+
+import pytest
+
+from routes.authentication import AuthenticatedUser
+from utils import session_store
+
+COOKIES = {"IPCZQX01": {"value": "ipc", "domain": ".cf.ac.uk", "path": "/"}}
+
+
+class FakeCursor:
+    def __init__(self, rows: dict, queries: list):
+        self.rows = rows
+        self.queries = queries
+        self.result = None
+
+    async def execute(self, query: str, params: tuple):
+        self.queries.append(query.split()[0])
+        if query.startswith("INSERT"):
+            session_id, _, cookies, expiry = params
+            self.rows[session_id] = (cookies, expiry)
+        elif query.startswith("SELECT"):
+            session_id, now = params
+            row = self.rows.get(session_id)
+            self.result = row if row and row[1] > now else None
+
+    async def fetchone(self):
+        return self.result
+
+
+class FakePool:
+    """
+    The user_sessions table, in memory
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.queries = []
+
+    @asynccontextmanager
+    async def connection(self):
+        yield self
+
+    @asynccontextmanager
+    async def cursor(self):
+        yield FakeCursor(self.rows, self.queries)
+
+
+@pytest.fixture
+def fake_pool():
+    fake = FakePool()
+    with patch("utils.session_store.pool", fake), \
+            patch.dict(session_store.session_cache, clear=True):
+        yield fake
+
+
+@pytest.mark.asyncio
+async def test_sessions_are_loaded_lazily(fake_pool):
+    expiry = int(time.time()) + 60
+    session_id = await session_store.create_session("c1234567", COOKIES, expiry)
+
+    # Recently created sessions don't need the database
+    assert await session_store.load_cookies(session_id) == COOKIES
+    assert fake_pool.queries == ["DELETE", "INSERT"]
+
+    # Another worker, or after the session left the cache
+    session_store.session_cache.clear()
+    user = AuthenticatedUser(username="c1234567", session_id=session_id)
+    assert await user.get_cookies() == COOKIES
+    assert await user.get_cookies() == COOKIES
+    assert fake_pool.queries == ["DELETE", "INSERT", "SELECT"]
+
+
+@pytest.mark.asyncio
+async def test_expired_sessions(fake_pool):
+    session_id = await session_store.create_session("c1234567", COOKIES,
+                                                    int(time.time()) - 1)
+
+    assert await session_store.load_cookies(session_id) is None
+    assert await session_store.load_cookies("unknown") is None
+
+    user = AuthenticatedUser(username="c1234567", session_id=session_id)
+    with pytest.raises(Exception, match="Session expired"):
+        await user.get_cookies()
+
+
+@pytest.mark.asyncio
+async def test_legacy_tokens_carry_cookies():
+    user = AuthenticatedUser(username="c1234567", cookies=COOKIES)
+
+    assert await user.get_cookies() == COOKIES
+
+
+def test_cache_is_bounded(fake_pool):
+    with patch("utils.session_store.SESSION_CACHE_SIZE", 2):
+        for session_id in ["a", "b", "c"]:
+            session_store.cache_session(session_id, COOKIES, 0)
+
+    assert list(session_store.session_cache) == ["b", "c"]
@@ -1,8 +1,11 @@
 import asyncio
+from unittest.mock import patch
 
+import httpx
 import pytest
 from httpx import AsyncClient
-from scripts.society_scraping import scrape_links, scrape_content, SocietyModel
+from scripts.society_scraping import scrape_links, scrape_content, SocietyModel, \
+    stream_societies
 
 
 @pytest.mark.asyncio
@@ -87,3 +90,38 @@ async def test_search_specific_society_by_description():
 
     # Ensure a society with the specific description is found
     assert found_society_by_description, "Society with specified description not found"
+
+
+@pytest.mark.asyncio
+async def test_stream_societies():
+    requests = []
+    failed = set()
+
+    def handler(request):
+        requests.append(request.url.path)
+        name = request.url.path.strip("/").split("/")[-1]
+        if name == "broken":
+            return httpx.Response(500)
+        # The first request of each page is rate limited
+        if name not in failed:
+            failed.add(name)
+            return httpx.Response(429)
+        html = (f'<h1>{name.title()} Society</h1>'
+                f'<div id="soc-content"><p>About {name}</p></div>')
+        return httpx.Response(200, text=html)
+
+    links = [f"https://www.cardiffstudents.com/activities/society/{name}/"
+             for name in ["yoga", "chess", "broken"]]
+
+    # No waiting between retries
+    with patch("scripts.society_scraping.random.uniform", return_value=0):
+        async with AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            societies = [society async for society in
+                         stream_societies(client, links, concurrency=2)]
+
+    assert sorted(society.organisation for society in societies) == \
+        ["Chess Society", "Yoga Society"]
+    assert all(society.content == f"About {society.link.split('/')[-2]}"
+               for society in societies)
+    # The broken page is tried once, then retried 3 times
+    assert requests.count("/activities/society/broken/") == 4
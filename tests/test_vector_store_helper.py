@@ -0,0 +1,120 @@
+import pytest
+from llama_index.core.schema import MetadataMode, NodeRelationship, \
+    RelatedNodeInfo, TextNode
+from llama_index.vector_stores.qdrant import QdrantVectorStore
+from qdrant_client import models
+
+from utils.vector_store_helper import embedding_kwargs, ensure_collection, \
+    quantization_config, search_llm_text, search_params, stored_documents, \
+    LLMTextQdrantVectorStore
+
+
+def test_embedding_kwargs():
+    # Full size embeddings shouldn't send the dimensions parameter
+    assert embedding_kwargs(3072) == {"model": "text-embedding-3-large"}
+    assert embedding_kwargs(256) == {
+        "model": "text-embedding-3-large",
+        "dimensions": 256
+    }
+
+
+def test_quantization_config():
+    assert quantization_config("none") is None
+    assert isinstance(quantization_config("scalar"), models.ScalarQuantization)
+    assert isinstance(quantization_config("binary"), models.BinaryQuantization)
+
+    with pytest.raises(ValueError):
+        quantization_config("product")
+
+
+def test_search_params_rescore():
+    assert search_params("none") is None
+
+    params = search_params("binary", 3.0)
+    assert params.quantization.rescore
+    assert params.quantization.oversampling == 3.0
+
+
+@pytest.mark.asyncio
+async def test_search_quantized_collection(aclient):
+    assert await ensure_collection(aclient, "intranet", 4, "scalar")
+    # Collection already exists, so it's left untouched
+    assert not await ensure_collection(aclient, "intranet", 4, "scalar")
+    # Vectors of another size can't be added to it
+    with pytest.raises(Exception, match="4 dimension vectors, not 8"):
+        await ensure_collection(aclient, "intranet", 8, "scalar")
+
+    store = LLMTextQdrantVectorStore("intranet", aclient=aclient)
+
+    nodes = [
+        TextNode(text="vpn", embedding=[1.0, 0.0, 0.0, 0.0]),
+        TextNode(text="library", embedding=[0.0, 1.0, 0.0, 0.0]),
+    ]
+    await store.async_add(nodes)
+
+    results = await search_llm_text(
+        aclient, "intranet", [0.9, 0.1, 0.0, 0.0], 1, search_params("scalar")
+    )
+
+    assert len(results) == 1
+    assert results[0].node.get_content() == "vpn"
+
+
+@pytest.mark.asyncio
+async def test_llm_text_payload(aclient):
+    store = LLMTextQdrantVectorStore("events", aclient=aclient, payload_keys=["date"])
+
+    node = TextNode(
+        text="Yoga Society",
+        metadata={"date": "2024-04-01", "location": "SU"},
+        embedding=[1.0, 0.0],
+    )
+    await store.async_add([node])
+
+    points, _ = await aclient.scroll("events", with_payload=True)
+    payload = points[0].payload
+
+    # Only the rendered text, kept metadata and document ids are stored
+    assert payload["llm_text"] == node.get_content(MetadataMode.LLM)
+    assert payload["date"] == "2024-04-01"
+    assert "_node_content" not in payload
+    assert "location" not in payload
+
+
+@pytest.mark.asyncio
+async def test_search_legacy_payload(aclient):
+    # Nodes stored before the text was pre-rendered
+    store = QdrantVectorStore("societies", aclient=aclient)
+    node = TextNode(
+        text="Yoga Society",
+        metadata={"URL": "https://example.com"},
+        embedding=[1.0, 0.0],
+    )
+    await store.async_add([node])
+
+    results = await search_llm_text(aclient, "societies", [1.0, 0.0], 1)
+
+    assert results[0].node.get_content() == node.get_content(MetadataMode.LLM)
+
+
+@pytest.mark.asyncio
+async def test_stored_documents(aclient):
+    # Nothing is stored before the collection exists
+    assert await stored_documents(aclient, "uni_website", ["lastmod"]) == {}
+
+    store = LLMTextQdrantVectorStore("uni_website", aclient=aclient,
+                                     payload_keys=["lastmod"])
+
+    nodes = []
+    for url in ["https://a", "https://a", "https://b"]:
+        node = TextNode(text=url, metadata={"lastmod": "2024-04-01"},
+                        embedding=[1.0, 0.0])
+        node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id=url)
+        nodes.append(node)
+    await store.async_add(nodes)
+
+    documents = await stored_documents(aclient, "uni_website", ["lastmod"])
+
+    # One entry per document, not per chunk
+    assert set(documents) == {"https://a", "https://b"}
+    assert documents["https://a"]["lastmod"] == "2024-04-01"
@@ -0,0 +1,82 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, Optional
+
+from psycopg import AsyncConnection
+
+from utils.db import connection_uri, pool
+
+# Sent by the trigger on the admins table, see 8-admins-notify.xml
+ADMINS_CHANNEL = "admins_changed"
+# Wait before listening again if the connection is lost
+ADMIN_LISTEN_RETRY_SECONDS = int(os.getenv("ADMIN_LISTEN_RETRY_SECONDS", 5))
+
+
+class AdminSet:
+    """
+    The usernames of the admins, kept in memory and reloaded
+    when the admins table changes
+    """
+
+    def __init__(self, connect: Optional[Callable[[], Awaitable]] = None):
+        """
+        :param connect: opens the connection listening for changes,
+        an autocommit connection to the database by default
+        """
+        self.admins: set[str] = set()
+        self.loaded = False
+        self.connect = connect or self.connect_postgres
+        self.task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    async def connect_postgres() -> AsyncConnection:
+        # Notifications are only received outside of transactions
+        return await AsyncConnection.connect(connection_uri, autocommit=True)
+
+    async def load(self):
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT username FROM admins")
+                self.admins = {row[0] for row in await cur.fetchall()}
+        self.loaded = True
+
+    async def is_admin(self, username: str) -> bool:
+        # Loaded on first use if the listener hasn't started yet
+        if not self.loaded:
+            await self.load()
+        return username in self.admins
+
+    async def start(self):
+        """
+        Listen for changes to the admins, called at startup
+        """
+        if self.task is None:
+            self.task = asyncio.create_task(self.listen())
+
+    async def listen(self):
+        while True:
+            try:
+                conn = await self.connect()
+                async with conn:
+                    await conn.execute(f"LISTEN {ADMINS_CHANNEL}")
+                    # Changes may have been missed while not listening
+                    await self.load()
+                    async for _ in conn.notifies():
+                        await self.load()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("Failed to listen for admin changes:", e)
+            await asyncio.sleep(ADMIN_LISTEN_RETRY_SECONDS)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+
+admin_set = AdminSet()
@@ -1,7 +1,44 @@
+import asyncio
+import hashlib
+import os
+import re
+import time
+from typing import Optional
+from urllib.parse import urljoin
+
+import httpx
+import lxml.html
 from httpx import AsyncClient
-from playwright.async_api import async_playwright, TimeoutError
+from playwright.async_api import TimeoutError
 from pydantic import BaseModel
 
+from utils.browser_pool import browser_pool
+
+INTRANET_URL = "https://intranet.cardiff.ac.uk/students"
+LOGIN_TIMEOUT = 15
+# Redirects aren't counted, only the pages of the flow
+MAX_LOGIN_STEPS = 10
+# Logins falling back to the browser at once, others wait
+BROWSER_LOGIN_CONCURRENCY = int(os.getenv("BROWSER_LOGIN_CONCURRENCY", 2))
+# Failed logins of a username in the window before it's throttled
+MAX_LOGIN_FAILURES = int(os.getenv("MAX_LOGIN_FAILURES", 5))
+LOGIN_FAILURE_WINDOW = int(os.getenv("LOGIN_FAILURE_WINDOW", 300))
+
+# Connections to the login servers are reused between logins,
+# each login has its own client, so its own cookies
+login_transport = httpx.AsyncHTTPTransport(retries=1)
+
+# Pages which redirect with JavaScript, e.g. top.location.href='...'
+script_redirect_matcher = re.compile(
+    r"(?:top|window|document)\.location(?:\.href)?\s*=\s*['\"]([^'\"]+)['\"]"
+)
+
+browser_logins = asyncio.Semaphore(BROWSER_LOGIN_CONCURRENCY)
+# Logins running, by username and password, so repeated requests share one
+logins_in_flight: dict[str, asyncio.Task] = {}
+# Username -> the times of its recent failed logins
+login_failures: dict[str, list[float]] = {}
+
 
 class UniCredentials(BaseModel):
     username: str
@@ -12,13 +49,211 @@ class BadCredentialsException(Exception):
     pass
 
 
+class LoginThrottledException(Exception):
+    """
+    Too many failed logins for the username, retry after the given seconds
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Too many failed logins, retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class LoginFlowError(Exception):
+    """
+    The login pages weren't as expected, the browser can still log in
+    """
+    pass
+
+
+def auth_cookies(cookies: list[dict]) -> dict:
+    """
+    Find, and extract all the important cookies used for authentication
+    :param cookies: the cookies, with their name, value, domain and path
+    :return: the cookies by name
+    """
+    cookies_dict = {}
+
+    for cookie in cookies:
+        name = cookie["name"]
+        domain = cookie["domain"]
+
+        # Skip cookies from other hostnames
+        if name == "JSESSIONID" and domain == "idp.cf.ac.uk" or \
+                name.startswith("IPC") and domain == ".cf.ac.uk":
+            # Extract cookie name, value, domain and path
+            cookies_dict[name] = {
+                "value": cookie["value"],
+                "domain": cookie["domain"],
+                "path": cookie["path"],
+            }
+
+    if not cookies_dict:
+        raise Exception("Could not find cookie from authentication")
+
+    return cookies_dict
+
+
+def form_data(form: lxml.html.FormElement) -> dict[str, str]:
+    # The values a browser would submit, without the buttons
+    return dict(form.form_values())
+
+
+def status_message(document: lxml.html.HtmlElement) -> Optional[str]:
+    status = document.get_element_by_id("status-msg", None)
+    if status is None:
+        return None
+    return status.text_content().strip()
+
+
+async def http_login(
+        credentials: UniCredentials,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+) -> dict:
+    """
+    Log in by replaying the requests of the browser: the SAML redirects,
+    the auto-submitted forms and the login form
+    :param credentials: the university credentials
+    :param transport: the transport to send the requests with, for tests
+    :return: the authentication cookies
+    """
+    # Not closed, as it would close the shared transport
+    client = AsyncClient(
+        transport=transport or login_transport,
+        follow_redirects=True,
+        timeout=LOGIN_TIMEOUT,
+    )
+
+    response = await client.get(INTRANET_URL)
+    submitted = False
+
+    for _ in range(MAX_LOGIN_STEPS):
+        response.raise_for_status()
+
+        # Back on the intranet, the login is complete
+        if submitted and str(response.url).startswith(INTRANET_URL):
+            cookies = [
+                {"name": cookie.name, "value": cookie.value,
+                 "domain": cookie.domain, "path": cookie.path}
+                for cookie in client.cookies.jar
+            ]
+            return auth_cookies(cookies)
+
+        document = lxml.html.document_fromstring(response.text)
+        url = str(response.url)
+
+        status = status_message(document)
+        if submitted and status:
+            # Raise exception with the status message
+            raise BadCredentialsException(f"Failed to login: {status}")
+
+        password_inputs = document.xpath("//form//input[@type='password']")
+        forms = document.forms
+
+        if password_inputs and not submitted:
+            # Fill in the username and password of the login form
+            form = next(password_inputs[0].iterancestors("form"))
+            username = document.get_element_by_id("username", None)
+            if username is None:
+                raise LoginFlowError(f"Unexpected login form at {url}")
+
+            data = form_data(form)
+            data[username.name] = credentials.username
+            data[password_inputs[0].name] = credentials.password
+            # The button clicked by the browser is sent too
+            for button in form.xpath(".//input[@type='submit'][@name]")[:1]:
+                data[button.name] = button.value or ""
+
+            response = await client.post(urljoin(url, form.action or url), data=data)
+            submitted = True
+        elif password_inputs:
+            raise BadCredentialsException("Failed to login")
+        elif len(forms) == 1 and all(
+                element.type == "hidden" for element in forms[0].inputs
+                if element.tag == "input"
+        ):
+            # SAML requests and responses are sent with forms submitted on load
+            form = forms[0]
+            response = await client.post(urljoin(url, form.action or url),
+                                         data=form_data(form))
+        elif match := script_redirect_matcher.search(response.text):
+            response = await client.get(urljoin(url, match.group(1)))
+        else:
+            raise LoginFlowError(f"Unexpected page at {url}")
+
+    raise LoginFlowError("Too many steps to login")
+
+
+def recent_failures(username: str) -> list[float]:
+    # Forget the failures outside of the window
+    now = time.monotonic()
+    failures = [failed for failed in login_failures.get(username, [])
+                if now - failed < LOGIN_FAILURE_WINDOW]
+    if failures:
+        login_failures[username] = failures
+    else:
+        login_failures.pop(username, None)
+    return failures
+
+
 async def login(credentials: UniCredentials):
-    async with async_playwright() as p:
+    """
+    Log in to the university, and get the authentication cookies.
+    Concurrent logins with the same credentials share one attempt,
+    and usernames with too many failed logins are throttled.
+    """
+    username = credentials.username.lower()
+
+    failures = recent_failures(username)
+    if len(failures) >= MAX_LOGIN_FAILURES:
+        retry_after = LOGIN_FAILURE_WINDOW - (time.monotonic() - failures[0])
+        raise LoginThrottledException(int(retry_after) + 1)
 
-        browser = await p.chromium.launch(headless=True)
+    # Only shared with the same password, the key isn't the password itself
+    key = hashlib.sha256(
+        f"{username}:{credentials.password}".encode()
+    ).hexdigest()
 
-        context = await browser.new_context()
+    task = logins_in_flight.get(key)
+    if task is None:
+        task = asyncio.create_task(attempt_login(credentials))
+        logins_in_flight[key] = task
+        task.add_done_callback(lambda _: logins_in_flight.pop(key, None))
 
+    # A request going away doesn't cancel the login the others wait for
+    return await asyncio.shield(task)
+
+
+async def attempt_login(credentials: UniCredentials):
+    """
+    Login is done over HTTP, the browser is used if the pages changed
+    """
+    username = credentials.username.lower()
+
+    try:
+        try:
+            cookies = await http_login(credentials)
+        except BadCredentialsException:
+            raise
+        except Exception as e:
+            print("HTTP login failed, logging in with the browser:", repr(e))
+            async with browser_logins:
+                cookies = await browser_login(credentials)
+    except BadCredentialsException:
+        login_failures.setdefault(username, []).append(time.monotonic())
+        # Forget the usernames which stopped failing, in a login storm
+        if len(login_failures) > 1024:
+            for name in list(login_failures):
+                recent_failures(name)
+        raise
+
+    login_failures.pop(username, None)
+    return cookies
+
+
+async def browser_login(credentials: UniCredentials):
+    # A fresh context on a warm browser, so no cookies are shared between users
+    async with browser_pool.context() as context:
         page = await context.new_page()
 
         # Block Analytics and tracking scripts
@@ -74,29 +309,7 @@ async def login(credentials: UniCredentials):
         ) as _:
             pass
 
-        cookies = await context.cookies()
-
-        cookies_dict = {}
-
-        # Find, and extract all the important cookies used for authentication
-        for cookie in cookies:
-            name = cookie["name"]
-            domain = cookie["domain"]
-
-            # Skip cookies from other hostnames
-            if name == "JSESSIONID" and domain == "idp.cf.ac.uk" or \
-                    name.startswith("IPC") and domain == ".cf.ac.uk":
-                # Extract cookie name, value, domain and path
-                cookies_dict[name] = {
-                    "value": cookie["value"],
-                    "domain": cookie["domain"],
-                    "path": cookie["path"],
-                }
-
-        if not cookies_dict:
-            raise Exception("Could not find cookie from authentication")
-
-        return cookies_dict
+        return auth_cookies(await context.cookies())
 
 
 async def validate_cookies(cookies):
@@ -0,0 +1,171 @@
+import asyncio
+import mmap
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from playwright.async_api import Browser, BrowserContext, Playwright, \
+    async_playwright
+
+# Warm browsers kept open, and the operations running at once over all of them
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", 2))
+BROWSER_MAX_CONTEXTS = int(os.getenv("BROWSER_MAX_CONTEXTS", 4))
+# Browsers are replaced after this many operations, or above this memory,
+# as Chromium slowly leaks memory
+BROWSER_MAX_USES = int(os.getenv("BROWSER_MAX_USES", 100))
+BROWSER_MAX_MEMORY_MB = int(os.getenv("BROWSER_MAX_MEMORY_MB", 1024))
+# Measuring the memory opens a CDP session, so it's only done every few operations
+BROWSER_MEMORY_CHECK_EVERY = int(os.getenv("BROWSER_MEMORY_CHECK_EVERY", 10))
+
+
+async def browser_memory(browser: Browser) -> int:
+    """
+    Measure the memory used by the processes of a browser
+    :return: the resident memory in bytes, 0 if it can't be measured
+    """
+    try:
+        # Chromium knows the ids of its processes
+        session = await browser.new_browser_cdp_session()
+        try:
+            info = await session.send("SystemInfo.getProcessInfo")
+        finally:
+            await session.detach()
+    except Exception as e:
+        print("Failed to get the browser processes:", e)
+        return 0
+
+    total = 0
+    for process in info.get("processInfo", []):
+        try:
+            # Only available on Linux, which the API runs on
+            with open(f"/proc/{process['id']}/statm") as f:
+                total += int(f.read().split()[1]) * mmap.PAGESIZE
+        except (OSError, ValueError, IndexError):
+            pass
+
+    return total
+
+
+class PooledBrowser:
+    def __init__(self, browser: Browser):
+        self.browser = browser
+        self.uses = 0
+        self.active = 0
+        # No new operations are given to a retiring browser,
+        # it's closed once the running ones finish
+        self.retiring = False
+
+
+class BrowserPool:
+    """
+    Warm Chromium browsers shared by the requests which need a browser.
+    Each operation gets its own context, so cookies are never shared.
+    """
+
+    def __init__(
+            self,
+            size: int = BROWSER_POOL_SIZE,
+            max_contexts: int = BROWSER_MAX_CONTEXTS,
+            max_uses: int = BROWSER_MAX_USES,
+            max_memory_mb: int = BROWSER_MAX_MEMORY_MB,
+            memory_check_every: int = BROWSER_MEMORY_CHECK_EVERY,
+            launch: Optional[Callable[[], Awaitable[Browser]]] = None,
+    ):
+        """
+        :param size: the number of browsers
+        :param max_contexts: the maximum operations at once, others wait
+        :param max_uses: the operations before a browser is replaced
+        :param max_memory_mb: the memory above which a browser is replaced
+        :param memory_check_every: the operations between memory measurements
+        :param launch: launches a browser, headless Chromium by default
+        """
+        self.size = size
+        self.max_uses = max_uses
+        self.max_memory = max_memory_mb * 1024 * 1024
+        self.memory_check_every = max(memory_check_every, 1)
+        self.launch = launch or self.launch_chromium
+        self.semaphore = asyncio.Semaphore(max_contexts)
+        self.lock = asyncio.Lock()
+        self.playwright: Optional[Playwright] = None
+        self.browsers: list[PooledBrowser] = []
+
+    async def start(self):
+        """
+        Launch the browsers, called at startup so the first request doesn't wait
+        """
+        async with self.lock:
+            while len(self.browsers) < self.size:
+                self.browsers.append(PooledBrowser(await self.launch()))
+
+    async def launch_chromium(self) -> Browser:
+        if self.playwright is None:
+            self.playwright = await async_playwright().start()
+        return await self.playwright.chromium.launch(headless=True)
+
+    async def close(self):
+        async with self.lock:
+            for pooled in self.browsers:
+                await self.close_browser(pooled)
+            self.browsers = []
+            if self.playwright is not None:
+                await self.playwright.stop()
+                self.playwright = None
+
+    @staticmethod
+    async def close_browser(pooled: PooledBrowser):
+        try:
+            await pooled.browser.close()
+        except Exception as e:
+            print("Failed to close browser:", e)
+
+    async def acquire(self) -> PooledBrowser:
+        # Replace browsers which crashed or were retired
+        self.browsers = [
+            pooled for pooled in self.browsers if pooled.browser.is_connected()
+        ]
+        await self.start()
+
+        # Spread the operations over the browsers
+        pooled = min(self.browsers, key=lambda pooled: pooled.active)
+        pooled.active += 1
+        pooled.uses += 1
+        return pooled
+
+    async def release(self, pooled: PooledBrowser):
+        pooled.active -= 1
+
+        if not pooled.retiring:
+            if pooled.uses >= self.max_uses:
+                pooled.retiring = True
+            elif self.max_memory and pooled.uses % self.memory_check_every == 0 \
+                    and await browser_memory(pooled.browser) > self.max_memory:
+                print("Browser is using too much memory, replacing it")
+                pooled.retiring = True
+
+            # The next operation launches a new browser
+            if pooled.retiring and pooled in self.browsers:
+                self.browsers.remove(pooled)
+
+        connected = pooled.browser.is_connected()
+        if pooled.active == 0 and (pooled.retiring or not connected):
+            await self.close_browser(pooled)
+
+    @asynccontextmanager
+    async def context(self, **kwargs) -> AsyncIterator[BrowserContext]:
+        """
+        Get a new context on one of the browsers, it's closed afterwards
+        :param kwargs: the options of the context, see Browser.new_context
+        """
+        async with self.semaphore:
+            pooled = await self.acquire()
+            try:
+                context = await pooled.browser.new_context(**kwargs)
+                try:
+                    yield context
+                finally:
+                    await context.close()
+            finally:
+                await self.release(pooled)
+
+
+browser_pool = BrowserPool()
@@ -0,0 +1,166 @@
+import os
+import re
+import zlib
+
+import numpy as np
+from llama_index.core import Document
+from llama_index.core.node_parser import NodeParser
+from llama_index.core.schema import MetadataMode
+from llama_index.core.utils import get_tokenizer
+from pydantic import BaseModel
+
+# Pages sharing this share of their 5 word shingles are near-duplicates,
+# e.g. printer-friendly copies, or listings with a different page number
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", 0.85))
+
+SHINGLE_SIZE = 5
+# 16 bands of 8 rows, so pages above ~0.7 similarity are likely to share a band,
+# the candidates are then checked against the threshold
+NUM_PERM = 128
+BANDS = 16
+
+# Hashes are taken modulo this prime, so the products fit in 64 bits
+PRIME = (1 << 31) - 1
+
+word_matcher = re.compile(r"\w+")
+
+
+class DuplicateReport(BaseModel):
+    documents: int = 0
+    # What would have been embedded without the filter
+    chunks: int = 0
+    tokens: int = 0
+
+    def __str__(self) -> str:
+        return (f"{self.documents} near-duplicates removed, "
+                f"{self.chunks} chunks and {self.tokens} tokens not embedded")
+
+
+def shingles(text: str) -> set[int]:
+    """
+    Hash the overlapping 5 word sequences of the text
+    """
+    words = word_matcher.findall(text.lower())
+    grams = [" ".join(words[i:i + SHINGLE_SIZE])
+             for i in range(max(len(words) - SHINGLE_SIZE + 1, 1))]
+    return {zlib.crc32(gram.encode()) for gram in grams}
+
+
+class MinHasher:
+    """
+    MinHash signatures, the share of equal values in two signatures
+    estimates the Jaccard similarity of the shingles of the two texts
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        # Fixed seed, so the signatures are the same on every run
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, PRIME, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, PRIME, num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        values = np.fromiter(shingles(text), dtype=np.uint64) % PRIME
+        # One row per shingle, one column per permutation
+        hashed = (np.outer(values, self.a) + self.b) % PRIME
+        return hashed.min(axis=0).astype(np.uint32)
+
+
+class NearDuplicateFilter:
+    """
+    Keeps one document of each cluster of near-duplicates: a document already
+    stored and unchanged if there is one, otherwise the one with the smallest id,
+    the ids of the intranet pages are their canonical urls.
+    Add all the documents first, so the same one is kept whatever order
+    the pages were crawled in, and it isn't deleted and re-embedded on every run.
+    """
+
+    def __init__(
+            self,
+            splitter: NodeParser,
+            threshold: float = NEAR_DUPLICATE_THRESHOLD,
+            bands: int = BANDS,
+    ):
+        """
+        :param splitter: the splitter of the collection,
+        to count the chunks and tokens which aren't embedded
+        :param threshold: the estimated similarity of near-duplicates
+        :param bands: the number of LSH bands, NUM_PERM must be a multiple of it
+        """
+        self.splitter = splitter
+        self.threshold = threshold
+        self.hasher = MinHasher()
+        self.rows = NUM_PERM // bands
+        # Band value -> the clusters with this value, for each band
+        self.buckets: list[dict[bytes, list[int]]] = [{} for _ in range(bands)]
+        # The signature, and the rank and id of the kept document of each cluster
+        self.signatures: list[np.ndarray] = []
+        self.kept: list[tuple[tuple[bool, str], str]] = []
+        # Document id -> its cluster
+        self.clusters: dict[str, int] = {}
+        self.report = DuplicateReport()
+
+    def add(self, document: Document, unchanged: bool = False):
+        """
+        Add the document to its cluster, or start a new one
+        :param unchanged: the document is stored and didn't change,
+        so it's kept over the others to avoid re-embedding
+        """
+        if document.id_ in self.clusters:
+            return
+
+        signature = self.hasher.signature(document.text)
+        keys = [signature[i * self.rows:(i + 1) * self.rows].tobytes()
+                for i in range(len(self.buckets))]
+
+        candidates = set()
+        for bucket, key in zip(self.buckets, keys):
+            candidates.update(bucket.get(key, ()))
+
+        cluster = next(
+            (candidate for candidate in sorted(candidates)
+             if np.mean(self.signatures[candidate] == signature) >= self.threshold),
+            None
+        )
+        rank = (not unchanged, document.id_)
+
+        if cluster is None:
+            cluster = len(self.signatures)
+            self.signatures.append(signature)
+            self.kept.append((rank, document.id_))
+        elif rank < self.kept[cluster][0]:
+            self.signatures[cluster] = signature
+            self.kept[cluster] = (rank, document.id_)
+        else:
+            self.clusters[document.id_] = cluster
+            return
+
+        self.clusters[document.id_] = cluster
+        for bucket, key in zip(self.buckets, keys):
+            clusters = bucket.setdefault(key, [])
+            if cluster not in clusters:
+                clusters.append(cluster)
+
+    def is_duplicate(self, document: Document, unchanged: bool = False) -> bool:
+        """
+        Check if the document is a near-duplicate of the one kept of its cluster.
+        Documents which weren't added before are added now, so a stream can be
+        filtered, but then the first of each cluster can be kept too.
+        """
+        self.add(document, unchanged)
+
+        if self.kept[self.clusters[document.id_]][1] == document.id_:
+            return False
+
+        self.record(document)
+        return True
+
+    def record(self, document: Document):
+        tokenizer = get_tokenizer()
+        nodes = self.splitter.get_nodes_from_documents([document])
+
+        self.report.documents += 1
+        self.report.chunks += len(nodes)
+        self.report.tokens += sum(
+            len(tokenizer(node.get_content(metadata_mode=MetadataMode.EMBED)))
+            for node in nodes
+        )
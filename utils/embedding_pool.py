@@ -0,0 +1,249 @@
+import asyncio
+import os
+import random
+import time
+from typing import Iterable, Iterator, Optional
+
+import httpx
+import openai
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import BaseNode, MetadataMode
+from llama_index.core.utils import get_tokenizer
+from llama_index.embeddings.openai import OpenAIEmbedding
+from llama_index.vector_stores.qdrant import QdrantVectorStore
+from pydantic import BaseModel
+
+# Limits of the OpenAI account, and of a single embedding request
+TOKENS_PER_MINUTE = int(os.getenv("EMBED_TOKENS_PER_MINUTE", 1_000_000))
+CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", 4))
+BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", 50_000))
+BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 512))
+MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", 8))
+
+
+class EmbeddingReport(BaseModel):
+    chunks: int = 0
+    tokens: int = 0
+    batches: int = 0
+    retries: int = 0
+    seconds: float = 0.0
+    # Summed over the concurrent batches, so they can add up to more than seconds
+    embed_seconds: float = 0.0
+    upsert_seconds: float = 0.0
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        return (f"{self.chunks} chunks ({self.tokens} tokens) embedded in "
+                f"{self.batches} batches, {self.seconds:.1f}s, "
+                f"{self.chunks_per_second:.1f} chunks/s, {self.retries} retries "
+                f"(batches spent {self.embed_seconds:.1f}s embedding, "
+                f"{self.upsert_seconds:.1f}s upserting)")
+
+
+class TokenBucket:
+    """
+    Spreads the tokens sent over the minute, so we stay under the rate limit
+    """
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self.tokens = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int):
+        # A batch bigger than the whole budget waits for a full bucket
+        tokens = min(tokens, self.capacity)
+
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+def retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """
+    How long to wait before retrying the request
+    :return: the delay in seconds, or None if the error isn't transient
+    """
+    if isinstance(error, openai.RateLimitError):
+        # OpenAI says how long to wait
+        retry_after = error.response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    elif not isinstance(error, (openai.APIConnectionError,
+                                openai.InternalServerError)):
+        return None
+
+    # Exponential backoff with jitter, capped at a minute
+    return min(60.0, 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def pack_batches(
+        nodes: Iterable[BaseNode],
+        batch_tokens: int = BATCH_TOKENS,
+        batch_size: int = BATCH_SIZE,
+) -> Iterator[tuple[list[BaseNode], list[str], int]]:
+    """
+    Group the nodes into batches of up to batch_tokens tokens
+    :return: the nodes, the texts to embed and the tokens of each batch
+    """
+    tokenizer = get_tokenizer()
+
+    nodes_batch, texts, tokens = [], [], 0
+    for node in nodes:
+        # Same text as IngestionPipeline embeds
+        text = node.get_content(metadata_mode=MetadataMode.EMBED)
+        size = len(tokenizer(text))
+
+        if nodes_batch and (tokens + size > batch_tokens or len(texts) >= batch_size):
+            yield nodes_batch, texts, tokens
+            nodes_batch, texts, tokens = [], [], 0
+
+        nodes_batch.append(node)
+        texts.append(text)
+        tokens += size
+
+    if nodes_batch:
+        yield nodes_batch, texts, tokens
+
+
+class EmbeddingPool:
+    """
+    Embeds nodes with several concurrent requests within the tokens per minute
+    budget, retrying rate limited requests, and upserts them in bulk.
+    Shared by the ingestion scripts instead of IngestionPipeline.
+    """
+
+    def __init__(
+            self,
+            embed_model: BaseEmbedding,
+            store: QdrantVectorStore,
+            tokens_per_minute: int = TOKENS_PER_MINUTE,
+            concurrency: int = CONCURRENCY,
+            batch_tokens: int = BATCH_TOKENS,
+            batch_size: int = BATCH_SIZE,
+            max_retries: int = MAX_RETRIES,
+            transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        """
+        :param transport: the transport of the OpenAI requests, for tests
+        """
+        self.embed_model = embed_model
+        # Each batch is sent as a single request
+        self.embed_model.embed_batch_size = batch_size
+        self.store = store
+        # And upserted with a single request, the store uploads 64 points at once
+        # by default
+        self.store.batch_size = batch_size
+        self.bucket = TokenBucket(tokens_per_minute)
+        self.concurrency = concurrency
+        self.batch_tokens = batch_tokens
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.report = EmbeddingReport()
+
+        # OpenAIEmbedding retries rate limits itself, out of sight of the bucket,
+        # so the pool sends the requests with a client which doesn't retry
+        self.aclient = None
+        if isinstance(embed_model, OpenAIEmbedding):
+            self.aclient = openai.AsyncOpenAI(
+                api_key=embed_model.api_key,
+                base_url=embed_model.api_base,
+                timeout=embed_model.timeout,
+                max_retries=0,
+                http_client=httpx.AsyncClient(transport=transport)
+                if transport is not None else None,
+            )
+
+    async def request(self, texts: list[str]) -> list[list[float]]:
+        if self.aclient is None:
+            return await self.embed_model.aget_text_embedding_batch(texts)
+
+        # Same request as OpenAIEmbedding sends
+        response = await self.aclient.embeddings.create(
+            input=[text.replace("\n", " ") for text in texts],
+            model=self.embed_model.model_name,
+            **self.embed_model.additional_kwargs,
+        )
+        return [data.embedding for data in response.data]
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        attempt = 0
+        while True:
+            try:
+                return await self.request(texts)
+            except Exception as e:
+                delay = retry_delay(e, attempt)
+                if delay is None or attempt >= self.max_retries:
+                    raise
+                print(f"Embedding failed, retrying in {delay:.1f}s:", e)
+                self.report.retries += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def process(self, batch_nodes: list[BaseNode], texts: list[str], tokens: int):
+        await self.bucket.acquire(tokens)
+
+        start = time.perf_counter()
+        embeddings = await self.embed(texts)
+        self.report.embed_seconds += time.perf_counter() - start
+
+        for node, embedding in zip(batch_nodes, embeddings):
+            node.embedding = embedding
+
+        start = time.perf_counter()
+        # One bulk upsert for the whole batch, see batch_size of the store
+        await self.store.async_add(batch_nodes)
+        self.report.upsert_seconds += time.perf_counter() - start
+
+        self.report.chunks += len(batch_nodes)
+        self.report.tokens += tokens
+        self.report.batches += 1
+
+    async def run(self, nodes: Iterable[BaseNode]):
+        """
+        Embed the nodes and add them to the vector store.
+        Can be called several times, the report adds up.
+        :param nodes: the chunks to embed, can be a generator
+        """
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+
+        try:
+            for batch in pack_batches(nodes, self.batch_tokens, self.batch_size):
+                # Only pack the next batch when a worker is free,
+                # so the nodes are streamed
+                await semaphore.acquire()
+
+                # Stop at the first failed batch
+                for task in [task for task in tasks if task.done()]:
+                    tasks.remove(task)
+                    task.result()
+
+                task = asyncio.create_task(self.process(*batch))
+                task.add_done_callback(lambda _: semaphore.release())
+                tasks.add(task)
+
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.report.seconds += time.perf_counter() - start
@@ -0,0 +1,54 @@
+import hashlib
+import math
+import re
+from typing import List
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+
+STOP_WORDS = {
+    "a", "an", "and", "are", "can", "do", "for", "from", "get", "how", "i", "in",
+    "is", "me", "my", "of", "on", "the", "there", "to", "was", "what", "when",
+    "where", "with", "you", "your",
+}
+
+token_matcher = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> list[str]:
+    return [
+        token for token in token_matcher.findall(text.lower())
+        if token not in STOP_WORDS
+    ]
+
+
+class HashingEmbedding(BaseEmbedding):
+    """
+    Deterministic bag of words embedding, each word is hashed into a bucket.
+    Stands in for OpenAIEmbedding in the tests, the offline benchmark
+    and dry runs of the ingestion, so no network is needed
+    """
+    dimensions: int = 256
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HashingEmbedding"
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+
+        for token in tokenize(text):
+            digest = hashlib.md5(token.encode()).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] % 2 else -1.0
+
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed(text)
@@ -2,17 +2,17 @@ import asyncio
 import json
 import os  # Module for operating system related functionalities
 
-from llama_index.core import VectorStoreIndex  # Vector store index from llama_index
 # Ingestion pipeline for document processing
 # Sentence splitter for chunking text
 from llama_index.core.schema import MetadataMode
 from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.postprocessor.cohere_rerank import CohereRerank
-# Vector store for Qdrant
-from llama_index.vector_stores.qdrant import QdrantVectorStore
+from opentelemetry import trace
 # Qdrant client for interacting with Qdrant
 from qdrant_client import AsyncQdrantClient
 
+from utils.vector_store_helper import search_llm_text
+
 if not os.environ.get("QDRANT_URL"):
     raise ValueError("QDRANT_URL environment variable not set")
 if not os.environ.get("QDRANT_API_KEY"):
@@ -23,27 +23,28 @@ aclient = AsyncQdrantClient(
     api_key=os.environ.get("QDRANT_API_KEY")
 )
 
-store = QdrantVectorStore("events", aclient=aclient)
-
 embed_model = OpenAIEmbedding(model="text-embedding-3-large")
 
-index = VectorStoreIndex.from_vector_store(
-    vector_store=store,
-    embed_model=embed_model,
-)
+tracer = trace.get_tracer(__name__)
 
 
 async def search_event_tool(query: str) -> str:
-    retriever = index.as_retriever(similarity_top_k=10)
-
-    results = await retriever.aretrieve(query)
-    # Reranking
-    reranker = CohereRerank(model="rerank-english-v3.0")
-    # Reranker asynchronously
-    results = await (asyncio.to_thread(reranker.postprocess_nodes,
-                                       nodes=results, query_str=query))
-    results = results[:3]
-
-    return json.dumps({
-        "results": [result.get_content(MetadataMode.LLM) for result in results]
-    })
+    # Each stage is traced, so we can see where the time goes
+    with tracer.start_as_current_span("embed"):
+        query_embedding = await embed_model.aget_query_embedding(query)
+
+    with tracer.start_as_current_span("search"):
+        # Results contain the text pre-rendered for the LLM at ingestion
+        results = await search_llm_text(aclient, "events", query_embedding, 10)
+
+    with tracer.start_as_current_span("rerank"):
+        reranker = CohereRerank(model="rerank-english-v3.0")
+        # Reranker asynchronously
+        results = await (asyncio.to_thread(reranker.postprocess_nodes,
+                                           nodes=results, query_str=query))
+        results = results[:3]
+
+    with tracer.start_as_current_span("render"):
+        return json.dumps({
+            "results": [result.get_content(MetadataMode.LLM) for result in results]
+        })
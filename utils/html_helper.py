@@ -0,0 +1,250 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Union
+from urllib.parse import urljoin
+
+import lxml.html
+
+# Elements removed from the page before extracting the text
+PRUNE_SELECTORS = ["nav", "footer", "header", ".btn", ".footer"]
+
+# Elements which never contain readable text
+SKIP_TAGS = {
+    "head", "script", "style", "noscript", "template", "svg", "iframe", "img",
+    "input", "select", "textarea", "object", "canvas",
+}
+
+BLOCK_TAGS = {
+    "address", "article", "aside", "blockquote", "body", "dd", "details", "div",
+    "dl", "dt", "fieldset", "figcaption", "figure", "form", "hr", "html", "li",
+    "main", "ol", "p", "pre", "section", "summary", "table", "tbody", "td",
+    "tfoot", "th", "thead", "tr", "ul",
+    "h1", "h2", "h3", "h4", "h5", "h6",
+}
+
+INLINE_MARKERS = {
+    "strong": "**", "b": "**",
+    "em": "_", "i": "_",
+    "code": "`",
+}
+
+PRUNE_TAGS = {
+    selector for selector in PRUNE_SELECTORS if not selector.startswith(".")
+}
+PRUNE_CLASSES = {
+    selector[1:] for selector in PRUNE_SELECTORS if selector.startswith(".")
+}
+
+# Extraction is CPU bound, so it runs on its own threads instead of the event loop
+executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("HTML_EXTRACT_WORKERS", 4)),
+    thread_name_prefix="html_extract",
+)
+
+
+class MarkdownEmitter:
+    """
+    Walks the parsed page once, skipping pruned elements,
+    and writes the markdown as it goes
+    """
+
+    def __init__(self, base_url: Optional[str] = None):
+        self.base_url = base_url
+        # (line, tight), tight lines like list items aren't separated by a blank line
+        self.lines = []
+        self.inline = []
+        # Prefix for the next line, and for the lines after it, e.g. in a list item
+        self.prefix = ""
+        self.indent = ""
+        self.in_list = False
+
+    def flush(self):
+        text = " ".join("".join(self.inline).split())
+        self.inline = []
+        if text:
+            self.lines.append((self.prefix + text, self.in_list))
+            self.prefix = self.indent
+
+    def add_text(self, text: str):
+        if text:
+            self.inline.append(text)
+
+    def render(self) -> str:
+        self.flush()
+
+        output = []
+        previous_tight = False
+        for line, tight in self.lines:
+            if output:
+                output.append("\n" if tight and previous_tight else "\n\n")
+            output.append(line)
+            previous_tight = tight
+
+        return "".join(output) + "\n"
+
+    def capture(self, element) -> str:
+        """
+        Render the contents of an inline element on its own
+        """
+        outer = self.inline
+        self.inline = []
+        self.walk_children(element)
+        inner = " ".join("".join(self.inline).split())
+        self.inline = outer
+        return inner
+
+    def walk_children(self, element):
+        self.add_text(element.text)
+        for child in element:
+            self.walk(child)
+            self.add_text(child.tail)
+
+    def walk(self, element):
+        tag = element.tag
+
+        # Comments and processing instructions
+        if not isinstance(tag, str):
+            return
+
+        if tag in SKIP_TAGS or tag in PRUNE_TAGS:
+            return
+
+        classes = element.get("class")
+        if classes and PRUNE_CLASSES.intersection(classes.split()):
+            return
+
+        match tag:
+            case "h1" | "h2" | "h3" | "h4" | "h5" | "h6":
+                self.flush()
+                prefix = self.prefix
+                self.prefix = "#" * int(tag[1]) + " "
+                self.walk_children(element)
+                self.flush()
+                self.prefix = prefix
+            case "ul" | "ol":
+                self.flush()
+                number = 1
+                for child in element:
+                    if child.tag == "li":
+                        marker = "* " if tag == "ul" else f"{number}. "
+                        self.walk_list_item(child, marker)
+                        number += 1
+                    else:
+                        self.walk(child)
+            case "tr":
+                self.flush()
+                cells = [
+                    self.capture(child) for child in element
+                    if child.tag in ("td", "th")
+                ]
+                if any(cells):
+                    self.lines.append(("| " + " | ".join(cells) + " |", True))
+                    # Separate the header row from the body
+                    if all(child.tag == "th" for child in element
+                           if isinstance(child.tag, str)):
+                        self.lines.append(("|" + " --- |" * len(cells), True))
+            case "pre":
+                self.flush()
+                code = element.text_content().strip("\n")
+                if code.strip():
+                    self.lines.append((self.prefix + "```\n" + code + "\n```", False))
+            case "br":
+                self.flush()
+            case "blockquote":
+                self.flush()
+                prefix, indent = self.prefix, self.indent
+                self.prefix = self.indent = indent + "> "
+                self.walk_children(element)
+                self.flush()
+                self.prefix, self.indent = prefix, indent
+            case "a":
+                href = element.get("href", "")
+                # Links wrapping blocks, e.g. cards, are kept as plain text
+                if any(child.tag in BLOCK_TAGS for child in element.iterdescendants()):
+                    self.walk_children(element)
+                    return
+                text = self.capture(element)
+                if text and href and not href.startswith(("#", "javascript:")):
+                    if self.base_url:
+                        try:
+                            href = urljoin(self.base_url, href)
+                        except ValueError:
+                            # Malformed, e.g. http://[bad, kept as written
+                            pass
+                    self.add_text(f"[{text}]({href})")
+                else:
+                    self.add_text(text)
+            case _ if tag in INLINE_MARKERS:
+                text = self.capture(element)
+                if text:
+                    marker = INLINE_MARKERS[tag]
+                    self.add_text(f"{marker}{text}{marker}")
+            case _ if tag in BLOCK_TAGS:
+                self.flush()
+                self.walk_children(element)
+                self.flush()
+            case _:
+                self.walk_children(element)
+
+    def walk_list_item(self, element, marker: str):
+        self.flush()
+        prefix, indent, in_list = self.prefix, self.indent, self.in_list
+        self.prefix = indent + marker
+        # Nested lists and paragraphs are indented under the marker
+        self.indent = indent + " " * len(marker)
+        self.in_list = True
+        self.walk_children(element)
+        self.flush()
+        self.prefix, self.indent, self.in_list = prefix, indent, in_list
+
+
+def html_to_markdown(
+        html: Union[str, bytes],
+        base_url: Optional[str] = None
+) -> str:
+    """
+    Extract the main text of the page as markdown, in a single pass
+    :param html: the html of the page, bytes are preferred so lxml detects the encoding
+    :param base_url: the url of the page, used to make links absolute
+    :return: the markdown text
+    """
+    return element_to_markdown(parse_html(html), base_url)
+
+
+def parse_html(html: Union[str, bytes]) -> lxml.html.HtmlElement:
+    try:
+        return lxml.html.document_fromstring(html)
+    except ValueError:
+        # lxml refuses strings with an XML encoding declaration
+        return lxml.html.document_fromstring(html.encode("utf-8"))
+
+
+def element_to_markdown(
+        element: lxml.html.HtmlElement,
+        base_url: Optional[str] = None
+) -> str:
+    """
+    Extract the text of an already parsed element as markdown
+    :param element: the element, e.g. the main content of the page
+    :param base_url: the url of the page, used to make links absolute
+    :return: the markdown text
+    """
+    emitter = MarkdownEmitter(base_url)
+    emitter.walk(element)
+
+    return emitter.render()
+
+
+async def extract_markdown(
+        html: Union[str, bytes],
+        base_url: Optional[str] = None
+) -> str:
+    """
+    Extract the markdown on the worker pool, so the event loop isn't blocked
+    :param html: the html of the page
+    :param base_url: the url of the page, used to make links absolute
+    :return: the markdown text
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, html_to_markdown, html, base_url)
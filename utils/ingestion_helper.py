@@ -0,0 +1,210 @@
+import os
+from hashlib import sha256
+from itertools import islice
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, Optional, \
+    TypeVar
+
+from llama_index.core import Document
+from llama_index.core.utils import get_tokenizer
+from llama_index.vector_stores.qdrant import QdrantVectorStore
+from pydantic import BaseModel
+
+from utils.dedup_helper import NearDuplicateFilter
+
+# Payload field with the hash of the page text, to detect changed pages
+CONTENT_HASH_KEY = "content_hash"
+
+# Missing documents aren't deleted if the scrape found less than this share
+# of the stored ones, a broken page or listing would otherwise wipe the collection
+MIN_SCRAPED_SHARE = float(os.getenv("MIN_SCRAPED_SHARE", 0.5))
+
+T = TypeVar("T")
+
+
+class IngestionReport(BaseModel):
+    added: int = 0
+    updated: int = 0
+    skipped: int = 0
+    deleted: int = 0
+    # Estimated with the tokenizer of the embedding model
+    tokens_embedded: int = 0
+    tokens_saved: int = 0
+
+    def add(self, other: "IngestionReport"):
+        """
+        Add the counts of another batch to this report
+        """
+        for field in self.model_fields:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    def __str__(self) -> str:
+        return (f"{self.added} added, {self.updated} updated, "
+                f"{self.skipped} skipped, {self.deleted} deleted, "
+                f"{self.tokens_embedded} tokens embedded, "
+                f"{self.tokens_saved} tokens saved")
+
+
+def content_hash(text: str) -> str:
+    return sha256(text.encode("utf-8")).hexdigest()
+
+
+def stable_document(
+        document: Document,
+        doc_id: str,
+        hashed_text: Optional[str] = None,
+) -> Document:
+    """
+    Give the document a stable id, and the hash of its text,
+    so the next run can tell if it changed
+    :param document: the scraped document
+    :param doc_id: the stable id, e.g. the url of the page
+    :param hashed_text: the text to hash instead of the document text,
+    when the metadata can change too
+    :return: the same document
+    """
+    document.id_ = doc_id
+    document.metadata[CONTENT_HASH_KEY] = content_hash(
+        document.text if hashed_text is None else hashed_text
+    )
+
+    # The hash is only for us, not for the embedding or the model
+    for excluded in (document.excluded_embed_metadata_keys,
+                     document.excluded_llm_metadata_keys):
+        if CONTENT_HASH_KEY not in excluded:
+            excluded.append(CONTENT_HASH_KEY)
+
+    return document
+
+
+def count_tokens(text: str) -> int:
+    return len(get_tokenizer()(text))
+
+
+def batched(items: Iterable[T], size: int) -> Iterator[list[T]]:
+    """
+    Split the items into lists of the given size, the last one can be shorter
+    """
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+async def abatched(items: AsyncIterable[T], size: int) -> AsyncIterator[list[T]]:
+    """
+    Split the items of an async iterator into lists of the given size,
+    so they can be processed while the rest are still being produced
+    """
+    batch = []
+    async for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def shrank_sharply(scraped: int, stored: int) -> bool:
+    """
+    Check if the scrape found far fewer documents than the collection has,
+    then the scrape is more likely broken than the documents deleted
+    """
+    if stored and scraped < stored * MIN_SCRAPED_SHARE:
+        print(f"Only {scraped} documents found for {stored} stored, "
+              "not deleting the missing ones")
+        return True
+    return False
+
+
+async def delete_documents(store: QdrantVectorStore, doc_ids: Iterable[str]) -> int:
+    """
+    Remove every chunk of the documents from the store
+    :return: the number of documents removed
+    """
+    deleted = 0
+    for doc_id in doc_ids:
+        await store.adelete(doc_id)
+        deleted += 1
+    return deleted
+
+
+def is_unchanged(document: Document, stored: dict[str, dict]) -> bool:
+    previous = stored.get(document.id_)
+    return previous is not None and \
+        previous.get(CONTENT_HASH_KEY) == document.metadata[CONTENT_HASH_KEY]
+
+
+def add_duplicates(
+        duplicates: NearDuplicateFilter,
+        documents: Iterable[Document],
+        stored: dict[str, dict],
+):
+    """
+    Add all the documents to the near-duplicate filter before apply_changes,
+    so the document kept of each cluster doesn't depend on their order
+    :param documents: the scraped documents, with stable ids and hashes
+    :param stored: the payload of the documents in the collection, by id
+    """
+    for document in documents:
+        duplicates.add(document, unchanged=is_unchanged(document, stored))
+
+
+async def apply_changes(
+        store: QdrantVectorStore,
+        documents: list[Document],
+        stored: dict[str, dict],
+        delete_missing: bool = True,
+        duplicates: Optional[NearDuplicateFilter] = None,
+) -> tuple[list[Document], IngestionReport]:
+    """
+    Compare the scraped documents with the ones already in the collection.
+    Removes the chunks of changed and deleted documents from the store.
+    :param store: the vector store of the collection
+    :param documents: the scraped documents, with stable ids and hashes
+    :param stored: the payload of the documents in the collection, by id,
+    see stored_documents
+    :param delete_missing: remove stored documents which weren't scraped
+    :param duplicates: the filter to skip near-duplicates of other documents with,
+    their chunks are removed from the store too, see add_duplicates
+    :return: the documents which need to be embedded, and the report so far
+    """
+    report = IngestionReport()
+    changed = []
+    seen = set()
+
+    for document in documents:
+        # The same page can be scraped twice, keep the first
+        if document.id_ in seen:
+            continue
+        seen.add(document.id_)
+
+        if duplicates and duplicates.is_duplicate(
+                document, unchanged=is_unchanged(document, stored)
+        ):
+            if document.id_ in stored:
+                await store.adelete(document.id_)
+                report.deleted += 1
+            continue
+
+        previous: Optional[dict] = stored.get(document.id_)
+
+        if previous is None:
+            report.added += 1
+        elif previous.get(CONTENT_HASH_KEY) == document.metadata[CONTENT_HASH_KEY]:
+            report.skipped += 1
+            report.tokens_saved += count_tokens(document.text)
+            continue
+        else:
+            # Replace the chunks of the old version
+            await store.adelete(document.id_)
+            report.updated += 1
+
+        report.tokens_embedded += count_tokens(document.text)
+        changed.append(document)
+
+    if delete_missing:
+        report.deleted += await delete_documents(
+            store, [doc_id for doc_id in stored if doc_id not in seen]
+        )
+
+    return changed, report
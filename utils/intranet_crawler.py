@@ -0,0 +1,499 @@
+import asyncio
+import json
+import os
+from collections import Counter
+from pathlib import Path
+from typing import Iterator, Optional
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+import httpx
+from llama_index.core import Document
+from playwright.async_api import async_playwright
+
+from utils.html_helper import element_to_markdown, parse_html
+
+# Pages with less text than this, which run scripts, are rendered in a browser
+MIN_TEXT_LENGTH = 50
+
+# The most pages kept for the same path with different queries,
+# we had too many search result pages being added
+MAX_QUERIES_PER_PATH = 10
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Query parameters which don't change the page
+IGNORED_PARAMS = ("utm_", "fbclid", "gclid")
+
+# Pages which failed to fetch are retried this many times, then left pending
+# so the crawl isn't finished and they're retried when resuming
+MAX_FETCH_ATTEMPTS = 3
+
+# Redirects to these hosts mean the session expired,
+# other hosts are pages which moved off the intranet
+LOGIN_HOSTS = ("login.cardiff.ac.uk", "idp.cf.ac.uk")
+
+
+def canonical_url(url: str) -> str:
+    """
+    Normalise the url, so the same page is only crawled once: lowercase the
+    scheme and host, drop the default port, the fragment and tracking
+    parameters, and sort the query
+    :param url: an absolute url
+    :return: the canonical url
+    :raises ValueError: if the url is malformed, e.g. its port isn't a number
+    """
+    parts = urlsplit(url.strip())
+
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.startswith(IGNORED_PARAMS)
+    )
+
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+
+class URLFrontier:
+    """
+    The urls waiting to be crawled, and the urls already seen.
+    Every admission decision is a constant number of set and dict lookups.
+    """
+
+    def __init__(
+            self,
+            prefix: str,
+            max_depth: int = 10,
+            max_queries_per_path: int = MAX_QUERIES_PER_PATH
+    ):
+        self.prefix = canonical_url(prefix)
+        self.max_depth = max_depth
+        self.max_queries_per_path = max_queries_per_path
+
+        self.seen: set[str] = set()
+        # Path -> number of urls admitted with a query on that path
+        self.path_counts: Counter = Counter()
+        # Url -> depth, for the urls admitted but not crawled yet
+        self.pending: dict[str, int] = {}
+
+    def admit(self, url: str, depth: int, force: bool = False) -> Optional[str]:
+        """
+        Decide if the url should be crawled, and remember it if so
+        :param url: an absolute url
+        :param depth: the number of links followed to get to the url
+        :param force: skip the prefix and depth rules, e.g. for the start url
+        :return: the canonical url if admitted, otherwise None
+        """
+        url = canonical_url(url)
+
+        if url in self.seen:
+            return None
+        if not force and (depth > self.max_depth or not url.startswith(self.prefix)):
+            return None
+
+        parts = urlsplit(url)
+        if parts.query:
+            if self.path_counts[parts.path] >= self.max_queries_per_path:
+                return None
+            self.path_counts[parts.path] += 1
+
+        self.seen.add(url)
+        self.pending[url] = depth
+        return url
+
+    def complete(self, url: str):
+        """
+        Mark the url as crawled
+        """
+        self.pending.pop(url, None)
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def to_dict(self) -> dict:
+        return {
+            "seen": list(self.seen),
+            "path_counts": dict(self.path_counts),
+            "pending": self.pending,
+        }
+
+    def load(self, state: dict):
+        self.seen = set(state["seen"])
+        self.path_counts = Counter(state["path_counts"])
+        self.pending = dict(state["pending"])
+
+
+class SessionExpiredError(Exception):
+    pass
+
+
+class FetchError(Exception):
+    """
+    The page couldn't be fetched, e.g. a timeout or a server error,
+    it isn't known to be deleted
+    """
+    pass
+
+
+class CrawlCheckpoint:
+    """
+    Crawl state saved as it goes, so an interrupted crawl can be resumed.
+    Pages are appended to pages.jsonl as soon as they're crawled,
+    and the frontier is saved to frontier.json every so often.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.pages_path = self.directory / "pages.jsonl"
+        self.frontier_path = self.directory / "frontier.json"
+        self.pages_file = None
+
+    def load_state(self) -> Optional[dict]:
+        if not self.frontier_path.exists():
+            return None
+        with open(self.frontier_path) as f:
+            return json.load(f)
+
+    def finished(self) -> bool:
+        """
+        :return: True if the last crawl ran to the end
+        """
+        state = self.load_state()
+        return state is not None and state["finished"]
+
+    def reset(self):
+        """
+        Remove the saved state, to start a new crawl
+        """
+        self.close()
+        self.pages_path.unlink(missing_ok=True)
+        self.frontier_path.unlink(missing_ok=True)
+
+    def resume(self, frontier: URLFrontier) -> bool:
+        """
+        Restore the frontier of an unfinished crawl
+        :return: True if there was a crawl to resume
+        """
+        state = self.load_state()
+        if state is None or state["finished"]:
+            return False
+
+        frontier.load(state["frontier"])
+        return True
+
+    def save_frontier(self, frontier: URLFrontier, finished: bool = False):
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        # Pages are written before the frontier which says they're crawled
+        if self.pages_file is not None:
+            self.pages_file.flush()
+            os.fsync(self.pages_file.fileno())
+
+        # Replace the file at once, so a crash never leaves half a file
+        temporary_path = self.frontier_path.with_suffix(".tmp")
+        with open(temporary_path, "w") as f:
+            json.dump({"finished": finished, "frontier": frontier.to_dict()}, f)
+        os.replace(temporary_path, self.frontier_path)
+
+    def append(self, document: Document):
+        if self.pages_file is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self.pages_file = open(self.pages_path, "a", encoding="utf-8")
+
+        self.pages_file.write(json.dumps({
+            "url": document.metadata["URL"],
+            "text": document.text,
+        }) + "\n")
+
+    def close(self):
+        if self.pages_file is not None:
+            self.pages_file.close()
+            self.pages_file = None
+
+    def documents(self) -> Iterator[Document]:
+        """
+        Stream the crawled pages, without loading them all in memory.
+        Pages crawled again after resuming only appear once, with their last text.
+        """
+        if not self.pages_path.exists():
+            return
+
+        # First pass only keeps the line number of the last copy of each page
+        last_lines = {}
+        with open(self.pages_path, encoding="utf-8") as f:
+            for number, line in enumerate(f):
+                try:
+                    last_lines[json.loads(line)["url"]] = number
+                except ValueError:
+                    # The last line can be cut short by a crash
+                    continue
+
+        keep = set(last_lines.values())
+        with open(self.pages_path, encoding="utf-8") as f:
+            for number, line in enumerate(f):
+                if number in keep:
+                    page = json.loads(line)
+                    yield Document(text=page["text"], extra_info={"URL": page["url"]})
+
+
+class IntranetCrawler:
+    """
+    Crawls the intranet over plain HTTP with the session cookie,
+    only rendering the pages that need JavaScript in a browser
+    """
+
+    def __init__(
+            self,
+            prefix: str,
+            cookies: dict[str, str],
+            max_depth: int = 10,
+            concurrency: int = 16,
+            browser_pages: int = 2,
+            transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        """
+        :param prefix: only urls starting with this are crawled
+        :param cookies: the cookies of the logged in session
+        :param max_depth: the most links followed from the start page
+        :param concurrency: the most pages fetched at once
+        :param browser_pages: the most pages rendered in the browser at once
+        :param transport: the HTTP transport, used by the tests
+        """
+        self.prefix = prefix
+        self.cookies = cookies
+        self.concurrency = concurrency
+        self.transport = transport
+
+        self.frontier = URLFrontier(prefix, max_depth)
+
+        self.browser_limit = asyncio.Semaphore(browser_pages)
+        self.browser_lock = asyncio.Lock()
+        self.playwright = None
+        self.browser_context = None
+
+    def parse_page(self, url: str, html: bytes | str) -> tuple[str, list[str], bool]:
+        """
+        Extract the content and the links of the page
+        :return: the markdown, the links, and if the page runs scripts
+        """
+        doc = parse_html(html)
+
+        # Intranet pages keep their content in main.content
+        content = doc.xpath(
+            "//main[contains(concat(' ', normalize-space(@class), ' '), ' content ')]"
+        ) or doc.xpath("//body") or [doc]
+        markdown = element_to_markdown(content[0], url).strip()
+
+        links = []
+        for href in doc.xpath("//a/@href"):
+            try:
+                links.append(urljoin(url, href.strip()))
+            except ValueError:
+                # Malformed, e.g. http://[bad, only this link is skipped
+                print("Skipping malformed link:", url, href)
+
+        has_scripts = bool(doc.xpath("//script"))
+
+        return markdown, links, has_scripts
+
+    async def fetch(self, client: httpx.AsyncClient, url: str) -> Optional[bytes]:
+        """
+        Fetch the page over HTTP
+        :return: the html, or None if it isn't an intranet html page,
+        or was deleted
+        """
+        try:
+            resp = await client.get(url)
+        except httpx.HTTPError as e:
+            raise FetchError(repr(e)) from e
+
+        if resp.url.host != httpx.URL(url).host:
+            # Redirected to the login page
+            if resp.url.host in LOGIN_HOSTS:
+                raise SessionExpiredError(f"Redirected to {resp.url.host}")
+            # Moved off the intranet, e.g. to SharePoint, so it isn't crawled
+            return None
+        # Only these mean the page is gone, it's removed from the collection
+        if resp.status_code in (404, 410):
+            return None
+        if resp.status_code != 200:
+            raise FetchError(f"Status {resp.status_code}")
+        if "html" not in resp.headers.get("Content-Type", "text/html"):
+            return None
+
+        return resp.content
+
+    async def render(self, url: str) -> Optional[str]:
+        """
+        Render the page in the browser, for pages which need JavaScript
+        :return: the rendered html
+        """
+        async with self.browser_lock:
+            if self.browser_context is None:
+                self.playwright = await async_playwright().start()
+                browser = await self.playwright.chromium.launch(headless=True)
+                self.browser_context = await browser.new_context()
+                await self.browser_context.add_cookies([
+                    {"name": name, "value": value,
+                     "domain": ".cardiff.ac.uk", "path": "/"}
+                    for name, value in self.cookies.items()
+                ])
+
+        async with self.browser_limit:
+            page = await self.browser_context.new_page()
+            try:
+                await page.goto(url, wait_until="networkidle")
+                return await page.content()
+            except Exception as e:
+                print("Error while rendering:", url, e)
+                return None
+            finally:
+                await page.close()
+
+    async def crawl_page(
+            self,
+            client: httpx.AsyncClient,
+            url: str
+    ) -> tuple[Optional[Document], list[str]]:
+        html = await self.fetch(client, url)
+        if html is None:
+            return None, []
+
+        markdown, links, has_scripts = await asyncio.to_thread(
+            self.parse_page, url, html
+        )
+
+        if len(markdown) < MIN_TEXT_LENGTH and has_scripts:
+            rendered = await self.render(url)
+            if rendered is not None:
+                markdown, links, _ = await asyncio.to_thread(
+                    self.parse_page, url, rendered
+                )
+
+        if not markdown:
+            return None, links
+
+        # Same metadata as the WholeSiteReader used before
+        return Document(text=markdown, extra_info={"URL": url}), links
+
+    async def crawl(
+            self,
+            start_url: str,
+            checkpoint: Optional[CrawlCheckpoint] = None,
+            save_every: int = 100,
+    ) -> list[Document]:
+        """
+        Crawl the site from the start url, breadth first
+        :param start_url: the first page
+        :param checkpoint: where to save the progress, and resume from
+        :param save_every: save the frontier after this many pages
+        :return: a document for each page with content. With a checkpoint,
+        pages are appended to it instead, and nothing is returned
+        """
+        documents = []
+        queue = asyncio.Queue()
+        expired = asyncio.Event()
+        crawled = 0
+        # Url -> the failed attempts to crawl it
+        attempts: Counter = Counter()
+
+        if checkpoint is not None and checkpoint.resume(self.frontier):
+            print(f"Resuming the crawl, {len(self.frontier.seen)} urls seen, "
+                  f"{len(self.frontier)} left")
+            for url, depth in self.frontier.pending.items():
+                queue.put_nowait((url, depth))
+        else:
+            start_url = self.frontier.admit(start_url, 0, force=True)
+            if start_url is not None:
+                queue.put_nowait((start_url, 0))
+
+        async def worker(client: httpx.AsyncClient):
+            nonlocal crawled
+            while True:
+                url, depth = await queue.get()
+                try:
+                    document, links = await self.crawl_page(client, url)
+                    if document is not None:
+                        if checkpoint is not None:
+                            checkpoint.append(document)
+                        else:
+                            documents.append(document)
+
+                    for link in links:
+                        try:
+                            link = self.frontier.admit(link, depth + 1)
+                        except ValueError:
+                            # e.g. a port which isn't a number
+                            print("Skipping malformed link:", url, link)
+                            continue
+                        if link is not None:
+                            queue.put_nowait((link, depth + 1))
+
+                    self.frontier.complete(url)
+                    crawled += 1
+                    if crawled % save_every == 0:
+                        print(f"Crawled {crawled} pages, {queue.qsize()} queued")
+                        if checkpoint is not None:
+                            checkpoint.save_frontier(self.frontier)
+                except SessionExpiredError as e:
+                    # Keep the url pending, so it's crawled when resuming
+                    print("Session expired while crawling:", url, e)
+                    expired.set()
+                except Exception as e:
+                    # Never marked as crawled, its stored copy must not be deleted
+                    attempts[url] += 1
+                    if attempts[url] < MAX_FETCH_ATTEMPTS:
+                        queue.put_nowait((url, depth))
+                    else:
+                        print("Error while crawling, left for the next run:", url, e)
+                finally:
+                    queue.task_done()
+
+        async with httpx.AsyncClient(
+                cookies=self.cookies,
+                follow_redirects=True,
+                timeout=30,
+                limits=httpx.Limits(max_connections=self.concurrency),
+                transport=self.transport,
+        ) as client:
+            workers = [
+                asyncio.create_task(worker(client)) for _ in range(self.concurrency)
+            ]
+            waiters = [
+                asyncio.create_task(queue.join()),
+                asyncio.create_task(expired.wait()),
+            ]
+            try:
+                await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in workers + waiters:
+                    task.cancel()
+                await self.close_browser()
+
+                # Saved even when interrupted, pages being crawled stay pending
+                if checkpoint is not None:
+                    checkpoint.save_frontier(
+                        self.frontier, finished=len(self.frontier) == 0
+                    )
+                    checkpoint.close()
+
+        failed = len([url for url in attempts if url in self.frontier.pending])
+        if failed:
+            print(f"{failed} pages failed, the crawl resumes with them next time")
+
+        if expired.is_set():
+            raise SessionExpiredError(
+                "The session expired, log in again to resume the crawl"
+            )
+
+        return documents
+
+    async def close_browser(self):
+        if self.browser_context is not None:
+            await self.browser_context.browser.close()
+            await self.playwright.stop()
+            self.browser_context = None
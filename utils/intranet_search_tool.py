@@ -2,13 +2,15 @@ import asyncio
 import json
 import os
 
-from llama_index.core import VectorStoreIndex
 from llama_index.core.schema import MetadataMode
 from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.postprocessor.cohere_rerank import CohereRerank
-from llama_index.vector_stores.qdrant import QdrantVectorStore
+from opentelemetry import trace
 from qdrant_client import AsyncQdrantClient
 
+from utils.vector_store_helper import intranet_embed_dimensions, \
+    intranet_quantization, intranet_rescore_oversampling, embedding_kwargs, \
+    search_params, search_llm_text
 
 # throw Exception if the environment variables are not set
 if not os.environ.get("QDRANT_URL"):
@@ -21,14 +23,13 @@ aclient = AsyncQdrantClient(
     api_key=os.environ.get("QDRANT_API_KEY")
 )
 
-store = QdrantVectorStore("intranet", aclient=aclient)
+# The query has to be embedded with the same dimension as the collection
+embed_model = OpenAIEmbedding(**embedding_kwargs(intranet_embed_dimensions()))
 
-embed_model = OpenAIEmbedding(model="text-embedding-3-large")
+# Rescore with the original vectors if the collection is quantized
+params = search_params(intranet_quantization(), intranet_rescore_oversampling())
 
-index = VectorStoreIndex.from_vector_store(
-    vector_store=store,
-    embed_model=embed_model,
-)
+tracer = trace.get_tracer(__name__)
 
 
 async def search_intranet(query: str) -> str:
@@ -36,17 +37,23 @@ async def search_intranet(query: str) -> str:
     Search the intranet for the given query
     """
 
-    retriever = index.as_retriever(similarity_top_k=100)
-
-    results = await retriever.aretrieve(query)
-
-    # Reranking
-    reranker = CohereRerank(model="rerank-english-v3.0")
-    # Reranker asynchronously
-    results = await (asyncio.to_thread(reranker.postprocess_nodes,
-                                       nodes=results, query_str=query))
-    results = results[:3]
-
-    return json.dumps({
-        "results": [result.get_content(MetadataMode.LLM) for result in results]
-    })
+    # Each stage is traced, so we can see where the time goes
+    with tracer.start_as_current_span("embed"):
+        query_embedding = await embed_model.aget_query_embedding(query)
+
+    with tracer.start_as_current_span("search"):
+        # Results contain the text pre-rendered for the LLM at ingestion
+        results = await search_llm_text(aclient, "intranet", query_embedding,
+                                        100, params)
+
+    with tracer.start_as_current_span("rerank"):
+        reranker = CohereRerank(model="rerank-english-v3.0")
+        # Reranker asynchronously
+        results = await (asyncio.to_thread(reranker.postprocess_nodes,
+                                           nodes=results, query_str=query))
+        results = results[:3]
+
+    with tracer.start_as_current_span("render"):
+        return json.dumps({
+            "results": [result.get_content(MetadataMode.LLM) for result in results]
+        })
@@ -6,10 +6,12 @@ from typing import Optional, Union
 
 import httpx
 from bs4 import BeautifulSoup
-from playwright.async_api import async_playwright
 from pydantic import BaseModel
 
+from utils.browser_pool import browser_pool
+
 from utils.db import pool
+from utils.session_store import CookieLoader
 
 BASE_URL = "https://learningcentral.cf.ac.uk"
 
@@ -21,11 +23,7 @@ async def get_learning_central_cookies(cookies_dict: dict) -> list[dict]:
     browse the learning central service
     :return: the cookies from the learning central service
     """
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-
-        context = await browser.new_context()
-
+    async with browser_pool.context() as context:
         cookies = []
 
         for key, value in cookies_dict.items():
@@ -89,8 +87,6 @@ async def get_learning_central_cookies(cookies_dict: dict) -> list[dict]:
                     "path": cookie["path"],
                 })
 
-        await context.close()
-
         return cookies
 
 
@@ -100,13 +96,15 @@ xsrf_matcher = re.compile(
 expires_matcher = re.compile(r"expires:(\d+)")  # matches expires:number
 
 
-async def get_cached_cookies(username: str, cookies_dict: dict) -> list[dict]:
+async def get_cached_cookies(
+        username: str, cookie_loader: CookieLoader
+) -> list[dict]:
     """
     Get the cached cookies from the database, else fetch it with
     the cookies and upsert it.
     :param username: the username to lookup in the database for cache
-    :param cookies_dict: authentication cookies used to
-    browse the learning central service
+    :param cookie_loader: loads the authentication cookies used to
+    browse the learning central service, only called if not cached
     :return: the cookies from the learning central service
     """
     async with pool.connection() as conn:
@@ -120,7 +118,9 @@ async def get_cached_cookies(username: str, cookies_dict: dict) -> list[dict]:
             if result is not None:
                 return json.loads(result[0])
             else:
-                cookies = await get_learning_central_cookies(cookies_dict)
+                cookies = await get_learning_central_cookies(
+                    await cookie_loader()
+                )
                 for cookie in cookies:
                     if cookie["name"] == "BbRouter":
                         expiry = int(expires_matcher.search(cookie["value"]).group(1))
@@ -5,6 +5,7 @@ from openai import BaseModel
 from utils.learning_central_helper import get_cached_cookies, \
     extract_learning_central_stream_entries, \
     LearningCentralStreamEntry, GradeDetails
+from utils.session_store import CookieLoader
 
 
 class StreamEntriesResponse(BaseModel):
@@ -14,9 +15,11 @@ class StreamEntriesResponse(BaseModel):
     stream_entries: List[Union[LearningCentralStreamEntry, GradeDetails]]
 
 
-async def get_learning_central_stream(username: str, cookies_dict: dict) -> str:
+async def get_learning_central_stream(
+        username: str, cookie_loader: CookieLoader
+) -> str:
     # Get the cookies for learning central
-    cookies = await get_cached_cookies(username, cookies_dict)
+    cookies = await get_cached_cookies(username, cookie_loader)
 
     # Extract the stream entries using the cookies
     stream_entries = await extract_learning_central_stream_entries(cookies)
@@ -1,88 +1,378 @@
 import asyncio
 import os
-from typing import Union
+import time
+from collections import OrderedDict
+from typing import Optional, Union
+from urllib.parse import urlsplit
 
-import html2text
 import httpx
-from bs4 import BeautifulSoup
 from llama_index.core import Document
+from psycopg.rows import dict_row
+from pydantic import BaseModel
+
+from utils.db import pool
+from utils.html_helper import extract_markdown
 
 client = httpx.AsyncClient()
 SEARX_URL = os.getenv("SEARX_URL", "https://searx-api.kavin.rocks")
+# Comma separated SearXNG instances, tried in order
+SEARX_URLS = [
+    url.strip().rstrip("/")
+    for url in os.getenv("SEARX_URLS", SEARX_URL).split(",")
+    if url.strip()
+]
+# Start the next instance if there's no answer after this many seconds,
+# 0 races all the instances at once
+SEARX_HEDGE_DELAY = float(os.getenv("SEARX_HEDGE_DELAY", 0.5))
+SEARX_TIMEOUT = float(os.getenv("SEARX_TIMEOUT", 5))
+
+# How long search results are reused, and how many queries are kept
+SEARCH_CACHE_TTL = int(os.getenv("SEARX_CACHE_TTL", 60 * 60))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARX_CACHE_SIZE", 1024))
+
+# Normalised query -> (time cached, links)
+search_cache: OrderedDict[str, tuple[float, list[str]]] = OrderedDict()
+
+# How long a cached page is used without asking the website if it changed
+PAGE_CACHE_TTL = int(os.getenv("UNI_WEBSITE_CACHE_TTL", 24 * 60 * 60))
+
+# Limits for fetching the pages of the search results, times are in seconds
+HOST_CONCURRENCY = int(os.getenv("UNI_WEBSITE_HOST_CONCURRENCY", 4))
+REQUEST_TIMEOUT = float(os.getenv("UNI_WEBSITE_REQUEST_TIMEOUT", 5))
+FETCH_DEADLINE = float(os.getenv("UNI_WEBSITE_FETCH_DEADLINE", 8))
+MAX_PAGE_BYTES = int(os.getenv("UNI_WEBSITE_MAX_PAGE_BYTES", 2 * 1024 * 1024))
+# Stop waiting for the other pages once this many have arrived
+ENOUGH_DOCUMENTS = int(os.getenv("UNI_WEBSITE_ENOUGH_DOCUMENTS", 6))
+
+
+async def searxng_instance_search(url: str, query: str) -> Optional[list[str]]:
+    """
+    Search one SearXNG instance
+    :param url: the url of the instance
+    :param query: the user's query
+    :return: the links found, or None if the instance failed
+    """
+    try:
+        # Take in the user's query using SearXNG API
+        # specify site:cardiff.ac.uk to only search for Cardiff University's website
+        response = await client.get(
+            f"{url}/search",
+            params={
+                "q": f"{query} site:cardiff.ac.uk",
+                "format": "json"
+            },
+            timeout=SEARX_TIMEOUT
+        )
+    except httpx.HTTPError as e:
+        print("Error while searching SearXNG:", url, e)
+        return None
+
+    if response.status_code != 200:
+        print("SearXNG returned", response.status_code, url)
+        return None
+
+    try:
+        results = response.json().get("results") or []
+    except ValueError as e:
+        # Some instances answer with an html error page
+        print("SearXNG returned invalid json:", url, e)
+        return None
+
+    # Extract the url link from the results
+    return [result['url'] for result in results]
+
+
+async def race_searxng(query: str) -> Optional[list[str]]:
+    """
+    Search the SearXNG instances, starting the next one when the previous
+    is slow or fails, and take the first response with results
+    :param query: the user's query
+    :return: the links found, an empty list if nothing was found,
+    or None if every instance failed
+    """
+    # Nothing to search with if SEARX_URLS is empty
+    if not SEARX_URLS:
+        print("No SearXNG instances configured, set SEARX_URLS")
+        return []
+
+    pending = set()
+    started = 0
+    answered = False
 
+    def start_next():
+        nonlocal started
+        url = SEARX_URLS[started]
+        pending.add(asyncio.create_task(searxng_instance_search(url, query)))
+        started += 1
+
+    start_next()
+
+    try:
+        while pending:
+            # Hedge with the next instance if none answered in time
+            timeout = SEARX_HEDGE_DELAY if started < len(SEARX_URLS) else None
+            done, pending = await asyncio.wait(
+                pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+
+            for task in done:
+                links = task.result()
+                if links:
+                    return links
+                if links is not None:
+                    answered = True
+
+            # Slow, failed or empty answers move on to the next instance
+            if started < len(SEARX_URLS):
+                start_next()
+
+        return [] if answered else None
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def searxng_search(query: str) -> Optional[list[str]]:
+    """
+    Search the Cardiff University website with SearXNG,
+    reusing the results of recent identical queries
+    :param query: the user's query
+    :return: the links found, or None if the search failed
+    """
+    key = " ".join(query.lower().split())
+
+    cached = search_cache.get(key)
+    if cached is not None and time.monotonic() - cached[0] < SEARCH_CACHE_TTL:
+        search_cache.move_to_end(key)
+        return list(cached[1])
+
+    links = await race_searxng(query)
+
+    # Failures and empty results aren't cached, so they're retried next time
+    if links:
+        search_cache[key] = (time.monotonic(), links)
+        search_cache.move_to_end(key)
+        while len(search_cache) > SEARCH_CACHE_SIZE:
+            search_cache.popitem(last=False)
+
+    return list(links) if links is not None else None
+
+
+class CachedPage(BaseModel):
+    url: str
+    markdown: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    fetched_at: int
+
+
+async def get_cached_page(url: str) -> Optional[CachedPage]:
+    """
+    Get the cached page from the database
+    :param url: the url of the page
+    :return: the cached page, or None if it's not cached
+    """
+    async with pool.connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute(
+                "SELECT url, markdown, etag, last_modified, fetched_at"
+                " FROM uni_website_cache WHERE url = %s",
+                (url,)
+            )
+            row = await cur.fetchone()
 
-async def searxng_search(query) -> list[str]:
-    print("Searching for:", query)
-    # Take in the user's query using SearXNG API
-    # specify site:cardiff.ac.uk to only search for Cardiff University's website
-    response = await client.get(
-        f"{SEARX_URL}/search",
-        params={
-            "q": f"{query} site:cardiff.ac.uk",
-            "format": "json"
+            if row is None:
+                return None
+
+            return CachedPage(**row)
+
+
+async def save_cached_page(page: CachedPage):
+    """
+    Upsert the page into the cache
+    :param page: the page to cache
+    """
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "INSERT INTO uni_website_cache"
+                " (url, markdown, etag, last_modified, fetched_at)"
+                " VALUES (%s, %s, %s, %s, %s)"
+                " ON CONFLICT (url) DO UPDATE"
+                " SET markdown = EXCLUDED.markdown, etag = EXCLUDED.etag,"
+                " last_modified = EXCLUDED.last_modified,"
+                " fetched_at = EXCLUDED.fetched_at",
+                (page.url, page.markdown, page.etag, page.last_modified,
+                 page.fetched_at)
+            )
+
+
+async def touch_cached_page(url: str, fetched_at: int):
+    """
+    Mark the cached page as fresh again, after the website said it's unchanged
+    :param url: the url of the page
+    :param fetched_at: the time the page was revalidated
+    """
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "UPDATE uni_website_cache SET fetched_at = %s WHERE url = %s",
+                (fetched_at, url)
+            )
+
+
+def conditional_headers(page: Optional[CachedPage]) -> dict:
+    """
+    Build the headers to ask the website if the cached page changed
+    :param page: the cached page
+    :return: the If-None-Match and If-Modified-Since headers
+    """
+    headers = {}
+
+    if page is None:
+        return headers
+
+    if page.etag:
+        headers["If-None-Match"] = page.etag
+    if page.last_modified:
+        headers["If-Modified-Since"] = page.last_modified
+
+    return headers
+
+
+async def fetch_page(link: str, headers: dict) -> tuple[httpx.Response, bytes]:
+    """
+    Fetch the page, without downloading more than MAX_PAGE_BYTES
+    :param link: the link to fetch
+    :param headers: the request headers
+    :return: the response, and its body
+    """
+    async with client.stream("GET", link, headers=headers) as resp:
+        length = resp.headers.get("Content-Length")
+        if length and int(length) > MAX_PAGE_BYTES:
+            raise Exception(f"Page is larger than {MAX_PAGE_BYTES} bytes")
+
+        content = bytearray()
+        async for chunk in resp.aiter_bytes():
+            content += chunk
+            # The length header can be missing or wrong
+            if len(content) > MAX_PAGE_BYTES:
+                raise Exception(f"Page is larger than {MAX_PAGE_BYTES} bytes")
+
+        return resp, bytes(content)
+
+
+def page_document(link: str, markdown: str) -> Document:
+    return Document(
+        text=markdown,
+        extra_info={
+            "Source": link
         }
     )
-    if response.status_code == 200:
-        results = response.json().get("results")
-
-        # Extract the url link from the results
-        links = [result['url'] for result in results]
-        print(links)
-        return links
 
 
 async def get_text(link: str) -> Union[Document, None]:
     """
-    Get the text from the given link
+    Get the text from the given link, using the page cache when possible
     :param link: the link to get the text from
     :return: the markdown text from the link
     """
     try:
-        resp = await client.get(link)
+        try:
+            cached = await get_cached_page(link)
+        except Exception as e:
+            # The cache is only an optimisation, fetch the page without it
+            print("Error while reading the page cache:", link, e)
+            cached = None
+
+        now = int(time.time())
+
+        # Serve fresh pages straight from the cache
+        if cached is not None and now - cached.fetched_at < PAGE_CACHE_TTL:
+            return page_document(link, cached.markdown)
+
+        async with asyncio.timeout(REQUEST_TIMEOUT):
+            resp, content = await fetch_page(link, conditional_headers(cached))
+
+        # The page didn't change, so we can skip downloading and parsing it
+        if resp.status_code == 304 and cached is not None:
+            try:
+                await touch_cached_page(link, now)
+            except Exception as e:
+                print("Error while writing the page cache:", link, e)
+            return page_document(link, cached.markdown)
+
         if resp.status_code == 200:
-            doc = BeautifulSoup(resp.text, "html.parser")
-
-            # Remove unwanted elements
-            for nav in doc.find_all("nav"):
-                nav.decompose()
-            for footer in doc.find_all("footer"):
-                footer.decompose()
-            for header in doc.find_all("header"):
-                header.decompose()
-            for element in doc.recursiveChildGenerator():
-                # Skip NavigableString
-                if element.name is None:
-                    continue
-
-                # Check if element contains these in class
-                blacklist = ["footer", "btn"]
-                for class_name in element.get("class", []):
-                    if class_name in blacklist:
-                        element.decompose()
-                        break
-
-            # Convert the HTML to markdown
-            text = html2text.html2text(str(doc.prettify("utf-8"), encoding='utf-8'))
-
-            return Document(
-                text=text,
-                extra_info={
-                    "Source": link
-                }
-            )
+            # Extracted on a worker thread, so other requests aren't blocked
+            markdown = await extract_markdown(content, link)
+
+            try:
+                await save_cached_page(CachedPage(
+                    url=link,
+                    markdown=markdown,
+                    etag=resp.headers.get("ETag"),
+                    last_modified=resp.headers.get("Last-Modified"),
+                    fetched_at=now,
+                ))
+            except Exception as e:
+                print("Error while writing the page cache:", link, e)
+
+            return page_document(link, markdown)
     except Exception as e:
         print("Error while parsing the document:", link, e)
         return None
 
 
-async def transform_data(links):
-    tasks = []
+async def transform_data(
+        links: Optional[list[str]],
+        enough: int = ENOUGH_DOCUMENTS,
+        deadline: float = FETCH_DEADLINE
+) -> list[Document]:
+    """
+    Fetch the pages of the links concurrently, with at most HOST_CONCURRENCY
+    requests to each host. Returns once enough pages have arrived, or when the
+    deadline is reached, and cancels the pages still being fetched.
+    :param links: the links to fetch, in the order of the search results
+    :param enough: the number of documents to wait for
+    :param deadline: the time to wait for the pages, in seconds
+    :return: the documents that arrived, in the order of the links
+    """
+    if not links:
+        return []
+
+    host_limits = {}
+
+    async def fetch(link: str) -> Optional[Document]:
+        host = urlsplit(link).hostname
+        limit = host_limits.setdefault(host, asyncio.Semaphore(HOST_CONCURRENCY))
+        async with limit:
+            return await get_text(link)
+
+    tasks = {asyncio.create_task(fetch(link)): i for i, link in enumerate(links)}
+    pending = set(tasks)
+    documents = {}
 
-    for link in links:
-        tasks.append(asyncio.create_task(get_text(link)))
-    documents = await asyncio.gather(*tasks)
+    loop = asyncio.get_running_loop()
+    deadline_at = loop.time() + deadline
 
-    # remove None documents
-    documents = [doc for doc in documents if doc]
+    try:
+        while pending and len(documents) < enough:
+            timeout = deadline_at - loop.time()
+            if timeout <= 0:
+                break
+
+            done, pending = await asyncio.wait(
+                pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                # get_text returns None for pages which couldn't be used
+                document = task.result()
+                if document:
+                    documents[tasks[task]] = document
+    finally:
+        # Don't let the stragglers hold the tool up
+        for task in pending:
+            task.cancel()
 
-    return documents
+    # Keep the search engine's ranking
+    return [documents[i] for i in sorted(documents)]
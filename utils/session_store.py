@@ -0,0 +1,85 @@
+import json
+import os
+import secrets
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from utils.db import pool
+
+# Sessions kept in memory, the rest are loaded from the database
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", 1024))
+
+# Loads the university cookies of the user, only called by the tools needing them
+CookieLoader = Callable[[], Awaitable[dict]]
+
+# Session id -> the cookies and the expiry timestamp, least recently used first
+session_cache: OrderedDict[str, tuple[dict, int]] = OrderedDict()
+
+
+def cache_session(session_id: str, cookies: dict, expiry: int):
+    session_cache[session_id] = (cookies, expiry)
+    session_cache.move_to_end(session_id)
+    while len(session_cache) > SESSION_CACHE_SIZE:
+        session_cache.popitem(last=False)
+
+
+async def create_session(username: str, cookies: dict, expiry: int) -> str:
+    """
+    Store the cookies of a login
+    :param username: the user who logged in
+    :param cookies: the university cookies of the login
+    :param expiry: the timestamp the session expires at, the expiry of the token
+    :return: the session id, to put in the token
+    """
+    session_id = secrets.token_urlsafe(32)
+
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            # Clean up the expired sessions, the expiry is indexed
+            await cur.execute(
+                "DELETE FROM user_sessions WHERE expiry < %s", (int(time.time()),)
+            )
+            await cur.execute(
+                "INSERT INTO user_sessions (session_id, username, cookies, expiry)"
+                " VALUES (%s, %s, %s, %s)",
+                (session_id, username, json.dumps(cookies), expiry)
+            )
+
+    cache_session(session_id, cookies, expiry)
+
+    return session_id
+
+
+async def load_cookies(session_id: str) -> Optional[dict]:
+    """
+    Get the cookies of a session, from memory if it was used recently
+    :return: the cookies, or None if the session doesn't exist or expired
+    """
+    now = time.time()
+
+    cached = session_cache.get(session_id)
+    if cached is not None:
+        cookies, expiry = cached
+        if expiry > now:
+            session_cache.move_to_end(session_id)
+            return cookies
+        del session_cache[session_id]
+        return None
+
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "SELECT cookies, expiry FROM user_sessions"
+                " WHERE session_id = %s AND expiry > %s",
+                (session_id, int(now))
+            )
+            result = await cur.fetchone()
+
+    if result is None:
+        return None
+
+    cookies = json.loads(result[0])
+    cache_session(session_id, cookies, result[1])
+
+    return cookies
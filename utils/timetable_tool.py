@@ -4,15 +4,16 @@ from typing import List
 
 from pydantic import TypeAdapter
 
+from utils.session_store import CookieLoader
 from utils.timetables_helper import get_cached_ical_url, parse_ical, TimetableEvent
 
 
-async def get_timetable(username: str, cookies: dict) -> str:
+async def get_timetable(username: str, cookie_loader: CookieLoader) -> str:
     """
     Get the timetable for the given user
     """
 
-    ical_url = await get_cached_ical_url(username, cookies)
+    ical_url = await get_cached_ical_url(username, cookie_loader)
 
     events = await parse_ical(ical_url)
 
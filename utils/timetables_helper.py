@@ -1,9 +1,24 @@
-from httpx import AsyncClient
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import httpx
 from ical_library import client as ical_client
-from playwright.async_api import async_playwright
 from pydantic import BaseModel
 
+from utils.browser_pool import browser_pool
 from utils.db import pool
+from utils.session_store import CookieLoader
+
+# How long the parsed timetable is used without asking if the feed changed,
+# and how many timetables are kept
+TIMETABLE_CACHE_TTL = int(os.getenv("TIMETABLE_CACHE_TTL", 15 * 60))
+TIMETABLE_CACHE_SIZE = int(os.getenv("TIMETABLE_CACHE_SIZE", 256))
+
+# Connections to the timetable service are reused between requests
+client = httpx.AsyncClient()
 
 
 async def get_ical_url(cookies_dict: dict) -> str:
@@ -13,11 +28,8 @@ async def get_ical_url(cookies_dict: dict) -> str:
     browse the timetables service
     :return: the ical url
     """
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-
-        context = await browser.new_context()
-
+    # The context is closed afterwards, with the cookies of the user
+    async with browser_pool.context() as context:
         page = await context.new_page()
 
         cookies = []
@@ -58,13 +70,13 @@ async def get_ical_url(cookies_dict: dict) -> str:
         return ical_url
 
 
-async def get_cached_ical_url(username: str, cookies_dict: dict) -> str:
+async def get_cached_ical_url(username: str, cookie_loader: CookieLoader) -> str:
     """
     Get the cached ical url from the database, else fetch it with
     the cookies and upsert it.
     :param username: the username to lookup in the database for cache
-    :param cookies_dict: authentication cookies used to
-    fetch ical for timetables service
+    :param cookie_loader: loads the authentication cookies used to
+    fetch ical for timetables service, only called if not cached
     :return:
     """
     async with pool.connection() as conn:
@@ -77,7 +89,7 @@ async def get_cached_ical_url(username: str, cookies_dict: dict) -> str:
             ical_url = await cur.fetchone()
 
             if ical_url is None:
-                ical_url = await get_ical_url(cookies_dict)
+                ical_url = await get_ical_url(await cookie_loader())
             else:
                 return ical_url[0]
 
@@ -98,25 +110,85 @@ class TimetableEvent(BaseModel):
     description: str
 
 
+class CachedTimetable(BaseModel):
+    events: list[TimetableEvent]
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    fetched_at: float
+
+
+# iCal URL -> the parsed timetable, least recently used first
+timetable_cache: OrderedDict[str, CachedTimetable] = OrderedDict()
+
+
+def parse_events(text: str) -> list[TimetableEvent]:
+    calendar = ical_client.parse_lines_into_calendar(text)
+
+    return [
+        TimetableEvent(
+            start=event.start.to_datetime_string(),
+            end=event.end.to_datetime_string(),
+            location=event.location.value,
+            description=event.description.value,
+        )
+        for event in calendar.events
+    ]
+
+
+def cache_timetable(ical_url: str, timetable: CachedTimetable):
+    timetable_cache[ical_url] = timetable
+    timetable_cache.move_to_end(ical_url)
+    while len(timetable_cache) > TIMETABLE_CACHE_SIZE:
+        timetable_cache.popitem(last=False)
+
+
 async def parse_ical(ical_url: str) -> list[TimetableEvent]:
     """'
     Parse ical url and fetch timetable events from it.
+    The events are cached, and the feed is only downloaded again if it changed.
 
     :param ical_url The ical URL to fetch.
     """
-    events = []
-
-    async with AsyncClient() as client:
-        response = await client.get(ical_url)
-
-        calendar = ical_client.parse_lines_into_calendar(response.text)
-
-        for event in calendar.events:
-            events.append(TimetableEvent(
-                start=event.start.to_datetime_string(),
-                end=event.end.to_datetime_string(),
-                location=event.location.value,
-                description=event.description.value,
-            ))
-
-    return events
+    now = time.time()
+    cached = timetable_cache.get(ical_url)
+
+    # Follow-up questions use the events parsed before
+    if cached is not None and now - cached.fetched_at < TIMETABLE_CACHE_TTL:
+        timetable_cache.move_to_end(ical_url)
+        return list(cached.events)
+
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+
+    try:
+        response = await client.get(ical_url, headers=headers)
+    except httpx.HTTPError as e:
+        if cached is None:
+            raise
+        # The timetable rarely changes, so an old copy is better than nothing
+        print("Failed to fetch the timetable, using the cached one:", repr(e))
+        return list(cached.events)
+
+    # The timetable didn't change, so there's nothing to download or parse
+    if response.status_code == 304 and cached is not None:
+        cache_timetable(ical_url, cached.model_copy(update={"fetched_at": now}))
+        return list(cached.events)
+
+    if response.status_code != 200:
+        raise Exception(f"Failed to fetch the timetable: {response.status_code}")
+
+    # Parsed on a worker thread, so other requests aren't blocked
+    events = await asyncio.to_thread(parse_events, response.text)
+
+    cache_timetable(ical_url, CachedTimetable(
+        events=events,
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified"),
+        fetched_at=now,
+    ))
+
+    return list(events)
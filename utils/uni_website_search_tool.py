@@ -2,35 +2,140 @@ import json
 import os
 import asyncio
 
-from llama_index.core.schema import MetadataMode, NodeWithScore
+from llama_index.core import Document
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import BaseNode, MetadataMode, NodeWithScore
+from llama_index.core.utils import get_tokenizer
+from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.postprocessor.cohere_rerank import CohereRerank
+from qdrant_client import AsyncQdrantClient
 
 from utils.scrape_uni_website import searxng_search, transform_data
+from utils.vector_store_helper import EMBED_MODEL, search_llm_text
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 
+# throw Exception if the environment variables are not set
+if not os.environ.get("QDRANT_URL"):
+    raise ValueError("QDRANT_URL environment variable not set")
+if not os.environ.get("QDRANT_API_KEY"):
+    raise ValueError("QDRANT_API_KEY environment variable not set")
 
-async def search_uni_website(query: str) -> str:
+aclient = AsyncQdrantClient(
+    url=os.environ.get("QDRANT_URL"),
+    api_key=os.environ.get("QDRANT_API_KEY")
+)
+
+# The pre-crawled website, see UniWebsiteSource in scripts/ingest.py
+embed_model = OpenAIEmbedding(model=EMBED_MODEL)
+# The best indexed passage needs at least this relevance,
+# otherwise the website is searched live
+INDEX_MIN_RELEVANCE = float(os.getenv("UNI_WEBSITE_INDEX_MIN_RELEVANCE", 0.3))
+
+# Pages are reranked in passages of this many tokens
+PASSAGE_SIZE = int(os.getenv("UNI_WEBSITE_PASSAGE_SIZE", 256))
+# The most passages sent to the reranker, and the most returned
+MAX_PASSAGES = int(os.getenv("UNI_WEBSITE_MAX_PASSAGES", 100))
+TOP_PASSAGES = int(os.getenv("UNI_WEBSITE_TOP_PASSAGES", 8))
+# The most tokens of passages returned to the model
+TOKEN_CAP = int(os.getenv("UNI_WEBSITE_TOKEN_CAP", 1500))
+
+splitter = SentenceSplitter(chunk_size=PASSAGE_SIZE, chunk_overlap=20)
+
+
+def split_passages(documents: list[Document]) -> list[BaseNode]:
     """
-    Search the Cardiff University's website for the given query
+    Split the pages into passages, dropping passages repeated across pages,
+    e.g. banners and contact details
+    :param documents: the pages, in the order of the search results
+    :return: the unique passages, keeping the source url of their page
     """
-    search_links = await searxng_search(query)
-    documents = await transform_data(search_links)
+    passages = []
+    seen = set()
 
-    # Get the first 10 documents
-    nodes = documents[:10]
+    for node in splitter.get_nodes_from_documents(documents):
+        key = " ".join(node.get_content().lower().split())
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        passages.append(node)
 
-    # Convert to NodeWithScore
-    nodes = [NodeWithScore(node=node) for node in nodes]
+    return passages[:MAX_PASSAGES]
+
+
+def select_passages(results: list[NodeWithScore], token_cap: int) -> list[str]:
+    """
+    Take the best passages, until the token cap is reached
+    :param results: the reranked passages, best first
+    :param token_cap: the most tokens to return
+    :return: the passages, rendered with their source url
+    """
+    tokenizer = get_tokenizer()
+    selected = []
+    tokens = 0
+
+    for result in results:
+        text = result.get_content(MetadataMode.LLM)
+        size = len(tokenizer(text))
+        if tokens + size > token_cap:
+            # A smaller passage further down may still fit
+            continue
+        selected.append(text)
+        tokens += size
+
+    return selected
+
+
+async def rerank(query: str, nodes: list[NodeWithScore]) -> list[NodeWithScore]:
+    if not nodes:
+        return []
 
     # Reranker
-    reranker = CohereRerank(model="rerank-english-v3.0")
+    reranker = CohereRerank(model="rerank-english-v3.0", top_n=TOP_PASSAGES)
     # Reranker asynchronously
-    results = await asyncio.to_thread(reranker.postprocess_nodes,
-                                      nodes=nodes, query_str=query)
-    results = results[:3]
+    return await asyncio.to_thread(reranker.postprocess_nodes,
+                                   nodes=nodes, query_str=query)
+
+
+async def search_index(query: str) -> list[NodeWithScore]:
+    """
+    Search the pre-crawled website
+    :return: the closest passages, or nothing if the index can't be used
+    """
+    try:
+        query_embedding = await embed_model.aget_query_embedding(query)
+        return await search_llm_text(aclient, "uni_website", query_embedding,
+                                     MAX_PASSAGES)
+    except Exception as e:
+        # e.g. the website hasn't been crawled yet
+        print("Error while searching the website index:", e)
+        return []
+
+
+async def search_live(query: str) -> list[NodeWithScore]:
+    """
+    Search the website with SearXNG, and fetch the pages found
+    :return: the passages of the pages
+    """
+    search_links = await searxng_search(query)
+    # Only the pages that arrive before the deadline are used
+    documents = await transform_data(search_links)
+
+    # Convert to NodeWithScore
+    return [NodeWithScore(node=node) for node in split_passages(documents)]
+
+
+async def search_uni_website(query: str) -> str:
+    """
+    Search the Cardiff University's website for the given query
+    """
+    results = await rerank(query, await search_index(query))
+
+    # Pages missing from the index are searched live
+    if not results or (results[0].score or 0) < INDEX_MIN_RELEVANCE:
+        results = await rerank(query, await search_live(query))
 
     # return the results in json format to pass to the chat endpoint
     return json.dumps({
-        "results": [result.get_content(MetadataMode.LLM) for result in results]
+        "results": select_passages(results, TOKEN_CAP)
     })
@@ -0,0 +1,317 @@
+import os
+from typing import Any, List, Optional, Tuple
+
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode, MetadataMode, NodeWithScore, TextNode
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+from llama_index.vector_stores.qdrant import QdrantVectorStore
+from qdrant_client import AsyncQdrantClient, models
+
+# text-embedding-3-large returns 3072 dimensions unless asked for fewer
+EMBED_MODEL = "text-embedding-3-large"
+FULL_EMBED_DIMENSIONS = 3072
+
+QUANTIZATION_MODES = ["none", "scalar", "binary"]
+
+# Payload field holding the text already rendered for the LLM
+LLM_TEXT_KEY = "llm_text"
+
+# Payload fields used by the vector store to delete nodes by document
+DOCUMENT_KEYS = ["doc_id", "document_id", "ref_doc_id"]
+
+
+def intranet_embed_dimensions() -> int:
+    """
+    Get the embedding dimension used by the intranet collection.
+    Read lazily, so scripts can load the .env file before it's used
+    :return: the number of dimensions to request from the embedding model
+    """
+    dimensions = int(os.getenv("INTRANET_EMBED_DIMENSIONS", FULL_EMBED_DIMENSIONS))
+
+    if not 0 < dimensions <= FULL_EMBED_DIMENSIONS:
+        raise ValueError(
+            f"INTRANET_EMBED_DIMENSIONS must be between 1 and {FULL_EMBED_DIMENSIONS}"
+        )
+
+    return dimensions
+
+
+def intranet_quantization() -> str:
+    """
+    Get the quantization mode used by the intranet collection
+    :return: one of "none", "scalar" or "binary"
+    """
+    quantization = os.getenv("INTRANET_QUANTIZATION", "none").lower()
+
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(
+            f"INTRANET_QUANTIZATION must be one of {', '.join(QUANTIZATION_MODES)}"
+        )
+
+    return quantization
+
+
+def intranet_rescore_oversampling() -> float:
+    """
+    Get how many extra candidates to fetch from the quantized index,
+    before rescoring them with the original vectors
+    """
+    return float(os.getenv("INTRANET_RESCORE_OVERSAMPLING", 2.0))
+
+
+def embedding_kwargs(dimensions: int) -> dict:
+    """
+    Build the keyword arguments for OpenAIEmbedding for the given dimension
+    :param dimensions: the number of dimensions wanted
+    :return: the kwargs to pass to OpenAIEmbedding
+    """
+    # Only send the dimensions parameter when we actually want to reduce it
+    if dimensions == FULL_EMBED_DIMENSIONS:
+        return {"model": EMBED_MODEL}
+    return {"model": EMBED_MODEL, "dimensions": dimensions}
+
+
+def quantization_config(
+        quantization: str
+) -> Optional[models.QuantizationConfig]:
+    """
+    Build the Qdrant quantization config for the given mode
+    :param quantization: one of "none", "scalar" or "binary"
+    :return: the quantization config, or None when not quantizing
+    """
+    match quantization:
+        case "none":
+            return None
+        case "scalar":
+            # int8 is 4x smaller than float32, with little loss in accuracy
+            return models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(
+                    type=models.ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=True,
+                )
+            )
+        case "binary":
+            # 1 bit per dimension, 32x smaller than float32
+            return models.BinaryQuantization(
+                binary=models.BinaryQuantizationConfig(always_ram=True)
+            )
+        case _:
+            raise ValueError(f"Unknown quantization mode: {quantization}")
+
+
+def vectors_config(dimensions: int, quantization: str) -> models.VectorParams:
+    """
+    Build the Qdrant vector params for the given dimension and quantization
+    :param dimensions: the size of the vectors
+    :param quantization: one of "none", "scalar" or "binary"
+    :return: the vector params
+    """
+    return models.VectorParams(
+        size=dimensions,
+        distance=models.Distance.COSINE,
+        # Keep the original vectors on disk when quantizing,
+        # only the quantized vectors need to be in RAM
+        on_disk=quantization != "none",
+    )
+
+
+def search_params(
+        quantization: str,
+        oversampling: float = 2.0
+) -> Optional[models.SearchParams]:
+    """
+    Build the search params for a collection with the given quantization
+    :param quantization: one of "none", "scalar" or "binary"
+    :param oversampling: how many more candidates to fetch before rescoring
+    :return: the search params, or None when not quantized
+    """
+    if quantization == "none":
+        return None
+
+    return models.SearchParams(
+        quantization=models.QuantizationSearchParams(
+            ignore=False,
+            # Rescore the candidates with the original vectors
+            rescore=True,
+            oversampling=oversampling,
+        )
+    )
+
+
+async def ensure_collection(
+        aclient: AsyncQdrantClient,
+        collection_name: str,
+        dimensions: int,
+        quantization: str,
+) -> bool:
+    """
+    Create the collection with the given settings, if it doesn't exist yet.
+    An existing collection is left as is, as changing the dimension
+    requires re-embedding everything.
+    :return: True if the collection was created
+    :raises Exception: if the existing collection has vectors of another size
+    """
+    if await aclient.collection_exists(collection_name):
+        info = await aclient.get_collection(collection_name)
+        vectors = info.config.params.vectors
+        if isinstance(vectors, models.VectorParams) and vectors.size != dimensions:
+            raise Exception(
+                f"The {collection_name} collection has {vectors.size} dimension "
+                f"vectors, not {dimensions}. Delete the collection to re-embed it "
+                "with the new dimension, or change the setting back"
+            )
+        return False
+
+    await aclient.create_collection(
+        collection_name=collection_name,
+        vectors_config=vectors_config(dimensions, quantization),
+        quantization_config=quantization_config(quantization),
+    )
+
+    return True
+
+
+class LLMTextQdrantVectorStore(QdrantVectorStore):
+    """
+    Qdrant vector store which stores a compact payload: the node's text
+    rendered for the LLM, instead of the serialised node and its metadata.
+    This way search results don't need to be parsed and rendered at query time.
+    """
+
+    _payload_keys: List[str] = PrivateAttr()
+
+    def __init__(
+            self,
+            collection_name: str,
+            payload_keys: Optional[List[str]] = None,
+            **kwargs: Any
+    ) -> None:
+        """
+        :param collection_name: the collection to store the nodes in
+        :param payload_keys: metadata keys to keep in the payload, e.g. for filtering
+        """
+        super().__init__(collection_name, **kwargs)
+        self._payload_keys = payload_keys or []
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LLMTextQdrantVectorStore"
+
+    def _build_points(self, nodes: List[BaseNode]) -> Tuple[List[Any], List[str]]:
+        points, ids = super()._build_points(nodes)
+
+        # Points are built in the same order as the nodes
+        for point, node in zip(points, nodes):
+            point.payload = llm_text_payload(node, point.payload, self._payload_keys)
+
+        return points, ids
+
+
+def llm_text_payload(node: BaseNode, payload: dict, payload_keys: List[str]) -> dict:
+    """
+    Build the compact payload for a node
+    :param node: the node to store
+    :param payload: the full payload built by the vector store
+    :param payload_keys: metadata keys to keep in the payload, if the node has them
+    :return: the compact payload
+    """
+    compact = {
+        LLM_TEXT_KEY: node.get_content(MetadataMode.LLM),
+    }
+
+    for key in DOCUMENT_KEYS:
+        if key in payload:
+            compact[key] = payload[key]
+
+    for key in payload_keys:
+        if key in node.metadata:
+            compact[key] = node.metadata[key]
+
+    return compact
+
+
+async def search_llm_text(
+        aclient: AsyncQdrantClient,
+        collection_name: str,
+        query_embedding: list[float],
+        limit: int,
+        params: Optional[models.SearchParams] = None,
+) -> list[NodeWithScore]:
+    """
+    Search the collection, and build the results from the pre-rendered text,
+    without deserialising the stored nodes
+    :param aclient: the Qdrant client
+    :param collection_name: the collection to search
+    :param query_embedding: the embedded query
+    :param limit: the number of results to return
+    :param params: the search params, e.g. for rescoring quantized vectors
+    :return: text nodes containing the LLM text, with their similarity scores
+    """
+    response = await aclient.query_points(
+        collection_name=collection_name,
+        query=query_embedding,
+        limit=limit,
+        search_params=params,
+        # Only fetch the text we need
+        with_payload=[LLM_TEXT_KEY],
+    )
+
+    texts = {
+        point.id: point.payload[LLM_TEXT_KEY]
+        for point in response.points
+        if point.payload and LLM_TEXT_KEY in point.payload
+    }
+
+    # Points ingested before the text was pre-rendered
+    # need to be parsed and rendered here
+    missing = [point.id for point in response.points if point.id not in texts]
+    if missing:
+        records = await aclient.retrieve(collection_name, missing, with_payload=True)
+        for record in records:
+            node = metadata_dict_to_node(record.payload)
+            texts[record.id] = node.get_content(MetadataMode.LLM)
+
+    return [
+        NodeWithScore(
+            node=TextNode(id_=str(point.id), text=texts.get(point.id, "")),
+            score=point.score,
+        )
+        for point in response.points
+    ]
+
+
+async def stored_documents(
+        aclient: AsyncQdrantClient,
+        collection_name: str,
+        payload_keys: List[str],
+) -> dict[str, dict]:
+    """
+    List the documents already in the collection, used for incremental updates
+    :param aclient: the Qdrant client
+    :param collection_name: the collection to list
+    :param payload_keys: the payload fields to return for each document
+    :return: the payload of one chunk of each document, by document id
+    """
+    documents = {}
+
+    if not await aclient.collection_exists(collection_name):
+        return documents
+
+    offset = None
+    while True:
+        points, offset = await aclient.scroll(
+            collection_name,
+            limit=1024,
+            offset=offset,
+            with_payload=["doc_id"] + payload_keys,
+            with_vectors=False,
+        )
+        for point in points:
+            doc_id = (point.payload or {}).get("doc_id")
+            if doc_id is not None:
+                documents.setdefault(doc_id, point.payload)
+        if offset is None:
+            break
+
+    return documents